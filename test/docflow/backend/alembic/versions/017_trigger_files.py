@@ -0,0 +1,80 @@
+"""Move folder trigger seen-file state into trigger_files table
+
+Revision ID: 017
+Revises: 016
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+from sqlalchemy import inspect
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+
+
+# revision identifiers, used by Alembic.
+revision = "017"
+down_revision = "016"
+branch_labels = None
+depends_on = None
+
+
+def _has_column(table: str, column: str) -> bool:
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    columns = [c["name"] for c in inspector.get_columns(table)]
+    return column in columns
+
+
+def upgrade() -> None:
+    op.create_table(
+        "trigger_files",
+        sa.Column("id", UUID(as_uuid=True), primary_key=True, server_default=sa.text("gen_random_uuid()")),
+        sa.Column("trigger_id", UUID(as_uuid=True), sa.ForeignKey("triggers.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("path", sa.String(1000), nullable=False),
+        sa.Column("size", sa.BigInteger(), nullable=True),
+        sa.Column("mtime", sa.Float(), nullable=True),
+        sa.Column("content_hash", sa.String(64), nullable=True),
+        sa.Column("status", sa.String(20), nullable=False, server_default="pending"),
+        sa.Column("task_id", sa.String(255), nullable=True),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        sa.UniqueConstraint("trigger_id", "path", name="uq_trigger_files_trigger_path"),
+    )
+    op.create_index("ix_trigger_files_trigger_status", "trigger_files", ["trigger_id", "status"])
+    op.create_index("ix_trigger_files_trigger_hash", "trigger_files", ["trigger_id", "content_hash"])
+
+    if _has_column("triggers", "processed_files"):
+        # Previously processed names become finished rows without size/mtime;
+        # the scanner fills those in on the next pass without reprocessing.
+        op.execute(
+            """
+            INSERT INTO trigger_files (trigger_id, path, status)
+            SELECT DISTINCT t.id, f.name, 'done'
+            FROM triggers t
+            CROSS JOIN LATERAL jsonb_array_elements_text(t.processed_files) AS f(name)
+            ON CONFLICT (trigger_id, path) DO NOTHING
+            """
+        )
+        op.drop_column("triggers", "processed_files")
+
+
+def downgrade() -> None:
+    if not _has_column("triggers", "processed_files"):
+        op.add_column(
+            "triggers",
+            sa.Column("processed_files", JSONB, server_default="[]", nullable=False),
+        )
+    op.execute(
+        """
+        UPDATE triggers t
+        SET processed_files = COALESCE(
+            (SELECT jsonb_agg(f.path) FROM trigger_files f
+             WHERE f.trigger_id = t.id AND f.status IN ('done', 'skipped', 'error')),
+            '[]'::jsonb
+        )
+        """
+    )
+    op.drop_index("ix_trigger_files_trigger_hash", table_name="trigger_files")
+    op.drop_index("ix_trigger_files_trigger_status", table_name="trigger_files")
+    op.drop_table("trigger_files")
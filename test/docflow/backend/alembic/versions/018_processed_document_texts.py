@@ -0,0 +1,69 @@
+"""Move OCR text and blocks out of processed_documents.ocr_result
+
+Revision ID: 018
+Revises: 017
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+
+
+# revision identifiers, used by Alembic.
+revision = "018"
+down_revision = "017"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "processed_document_texts",
+        sa.Column(
+            "document_id",
+            UUID(as_uuid=True),
+            sa.ForeignKey("processed_documents.id", ondelete="CASCADE"),
+            primary_key=True,
+        ),
+        sa.Column("raw_text", sa.Text(), nullable=False, server_default=""),
+        sa.Column("raw_text_raw", sa.Text(), nullable=False, server_default=""),
+        sa.Column("json_content", JSONB, nullable=False, server_default="{}"),
+        sa.Column("created_at", sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime(), nullable=False, server_default=sa.func.now()),
+    )
+
+    op.execute(
+        """
+        INSERT INTO processed_document_texts (document_id, raw_text, raw_text_raw, json_content)
+        SELECT id,
+               COALESCE(ocr_result->>'raw_text', ''),
+               COALESCE(ocr_result->>'raw_text_raw', ''),
+               COALESCE(ocr_result->'json_content', '{}'::jsonb)
+        FROM processed_documents
+        WHERE ocr_result ?| array['raw_text', 'raw_text_raw', 'json_content']
+        """
+    )
+    op.execute(
+        """
+        UPDATE processed_documents
+        SET ocr_result = ocr_result - 'raw_text' - 'raw_text_raw' - 'json_content'
+        WHERE ocr_result ?| array['raw_text', 'raw_text_raw', 'json_content']
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        """
+        UPDATE processed_documents d
+        SET ocr_result = COALESCE(d.ocr_result, '{}'::jsonb) || jsonb_build_object(
+            'raw_text', t.raw_text,
+            'raw_text_raw', t.raw_text_raw,
+            'json_content', t.json_content
+        )
+        FROM processed_document_texts t
+        WHERE t.document_id = d.id
+        """
+    )
+    op.drop_table("processed_document_texts")
@@ -0,0 +1,161 @@
+"""Per-run document counters maintained by triggers on processed_documents
+
+Revision ID: 019
+Revises: 018
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+from sqlalchemy import inspect
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "019"
+down_revision = "018"
+branch_labels = None
+depends_on = None
+
+COUNTER_COLUMNS = (
+    "documents_total",
+    "documents_processing",
+    "documents_needs_review",
+    "documents_reviewed",
+    "documents_error",
+    "fields_extracted",
+)
+
+# Rows of the transition tables with +1 for new and -1 for old versions
+CHANGES = {
+    "INSERT": "SELECT processing_run_id, status, extracted_fields, 1 AS sign FROM new_rows",
+    "DELETE": "SELECT processing_run_id, status, extracted_fields, -1 AS sign FROM old_rows",
+    "UPDATE": (
+        "SELECT processing_run_id, status, extracted_fields, 1 AS sign FROM new_rows "
+        "UNION ALL "
+        "SELECT processing_run_id, status, extracted_fields, -1 AS sign FROM old_rows"
+    ),
+}
+
+APPLY_DELTA = """
+        WITH changes AS ({changes}),
+        delta AS (
+            SELECT processing_run_id AS run_id,
+                   sum(sign) AS total,
+                   COALESCE(sum(sign) FILTER (WHERE status = 'processing'), 0) AS processing,
+                   COALESCE(sum(sign) FILTER (WHERE status = 'needs_review'), 0) AS needs_review,
+                   COALESCE(sum(sign) FILTER (WHERE status = 'reviewed'), 0) AS reviewed,
+                   COALESCE(sum(sign) FILTER (WHERE status = 'error'), 0) AS error,
+                   sum(sign * CASE WHEN jsonb_typeof(extracted_fields) = 'array'
+                                   THEN jsonb_array_length(extracted_fields) ELSE 0 END) AS fields
+            FROM changes
+            GROUP BY processing_run_id
+        )
+        UPDATE processing_runs r
+        SET documents_total = r.documents_total + d.total,
+            documents_processing = r.documents_processing + d.processing,
+            documents_needs_review = r.documents_needs_review + d.needs_review,
+            documents_reviewed = r.documents_reviewed + d.reviewed,
+            documents_error = r.documents_error + d.error,
+            fields_extracted = r.fields_extracted + d.fields
+        FROM delta d
+        WHERE r.id = d.run_id
+          AND (d.total, d.processing, d.needs_review, d.reviewed, d.error, d.fields)
+              IS DISTINCT FROM (0, 0, 0, 0, 0, 0);
+"""
+
+
+def _has_column(table: str, column: str) -> bool:
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    columns = [c["name"] for c in inspector.get_columns(table)]
+    return column in columns
+
+
+def upgrade() -> None:
+    for column in COUNTER_COLUMNS:
+        if not _has_column("processing_runs", column):
+            op.add_column(
+                "processing_runs",
+                sa.Column(column, sa.Integer(), nullable=False, server_default="0"),
+            )
+
+    # Statement-level triggers: a bulk UPDATE of a whole run touches its
+    # counters once. Transition tables do not allow several events per
+    # trigger, so there is one trigger per event sharing the function.
+    op.execute(
+        f"""
+        CREATE OR REPLACE FUNCTION processing_run_counters() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                {APPLY_DELTA.format(changes=CHANGES["INSERT"])}
+            ELSIF TG_OP = 'DELETE' THEN
+                {APPLY_DELTA.format(changes=CHANGES["DELETE"])}
+            ELSE
+                {APPLY_DELTA.format(changes=CHANGES["UPDATE"])}
+            END IF;
+            RETURN NULL;
+        END;
+        $$
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER processed_documents_counters_insert
+        AFTER INSERT ON processed_documents
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION processing_run_counters()
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER processed_documents_counters_update
+        AFTER UPDATE ON processed_documents
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION processing_run_counters()
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER processed_documents_counters_delete
+        AFTER DELETE ON processed_documents
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION processing_run_counters()
+        """
+    )
+
+    # Backfill existing runs
+    op.execute(
+        """
+        UPDATE processing_runs r
+        SET documents_total = c.total,
+            documents_processing = c.processing,
+            documents_needs_review = c.needs_review,
+            documents_reviewed = c.reviewed,
+            documents_error = c.error,
+            fields_extracted = c.fields
+        FROM (
+            SELECT processing_run_id,
+                   count(*) AS total,
+                   count(*) FILTER (WHERE status = 'processing') AS processing,
+                   count(*) FILTER (WHERE status = 'needs_review') AS needs_review,
+                   count(*) FILTER (WHERE status = 'reviewed') AS reviewed,
+                   count(*) FILTER (WHERE status = 'error') AS error,
+                   sum(CASE WHEN jsonb_typeof(extracted_fields) = 'array'
+                            THEN jsonb_array_length(extracted_fields) ELSE 0 END) AS fields
+            FROM processed_documents
+            GROUP BY processing_run_id
+        ) c
+        WHERE r.id = c.processing_run_id
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS processed_documents_counters_delete ON processed_documents")
+    op.execute("DROP TRIGGER IF EXISTS processed_documents_counters_update ON processed_documents")
+    op.execute("DROP TRIGGER IF EXISTS processed_documents_counters_insert ON processed_documents")
+    op.execute("DROP FUNCTION IF EXISTS processing_run_counters()")
+    for column in reversed(COUNTER_COLUMNS):
+        if _has_column("processing_runs", column):
+            op.drop_column("processing_runs", column)
@@ -0,0 +1,69 @@
+"""Composite indexes for run lists, document lookups, tokens and trigger scans
+
+Revision ID: 020
+Revises: 019
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+from sqlalchemy import inspect
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "020"
+down_revision = "019"
+branch_labels = None
+depends_on = None
+
+# name, table, columns, partial index condition
+INDEXES = (
+    ("ix_processing_runs_user_created", "processing_runs", ["user_id", "created_at", "id"], None),
+    ("ix_processing_runs_type_created", "processing_runs", ["document_type_id", "created_at", "id"], None),
+    ("ix_processing_runs_created", "processing_runs", ["created_at", "id"], None),
+    ("ix_processed_documents_run_id", "processed_documents", ["processing_run_id"], None),
+    ("ix_users_api_token", "users", ["api_token"], None),
+    ("ix_triggers_enabled", "triggers", ["id"], "enabled AND folder IS NOT NULL"),
+    ("ix_triggers_user_created", "triggers", ["user_id", "created_at"], None),
+)
+
+# Prefixes of the composite indexes above
+REDUNDANT = (
+    ("ix_processing_runs_user_id", "processing_runs", ["user_id"]),
+    ("ix_processing_runs_created_at", "processing_runs", ["created_at"]),
+    ("ix_triggers_user_id", "triggers", ["user_id"]),
+)
+
+
+def _has_index(table: str, name: str) -> bool:
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    return name in {index["name"] for index in inspector.get_indexes(table)}
+
+
+def upgrade() -> None:
+    for name, table, columns, where in INDEXES:
+        if not _has_index(table, name):
+            op.create_index(
+                name,
+                table,
+                columns,
+                postgresql_where=sa.text(where) if where else None,
+            )
+    for name, table, _ in REDUNDANT:
+        if _has_index(table, name):
+            op.drop_index(name, table_name=table)
+    op.execute("ANALYZE processing_runs")
+    op.execute("ANALYZE processed_documents")
+
+
+def downgrade() -> None:
+    for name, table, columns in REDUNDANT:
+        if not _has_index(table, name):
+            op.create_index(name, table, columns)
+    # ix_processed_documents_run_id and ix_users_api_token predate this revision
+    for name, table, _, _ in INDEXES:
+        if name in ("ix_processed_documents_run_id", "ix_users_api_token"):
+            continue
+        if _has_index(table, name):
+            op.drop_index(name, table_name=table)
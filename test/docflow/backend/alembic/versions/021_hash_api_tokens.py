@@ -0,0 +1,31 @@
+"""Store API tokens as sha256 digests
+
+Revision ID: 021
+Revises: 020
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "021"
+down_revision = "020"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Issued tokens keep working: clients send the token, the server compares digests.
+    op.execute(
+        """
+        UPDATE users
+        SET api_token = encode(sha256(convert_to(api_token, 'UTF8')), 'hex')
+        WHERE api_token IS NOT NULL
+        """
+    )
+
+
+def downgrade() -> None:
+    # Digests cannot be turned back into tokens; users log in again.
+    op.execute("UPDATE users SET api_token = NULL")
@@ -0,0 +1,41 @@
+"""Index processed documents by (run, created_at, id) for keyset export
+
+Revision ID: 022
+Revises: 021
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision = "022"
+down_revision = "021"
+branch_labels = None
+depends_on = None
+
+
+def _has_index(table: str, name: str) -> bool:
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    return name in {index["name"] for index in inspector.get_indexes(table)}
+
+
+def upgrade() -> None:
+    if not _has_index("processed_documents", "ix_processed_documents_run_created"):
+        op.create_index(
+            "ix_processed_documents_run_created",
+            "processed_documents",
+            ["processing_run_id", "created_at", "id"],
+        )
+    # Prefix of the new index
+    if _has_index("processed_documents", "ix_processed_documents_run_id"):
+        op.drop_index("ix_processed_documents_run_id", table_name="processed_documents")
+
+
+def downgrade() -> None:
+    if not _has_index("processed_documents", "ix_processed_documents_run_id"):
+        op.create_index("ix_processed_documents_run_id", "processed_documents", ["processing_run_id"])
+    if _has_index("processed_documents", "ix_processed_documents_run_created"):
+        op.drop_index("ix_processed_documents_run_created", table_name="processed_documents")
@@ -0,0 +1,52 @@
+"""Few-shot example store
+
+Revision ID: 023
+Revises: 022
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+
+
+# revision identifiers, used by Alembic.
+revision = "023"
+down_revision = "022"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Filled by the refresh task (snippets and embeddings are rendered in Python);
+    # types without examples are rebuilt on first use.
+    op.create_table(
+        "few_shot_examples",
+        sa.Column(
+            "document_id",
+            UUID(as_uuid=True),
+            sa.ForeignKey("processed_documents.id", ondelete="CASCADE"),
+            primary_key=True,
+        ),
+        sa.Column(
+            "document_type_id",
+            UUID(as_uuid=True),
+            sa.ForeignKey("type_of_documents.id", ondelete="CASCADE"),
+            nullable=False,
+        ),
+        sa.Column("filename", sa.String(500), nullable=False),
+        sa.Column("snippet", sa.Text(), nullable=False),
+        sa.Column("embedding", JSONB, nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime(), nullable=False, server_default=sa.func.now()),
+    )
+    op.create_index(
+        "ix_few_shot_examples_type_updated",
+        "few_shot_examples",
+        ["document_type_id", "updated_at"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_few_shot_examples_type_updated", table_name="few_shot_examples")
+    op.drop_table("few_shot_examples")
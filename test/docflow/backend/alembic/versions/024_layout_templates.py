@@ -0,0 +1,38 @@
+"""Layout templates learned from reviewed documents
+
+Revision ID: 024
+Revises: 023
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+
+
+# revision identifiers, used by Alembic.
+revision = "024"
+down_revision = "023"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Trained by a Celery task; types without a row are trained on first use.
+    op.create_table(
+        "layout_templates",
+        sa.Column(
+            "document_type_id",
+            UUID(as_uuid=True),
+            sa.ForeignKey("type_of_documents.id", ondelete="CASCADE"),
+            primary_key=True,
+        ),
+        sa.Column("template", JSONB, nullable=False, server_default="{}"),
+        sa.Column("documents", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("created_at", sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime(), nullable=False, server_default=sa.func.now()),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("layout_templates")
@@ -0,0 +1,28 @@
+"""Count failed processing attempts of trigger files
+
+Revision ID: 025
+Revises: 024
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "025"
+down_revision = "024"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Existing failures keep 0 attempts: they are not retried retroactively
+    op.add_column(
+        "trigger_files",
+        sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("trigger_files", "attempts")
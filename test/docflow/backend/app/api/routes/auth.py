@@ -47,5 +47,5 @@ def me(current_user=Depends(get_current_user)):
 
 @router.post("/logout")
 def logout(current_user=Depends(get_current_user), db: Session = Depends(get_db)):
-    user_crud.clear_token(db, current_user)
+    user_crud.clear_token(db, current_user.id)
     return {"success": True}
@@ -7,6 +7,7 @@ from app.core.database import get_db
 from app.core.security import get_current_user, require_admin
 from app.models.user import UserRole
 from app.crud import document_type as document_type_crud
+from app.services.layout_templates import layout_templates
 from app.schemas.document_type import (
     DocumentTypeResponse,
     DocumentTypeListResponse,
@@ -58,6 +59,31 @@ def get_document_type(document_type_id: UUID, db: Session = Depends(get_db), cur
     return doc_type
 
 
+@router.get("/{document_type_id}/layout-template")
+def get_layout_template(document_type_id: UUID, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+    """Learned extraction rules of the type, their precision, and template hit rate / latency per document."""
+    doc_type = document_type_crud.get_document_type(db, document_type_id)
+    if not doc_type:
+        raise HTTPException(status_code=404, detail="Document type not found")
+    if current_user.role != UserRole.ADMIN and doc_type.user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Access denied")
+    template = layout_templates.describe(str(document_type_id))
+    if template is None:
+        raise HTTPException(status_code=404, detail="Layout template not trained yet")
+    return template
+
+
+@router.post("/{document_type_id}/layout-template/train", status_code=202)
+def train_layout_template(document_type_id: UUID, db: Session = Depends(get_db), current_user=Depends(require_admin)):
+    from app.tasks.layout_template_tasks import train_layout_template_task
+
+    doc_type = document_type_crud.get_document_type(db, document_type_id)
+    if not doc_type:
+        raise HTTPException(status_code=404, detail="Document type not found")
+    task = train_layout_template_task.delay(str(document_type_id))
+    return {"task_id": task.id}
+
+
 @router.post("", response_model=DocumentTypeResponse)
 def create_document_type(
     payload: DocumentTypeCreate,
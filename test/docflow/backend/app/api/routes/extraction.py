@@ -1,10 +1,12 @@
 import os
 import json
 import io
+import mimetypes
 import tempfile
 import shutil
 from pathlib import Path
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from uuid import UUID
@@ -15,8 +17,8 @@ from celery.result import AsyncResult
 from app.core.database import get_db
 from app.core.security import get_current_user
 from app.core.config import settings
-from app.core.celery_app import celery_app
-from app.services import ocr_service
+from app.core.celery_app import celery_app, PRIORITY_BULK, PRIORITY_INTERACTIVE
+from app.services import ocr_service, task_registry
 from app.services.semantic_index_service import semantic_index_service
 from app.crud import processing_run as run_crud
 from app.crud import document_type as document_type_crud
@@ -30,9 +32,14 @@ from app.schemas.processing_run import ProcessingSource
 from app.models.processed_document import DocumentStatus
 from app.models.processing_run import ProcessingStatus
 from app.models.user import UserRole
+from app.services.bulk_upload import BulkIngest
+from app.services.context_builder import collect_stats as collect_context_stats
+from app.services.highlight_service import get_page_highlight_key, pick_preview_variant, save_page_images
+from app.services.llm_pool import collect_metrics
 from app.services.llm_service import llm_service
 from app.services.storage_service import storage_service
-from app.tasks.document_tasks import process_document_task
+from app.tasks.document_tasks import batch_process_documents_task, batch_time_limits, process_document_task
+from app.tasks.render_tasks import enqueue_preview_rendering
 
 router = APIRouter(tags=["extraction"])
 
@@ -43,20 +50,6 @@ def allowed_file(filename: str) -> bool:
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in settings.ALLOWED_EXTENSIONS
 
 
-def _save_preview_image(result: dict, storage_prefix: str, original_name: str) -> str | None:
-    """Save first page image as preview and return object key."""
-    page_images = result.get("pageImages", [])
-    if not page_images:
-        return None
-    first_page = page_images[0]
-    if not os.path.exists(first_page) or first_page.endswith('.txt'):
-        return None
-    preview_filename = f"{original_name}_preview.png"
-    preview_key = storage_service.build_key(storage_prefix, preview_filename)
-    storage_service.save_file(first_page, preview_key, content_type="image/png")
-    return preview_key
-
-
 def _cleanup_ocr_temp(result: dict):
     """Cleanup temp directory created by OCR for PDF/Word conversion."""
     temp_dir = result.get("_temp_dir")
@@ -208,8 +201,9 @@ async def extract_and_save(
             result = ocr_service.extract_document(temp_filepath, fields_to_extract, document_type_id=str(document_type_id))
 
             try:
-                # Save preview image for PDF/Word documents
-                preview_path = _save_preview_image(result, storage_prefix, original_name)
+                # Save page images; the first page doubles as the full-size preview
+                page_image_keys = save_page_images(result.get("pageImages", []), storage_prefix, original_name)
+                preview_path = page_image_keys[0] if page_image_keys else None
 
                 extracted_fields = [
                     {
@@ -219,6 +213,7 @@ async def extract_and_save(
                         "coordinate": f.get("coordinate"),
                         "group": f.get("group"),
                         "row_index": f.get("row_index"),
+                        "page_index": f.get("page_index"),
                         "original_value": f["value"],
                         "is_corrected": False,
                     }
@@ -231,6 +226,7 @@ async def extract_and_save(
                     "json_content": result.get("jsonContent", {}),
                     "highlighted_image": None,
                     "preview_image": preview_path,
+                    "page_images": page_image_keys,
                 }
 
                 run_crud.update_document_extraction_results(
@@ -240,6 +236,7 @@ async def extract_and_save(
                     extracted_fields=extracted_fields,
                     status=DocumentStatus.NEEDS_REVIEW,
                 )
+                enqueue_preview_rendering(document.id)
 
                 raw_text = result.get("rawText", "")
                 if raw_text:
@@ -384,8 +381,9 @@ async def extract_and_save_auto(
                 storage_key = storage_service.find_available_key([storage_prefix], file.filename)
                 storage_service.save_file(temp_filepath, storage_key, content_type=file.content_type)
 
-                # Save preview image for PDF/Word documents
-                preview_path = _save_preview_image(result, storage_prefix, original_name)
+                # Save page images; the first page doubles as the full-size preview
+                page_image_keys = save_page_images(result.get("pageImages", []), storage_prefix, original_name)
+                preview_path = page_image_keys[0] if page_image_keys else None
 
                 document = run_crud.create_processed_document(
                     db,
@@ -415,6 +413,7 @@ async def extract_and_save_auto(
                         "coordinate": f.get("coordinate"),
                         "group": f.get("group"),
                         "row_index": f.get("row_index"),
+                        "page_index": f.get("page_index"),
                         "original_value": f["value"],
                         "is_corrected": False,
                     }
@@ -427,6 +426,7 @@ async def extract_and_save_auto(
                     "json_content": result.get("jsonContent", {}),
                     "highlighted_image": None,
                     "preview_image": preview_path,
+                    "page_images": page_image_keys,
                 }
 
                 run_crud.update_document_extraction_results(
@@ -436,6 +436,7 @@ async def extract_and_save_auto(
                     extracted_fields=extracted_fields_payload,
                     status=DocumentStatus.NEEDS_REVIEW,
                 )
+                enqueue_preview_rendering(document.id)
 
                 raw_text = result.get("rawText", "")
                 if raw_text:
@@ -515,29 +516,79 @@ def get_document_file(
 @router.get("/documents/{document_id}/preview")
 def get_document_preview(
     document_id: UUID,
+    width: Optional[int] = Query(default=None, ge=1),
     db: Session = Depends(get_db),
     current_user=Depends(get_current_user),
 ):
-    """Return a preview PNG image for PDF/Word documents."""
+    """
+    Return a preview image of the first page.
+    With `width`, serves the smallest pre-rendered variant at least that wide.
+    """
     document = run_crud.get_processed_document(db, document_id)
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     if current_user.role != UserRole.ADMIN and document.processing_run.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Access denied")
 
-    preview_path_rel = (document.ocr_result or {}).get("preview_image")
-    if not preview_path_rel:
+    ocr_result = document.ocr_result or {}
+    preview_key = None
+    if width is not None:
+        preview_key = pick_preview_variant(ocr_result.get("preview_variants") or {}, width)
+    preview_key = preview_key or ocr_result.get("preview_image")
+    if not preview_key:
         raise HTTPException(status_code=404, detail="Preview not available")
 
     try:
-        preview_bytes = storage_service.read_bytes(preview_path_rel)
+        body = storage_service.iter_bytes(preview_key)
     except Exception:
         raise HTTPException(status_code=404, detail="Preview file not found")
 
+    extension = Path(preview_key).suffix or ".png"
     return StreamingResponse(
-        io.BytesIO(preview_bytes),
-        media_type="image/png",
-        headers={"Content-Disposition": f'inline; filename="{Path(document.filename).stem}_preview.png"'},
+        body,
+        media_type=mimetypes.guess_type(preview_key)[0] or "image/png",
+        headers={
+            "Content-Disposition": f'inline; filename="{Path(document.filename).stem}_preview{extension}"',
+            "Cache-Control": "private, max-age=3600",
+        },
+    )
+
+
+@router.get("/documents/{document_id}/highlighted")
+def get_document_highlighted_page(
+    document_id: UUID,
+    page: int = Query(default=0, ge=0),
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user),
+):
+    """Return one page with extracted fields highlighted, rendered on first request."""
+    document = run_crud.get_processed_document(db, document_id)
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if current_user.role != UserRole.ADMIN and document.processing_run.user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    try:
+        image_key = get_page_highlight_key(document, page)
+    except Exception as e:
+        print(f"Failed to render highlighted page {page} for document {document_id}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to render highlighted page")
+    if not image_key:
+        raise HTTPException(status_code=404, detail="Page not available")
+
+    try:
+        body = storage_service.iter_bytes(image_key)
+    except Exception:
+        raise HTTPException(status_code=404, detail="Page image not found")
+
+    media_type = mimetypes.guess_type(image_key)[0] or "image/png"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'inline; filename="{Path(image_key).name}"',
+            "Cache-Control": "private, max-age=3600",
+        },
     )
 
 
@@ -558,7 +609,7 @@ async def query_document(
     if not llm_service.is_configured:
         raise HTTPException(status_code=503, detail="LLM service not configured")
 
-    raw_text = (document.ocr_result or {}).get("raw_text", "")
+    raw_text = run_crud.get_document_raw_text(db, document.id)
     if not raw_text:
         raise HTTPException(status_code=400, detail="Document has no extracted text")
 
@@ -700,16 +751,20 @@ async def extract_and_save_async(
             status=DocumentStatus.PROCESSING,
         )
 
-        task = process_document_task.delay(
-            document_id=str(document.id),
-            processing_run_id=str(processing_run.id),
-            document_type_id=str(document_type_id),
-            temp_filepath=temp_filepath,
-            original_filename=file.filename,
-            file_size=file_size,
-            mime_type=file.content_type,
-            fields_to_extract=fields_to_extract,
-            user_id=str(current_user.id),
+        task = process_document_task.apply_async(
+            kwargs=dict(
+                document_id=str(document.id),
+                processing_run_id=str(processing_run.id),
+                document_type_id=str(document_type_id),
+                temp_filepath=temp_filepath,
+                original_filename=file.filename,
+                file_size=file_size,
+                mime_type=file.content_type,
+                fields_to_extract=fields_to_extract,
+                user_id=str(current_user.id),
+            ),
+            # Someone is waiting for this one, unless it came from a trigger
+            priority=PRIORITY_BULK if source == ProcessingSource.TRIGGER else PRIORITY_INTERACTIVE,
         )
 
         return {
@@ -731,6 +786,115 @@ async def extract_and_save_async(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/document-type/{document_type_id}/extract-bulk", status_code=202)
+async def extract_bulk(
+    document_type_id: UUID,
+    files: list[UploadFile] = File(...),
+    source: ProcessingSource = ProcessingSource.MANUAL,
+    trigger_name: Optional[str] = None,
+    processing_run_id: Optional[str] = Form(default=None),
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user),
+):
+    """
+    Upload many files (or ZIP/TAR archives of files) into one run and process
+    them as one batch. Returns as soon as the files are stored.
+    """
+    document_type = document_type_crud.get_document_type(db, document_type_id)
+    if not document_type:
+        raise HTTPException(status_code=404, detail="Document type not found")
+
+    if processing_run_id:
+        processing_run = run_crud.get_processing_run(db, UUID(processing_run_id))
+        if not processing_run:
+            raise HTTPException(status_code=404, detail="Processing run not found")
+        if current_user.role != UserRole.ADMIN and processing_run.user_id != current_user.id:
+            raise HTTPException(status_code=403, detail="Access denied")
+        if processing_run.document_type_id != document_type_id:
+            raise HTTPException(status_code=400, detail="Processing run has another document type")
+
+    ingest = BulkIngest()
+    handed_over = False
+    created_run_id = None
+    document_ids: list[UUID] = []
+    try:
+        for upload in files:
+            await run_in_threadpool(ingest.add_upload, upload.filename, upload.file, upload.content_type)
+        if not ingest.files:
+            raise HTTPException(status_code=400, detail={"message": "No files to process", "skipped": ingest.skipped})
+
+        if not processing_run_id:
+            processing_run = run_crud.create_processing_run(
+                db, document_type_id, source, trigger_name, user_id=current_user.id
+            )
+            # Keys are allocated under the run id, so the run exists before the upload
+            created_run_id = processing_run.id
+            taken = []
+        else:
+            taken = run_crud.get_document_file_paths(db, processing_run.id)
+
+        ingest.allocate_keys([str(document_type_id), str(processing_run.id)], taken)
+        uploaded = await run_in_threadpool(ingest.upload_all)
+        if not uploaded:
+            raise HTTPException(status_code=502, detail={"message": "Storage upload failed", "skipped": ingest.skipped})
+
+        document_ids = run_crud.bulk_create_processed_documents(
+            db,
+            processing_run.id,
+            [
+                {
+                    "filename": item.filename,
+                    "file_path": item.storage_key,
+                    "file_size": item.file_size,
+                    "mime_type": item.mime_type,
+                }
+                for item in uploaded
+            ],
+        )
+
+        documents = [
+            {
+                "document_id": str(document_id),
+                "temp_filepath": item.temp_path,
+                "original_filename": item.filename,
+                "file_size": item.file_size,
+                "mime_type": item.mime_type,
+            }
+            for document_id, item in zip(document_ids, uploaded)
+        ]
+        task = batch_process_documents_task.apply_async(
+            args=(str(document_type_id), str(processing_run.id), documents, str(current_user.id)),
+            **batch_time_limits(len(documents)),
+        )
+        handed_over = True
+
+        return {
+            "success": True,
+            "async": True,
+            "task_id": task.id,
+            "processing_run_id": str(processing_run.id),
+            "documents": [
+                {"document_id": doc["document_id"], "filename": doc["original_filename"]}
+                for doc in documents
+            ],
+            "skipped": ingest.skipped,
+            "status": "processing",
+        }
+    finally:
+        if not handed_over:
+            # Nothing reached the batch task: undo what this request stored
+            try:
+                db.rollback()
+                if created_run_id:
+                    run_crud.delete_processing_run(db, created_run_id)
+                elif document_ids:
+                    run_crud.delete_processed_documents(db, document_ids)
+            except Exception as e:
+                print(f"Failed to remove the records of a failed bulk upload: {e}")
+            ingest.delete_uploaded()
+            ingest.cleanup()
+
+
 @router.get("/tasks/{task_id}/status")
 def get_task_status(
     task_id: str,
@@ -753,34 +917,20 @@ def get_task_status(
     return response
 
 
+@router.get("/tasks/llm-metrics")
+def get_llm_metrics(current_user=Depends(get_current_user)):
+    """
+    In-flight/waiting LLM requests per worker, the LLM task queue length and
+    document tokens vs. tokens sent in prompts (per purpose).
+    """
+    return {**collect_metrics(), "context": collect_context_stats()}
+
+
 @router.get("/tasks/pending")
 def get_pending_tasks(
     limit: int = Query(default=10, le=100),
     current_user=Depends(get_current_user),
 ):
-    inspect = celery_app.control.inspect()
-
-    active = inspect.active() or {}
-    reserved = inspect.reserved() or {}
-
-    tasks = []
-
-    for worker, worker_tasks in active.items():
-        for task in worker_tasks:
-            tasks.append({
-                "task_id": task.get("id"),
-                "name": task.get("name"),
-                "status": "active",
-                "worker": worker,
-            })
-
-    for worker, worker_tasks in reserved.items():
-        for task in worker_tasks:
-            tasks.append({
-                "task_id": task.get("id"),
-                "name": task.get("name"),
-                "status": "reserved",
-                "worker": worker,
-            })
-
-    return {"tasks": tasks[:limit], "total": len(tasks)}
+    # Redis registry kept by Celery signals; no broadcast to the workers.
+    tasks, total = task_registry.list_tasks(limit)
+    return {"tasks": tasks, "total": total}
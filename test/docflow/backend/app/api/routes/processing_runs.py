@@ -1,6 +1,4 @@
-import csv
-import io
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from uuid import UUID
@@ -12,6 +10,10 @@ from app.models.user import UserRole
 from app.crud import processing_run as run_crud
 from app.crud import document_type as document_type_crud
 from app.crud import user as user_crud
+from app.crud.pagination import next_cursor
+from app.services import export_service, progress
+from app.services.few_shot_store import few_shot_store
+from app.tasks.few_shot_tasks import enqueue_few_shot_refresh
 from app.schemas.processing_run import (
     ProcessingRunResponse,
     ProcessingRunDetailResponse,
@@ -31,13 +33,17 @@ router = APIRouter(prefix="/processing-runs", tags=["processing-runs"])
 def list_processing_runs(
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
     user_id: Optional[UUID] = Query(None),
     db: Session = Depends(get_db),
     current_user=Depends(get_current_user),
 ):
     effective_user_id = user_id if current_user.role == UserRole.ADMIN else current_user.id
-    runs, total = run_crud.get_processing_runs(db, skip, limit, effective_user_id)
-    return ProcessingRunListResponse(items=runs, total=total)
+    try:
+        runs, total = run_crud.get_processing_runs(db, skip, limit, effective_user_id, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return ProcessingRunListResponse(items=runs, total=total, next_cursor=next_cursor(runs, limit))
 
 
 @router.get("/by-document-type/{document_type_id}", response_model=ProcessingRunListResponse)
@@ -45,6 +51,7 @@ def get_processing_runs_by_document_type(
     document_type_id: UUID,
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
     user_id: Optional[UUID] = Query(None),
     db: Session = Depends(get_db),
     current_user=Depends(get_current_user),
@@ -54,13 +61,18 @@ def get_processing_runs_by_document_type(
         raise HTTPException(status_code=404, detail="Document type not found")
 
     effective_user_id = user_id if current_user.role == UserRole.ADMIN else current_user.id
-    runs, total = run_crud.get_processing_runs_by_document_type(db, document_type_id, skip, limit, effective_user_id)
-    return ProcessingRunListResponse(items=runs, total=total)
+    try:
+        runs, total = run_crud.get_processing_runs_by_document_type(
+            db, document_type_id, skip, limit, effective_user_id, cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return ProcessingRunListResponse(items=runs, total=total, next_cursor=next_cursor(runs, limit))
 
 
 @router.get("/{run_id}", response_model=ProcessingRunDetailResponse)
 def get_processing_run(run_id: UUID, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
-    run = run_crud.get_processing_run(db, run_id)
+    run = run_crud.get_processing_run_detail(db, run_id)
     if not run:
         raise HTTPException(status_code=404, detail="Processing run not found")
     if current_user.role != UserRole.ADMIN and run.user_id != current_user.id:
@@ -68,6 +80,42 @@ def get_processing_run(run_id: UUID, db: Session = Depends(get_db), current_user
     return run
 
 
+@router.get("/{run_id}/events")
+def stream_processing_run_events(
+    run_id: UUID,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user),
+):
+    """
+    Server-Sent Events with the progress of a run. Starts with a "snapshot"
+    event (run and document statuses), then the last event of every document
+    and live "progress" events published by the workers.
+    """
+    run = run_crud.get_processing_run_summary(db, run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Processing run not found")
+    if current_user.role != UserRole.ADMIN and run.user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    initial = [{
+        "event": "snapshot",
+        "run_id": str(run.id),
+        "status": run.status.value,
+        "documents": [
+            {"document_id": str(doc.id), "filename": doc.filename, "status": doc.status.value}
+            for doc in run.documents
+        ],
+    }]
+    initial.extend(progress.snapshot(str(run.id)))
+
+    return StreamingResponse(
+        progress.stream(str(run.id), initial, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.post("/{document_type_id}", response_model=ProcessingRunResponse, status_code=201)
 def create_processing_run(
     document_type_id: UUID,
@@ -103,9 +151,12 @@ def delete_processing_run(run_id: UUID, db: Session = Depends(get_db), current_u
         raise HTTPException(status_code=404, detail="Processing run not found")
     if current_user.role != UserRole.ADMIN and run.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Access denied")
+    document_type_id = run.document_type_id
     success = run_crud.delete_processing_run(db, run_id)
     if not success:
         raise HTTPException(status_code=404, detail="Processing run not found")
+    # Its examples are deleted by the cascade
+    few_shot_store.invalidate([document_type_id])
     return None
 
 
@@ -147,6 +198,7 @@ def update_processing_run_document_type(
     run = run_crud.update_processing_run_document_type(db, run_id, payload.document_type_id)
     if not run:
         raise HTTPException(status_code=404, detail="Processing run not found")
+    enqueue_few_shot_refresh(run_id=run_id)
     return run
 
 
@@ -160,6 +212,7 @@ def mark_run_as_reviewed(run_id: UUID, db: Session = Depends(get_db), current_us
     run = run_crud.mark_run_as_reviewed(db, run_id)
     if not run:
         raise HTTPException(status_code=404, detail="Processing run not found")
+    enqueue_few_shot_refresh(run_id=run_id)
     return run
 
 
@@ -173,6 +226,7 @@ def cancel_run_review(run_id: UUID, db: Session = Depends(get_db), current_user=
     run = run_crud.cancel_run_review(db, run_id)
     if not run:
         raise HTTPException(status_code=404, detail="Processing run not found")
+    enqueue_few_shot_refresh(run_id=run_id)
     return run
 
 
@@ -200,9 +254,12 @@ def update_document_status(
         raise HTTPException(status_code=404, detail="Document not found")
     if current_user.role != UserRole.ADMIN and doc.processing_run.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Access denied")
-    doc = run_crud.update_document_status(db, document_id, doc_status)
-    if not doc:
+    run_id = run_crud.update_document_status(db, document_id, doc_status, commit=False)
+    if not run_id:
         raise HTTPException(status_code=404, detail="Document not found")
+    run_crud.refresh_processing_run_status(db, run_id, commit=False)
+    db.commit()
+    enqueue_few_shot_refresh([document_id])
     return {"status": "updated"}
 
 
@@ -216,6 +273,7 @@ def mark_document_reviewed(document_id: UUID, db: Session = Depends(get_db), cur
     doc = run_crud.mark_document_reviewed(db, document_id)
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
+    enqueue_few_shot_refresh([document_id])
     return {
         **ProcessedDocumentResponse.from_orm(doc).dict(),
         "run_status": doc.processing_run.status.value if doc.processing_run else None,
@@ -232,6 +290,7 @@ def cancel_document_review(document_id: UUID, db: Session = Depends(get_db), cur
     doc = run_crud.cancel_document_review(db, document_id)
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
+    enqueue_few_shot_refresh([document_id])
     return {
         **ProcessedDocumentResponse.from_orm(doc).dict(),
         "run_status": doc.processing_run.status.value if doc.processing_run else None,
@@ -263,41 +322,52 @@ def update_extracted_field(
     doc = run_crud.update_extracted_field(db, document_id, field_data.field_index, field_data.value)
     if not doc:
         raise HTTPException(status_code=404, detail="Document or field not found")
+    enqueue_few_shot_refresh([document_id])
     return doc
 
 
-def _build_export_rows(run, export_keys: dict) -> tuple[list[str], list[list[str]]]:
-    """Build header + rows from a processing run's documents."""
-    # Collect all field names across documents
-    all_field_names: list[str] = []
-    seen: set[str] = set()
-    for doc in run.documents:
-        for field in (doc.extracted_fields or []):
-            name = field.get("name", "")
-            if name and name not in seen:
-                all_field_names.append(name)
-                seen.add(name)
-
-    # Apply export_keys mapping: field_name -> export_key
-    headers = ["Файл"]
-    for name in all_field_names:
-        headers.append(export_keys.get(name, name))
-
-    rows: list[list[str]] = []
-    for doc in run.documents:
-        field_map = {f["name"]: f["value"] for f in (doc.extracted_fields or [])}
-        row = [doc.filename]
-        for name in all_field_names:
-            row.append(str(field_map.get(name, "")))
-        rows.append(row)
+def _export_response(
+    db: Session,
+    run_ids: list[UUID],
+    document_type,
+    format: str,
+    table: Optional[str] = None,
+) -> StreamingResponse:
+    """
+    Stream the documents of the runs. XLSX: documents sheet plus a sheet per
+    table group. CSV: the documents table, or the rows of one table group.
+    """
+    export_keys = (document_type.export_keys or {}) if document_type else {}
+    safe_name = export_service.safe_filename(document_type.name if document_type else None)
+    # Columns are computed in SQL first: rows are streamed and cannot be re-read
+    field_names, table_columns = run_crud.get_export_columns(db, run_ids)
+    sheets = export_service.build_sheets(safe_name, field_names, table_columns, export_keys)
 
-    return headers, rows
+    if format == "csv":
+        if table is not None:
+            sheets = [sheet for sheet in sheets if sheet.group == table]
+            if not sheets:
+                raise HTTPException(status_code=404, detail=f"Table '{table}' not found in the documents")
+            safe_name = export_service.safe_filename(f"{safe_name} {table}")
+        else:
+            sheets = sheets[:1]
+        return StreamingResponse(
+            export_service.csv_stream(sheets[0].headers, export_service.iter_rows(run_ids, field_names, sheets)),
+            media_type=export_service.CSV_MEDIA_TYPE,
+            headers={"Content-Disposition": export_service.content_disposition(safe_name, "csv")},
+        )
+    return StreamingResponse(
+        export_service.xlsx_stream(sheets, export_service.iter_rows(run_ids, field_names, sheets)),
+        media_type=export_service.XLSX_MEDIA_TYPE,
+        headers={"Content-Disposition": export_service.content_disposition(safe_name, "xlsx")},
+    )
 
 
 @router.get("/{run_id}/export")
 def export_processing_run(
     run_id: UUID,
     format: str = Query("xlsx", regex="^(xlsx|csv)$"),
+    table: Optional[str] = Query(None, description="CSV only: export the rows of this table group"),
     db: Session = Depends(get_db),
     current_user=Depends(get_current_user),
 ):
@@ -306,85 +376,29 @@ def export_processing_run(
         raise HTTPException(status_code=404, detail="Processing run not found")
     if current_user.role != UserRole.ADMIN and run.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Access denied")
-
-    document_type = run.document_type
-    export_keys = (document_type.export_keys or {}) if document_type else {}
-    type_name = document_type.name if document_type else "export"
-    safe_name = "".join(c if c.isalnum() or c in "._- " else "_" for c in type_name)
-
-    headers, rows = _build_export_rows(run, export_keys)
-
-    if not rows:
+    if not run.documents_total:
         raise HTTPException(status_code=404, detail="No documents to export")
 
-    if format == "csv":
-        output = io.StringIO()
-        output.write("\ufeff")  # BOM for Excel compatibility
-        writer = csv.writer(output)
-        writer.writerow(headers)
-        writer.writerows(rows)
-        content = output.getvalue().encode("utf-8")
-        return StreamingResponse(
-            io.BytesIO(content),
-            media_type="text/csv; charset=utf-8",
-            headers={"Content-Disposition": f'attachment; filename="{safe_name}.csv"'},
-        )
+    return _export_response(db, [run.id], run.document_type, format, table)
 
-    # Excel (xlsx)
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = safe_name[:31]  # Excel sheet name max 31 chars
-
-    # Header style
-    header_font = Font(bold=True, color="FFFFFF", size=11)
-    header_fill = PatternFill(start_color="107572", end_color="107572", fill_type="solid")
-    header_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    thin_border = Border(
-        left=Side(style="thin", color="DEE2E6"),
-        right=Side(style="thin", color="DEE2E6"),
-        top=Side(style="thin", color="DEE2E6"),
-        bottom=Side(style="thin", color="DEE2E6"),
-    )
 
-    # Write headers
-    for col_idx, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col_idx, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = header_alignment
-        cell.border = thin_border
-
-    # Write data
-    data_alignment = Alignment(vertical="center", wrap_text=True)
-    alt_fill = PatternFill(start_color="F8F9FA", end_color="F8F9FA", fill_type="solid")
-    for row_idx, row_data in enumerate(rows, 2):
-        for col_idx, value in enumerate(row_data, 1):
-            cell = ws.cell(row=row_idx, column=col_idx, value=value)
-            cell.alignment = data_alignment
-            cell.border = thin_border
-            if row_idx % 2 == 0:
-                cell.fill = alt_fill
-
-    # Auto-width columns
-    for col_idx in range(1, len(headers) + 1):
-        max_len = len(str(headers[col_idx - 1]))
-        for row_data in rows:
-            val_len = len(str(row_data[col_idx - 1])) if col_idx - 1 < len(row_data) else 0
-            max_len = max(max_len, val_len)
-        ws.column_dimensions[ws.cell(row=1, column=col_idx).column_letter].width = min(max_len + 4, 60)
-
-    # Freeze header row
-    ws.freeze_panes = "A2"
-
-    buffer = io.BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
+@router.get("/by-document-type/{document_type_id}/export")
+def export_document_type_runs(
+    document_type_id: UUID,
+    format: str = Query("xlsx", regex="^(xlsx|csv)$"),
+    table: Optional[str] = Query(None, description="CSV only: export the rows of this table group"),
+    user_id: Optional[UUID] = Query(None),
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user),
+):
+    """All documents of all runs of a document type (of the current user; admins: all or user_id)."""
+    document_type = document_type_crud.get_document_type(db, document_type_id)
+    if not document_type:
+        raise HTTPException(status_code=404, detail="Document type not found")
 
-    return StreamingResponse(
-        buffer,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f'attachment; filename="{safe_name}.xlsx"'},
-    )
+    effective_user_id = user_id if current_user.role == UserRole.ADMIN else current_user.id
+    run_ids = run_crud.get_export_run_ids(db, document_type_id, effective_user_id)
+    if not run_ids:
+        raise HTTPException(status_code=404, detail="No documents to export")
+
+    return _export_response(db, run_ids, document_type, format, table)
@@ -144,16 +144,20 @@ async def reindex_documents(
 
     This endpoint fetches documents from the database and adds them to LangChain PGVector index.
     """
+    from sqlalchemy.orm import contains_eager
     from app.models.processed_document import ProcessedDocument
+    from app.models.processed_document_text import ProcessedDocumentText
     from app.models.processing_run import ProcessingRun
     from app.models.document_type import DocumentType
 
-    # Get documents with OCR results
+    # Get documents with OCR text (the block list is not needed for indexing)
     documents = (
         db.query(ProcessedDocument)
+        .join(ProcessedDocument.text)
         .join(ProcessingRun)
         .join(DocumentType)
-        .filter(ProcessedDocument.ocr_result.isnot(None))
+        .options(contains_eager(ProcessedDocument.text).load_only(ProcessedDocumentText.raw_text))
+        .filter(ProcessedDocumentText.raw_text != "")
         .limit(batch_size)
         .all()
     )
@@ -169,7 +173,7 @@ async def reindex_documents(
 
     for doc in documents:
         try:
-            raw_text = (doc.ocr_result or {}).get("raw_text", "")
+            raw_text = doc.raw_text
 
             if raw_text:
                 # Get related data
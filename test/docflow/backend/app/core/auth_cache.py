@@ -0,0 +1,188 @@
+"""
+Cache of verified API tokens.
+
+get_current_user runs on every request, including frequent status polling.
+Verified tokens are kept per process for AUTH_CACHE_TTL seconds (keyed by
+the token hash, as stored in users.api_token) and shared between processes
+through Redis, so a cached request needs neither a database nor, usually, a
+Redis round trip. Logout and a new login invalidate the old token: the Redis
+entry is deleted and an invalidation is published, which every process
+applies to its local cache. If Redis is unavailable the TTL still bounds
+how long a revoked token is accepted by other processes.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Optional
+from uuid import UUID
+
+from app.core.config import settings
+from app.core.redis_client import get_redis
+from app.models.user import UserRole
+
+KEY_PREFIX = "docflow:auth:token"
+INVALIDATE_CHANNEL = "docflow:auth:invalidate"
+
+
+@dataclass(frozen=True)
+class AuthenticatedUser:
+    """Snapshot of the user behind a token (what request handlers read)."""
+    id: UUID
+    username: str
+    full_name: Optional[str]
+    role: UserRole
+    created_at: datetime
+    updated_at: datetime
+
+    @classmethod
+    def from_user(cls, user) -> "AuthenticatedUser":
+        return cls(
+            id=user.id,
+            username=user.username,
+            full_name=user.full_name,
+            role=user.role,
+            created_at=user.created_at,
+            updated_at=user.updated_at,
+        )
+
+    def to_json(self) -> str:
+        data = asdict(self)
+        data.update(
+            id=str(self.id),
+            role=self.role.value,
+            created_at=self.created_at.isoformat(),
+            updated_at=self.updated_at.isoformat(),
+        )
+        return json.dumps(data)
+
+    @classmethod
+    def from_json(cls, raw) -> "AuthenticatedUser":
+        data = json.loads(raw)
+        return cls(
+            id=UUID(data["id"]),
+            username=data["username"],
+            full_name=data.get("full_name"),
+            role=UserRole(data["role"]),
+            created_at=datetime.fromisoformat(data["created_at"]),
+            updated_at=datetime.fromisoformat(data["updated_at"]),
+        )
+
+
+class TokenCache:
+    """Per-process LRU of token hash -> user with a TTL, backed by Redis."""
+
+    def __init__(self):
+        self._entries: OrderedDict[str, tuple[float, AuthenticatedUser]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._listener_pid: Optional[int] = None
+
+    @property
+    def enabled(self) -> bool:
+        return settings.AUTH_CACHE_TTL > 0
+
+    def get(self, token_hash: str) -> Optional[AuthenticatedUser]:
+        if not self.enabled:
+            return None
+        self._ensure_listener()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(token_hash)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(token_hash)
+                return entry[1]
+            if entry:
+                del self._entries[token_hash]
+
+        try:
+            raw = get_redis().get(f"{KEY_PREFIX}:{token_hash}")
+        except Exception as e:
+            print(f"[AuthCache] Redis lookup failed: {e}")
+            return None
+        if not raw:
+            return None
+        user = AuthenticatedUser.from_json(raw)
+        self._store(token_hash, user)
+        return user
+
+    def put(self, token_hash: str, user) -> AuthenticatedUser:
+        """Cache a user loaded from the database; returns its snapshot."""
+        snapshot = AuthenticatedUser.from_user(user)
+        if not self.enabled:
+            return snapshot
+        self._store(token_hash, snapshot)
+        try:
+            get_redis().set(
+                f"{KEY_PREFIX}:{token_hash}",
+                snapshot.to_json(),
+                ex=max(1, int(settings.AUTH_CACHE_TTL)),
+            )
+        except Exception as e:
+            print(f"[AuthCache] Redis store failed: {e}")
+        return snapshot
+
+    def invalidate(self, token_hash: Optional[str] = None, user_id: Optional[UUID] = None) -> None:
+        """Drop a token (logout, new login) or all tokens of a user, in every process."""
+        self._evict(token_hash, str(user_id) if user_id else None)
+        try:
+            redis_client = get_redis()
+            if token_hash:
+                redis_client.delete(f"{KEY_PREFIX}:{token_hash}")
+            redis_client.publish(
+                INVALIDATE_CHANNEL,
+                json.dumps({"token_hash": token_hash, "user_id": str(user_id) if user_id else None}),
+            )
+        except Exception as e:
+            print(f"[AuthCache] Redis invalidation failed: {e}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _store(self, token_hash: str, user: AuthenticatedUser) -> None:
+        with self._lock:
+            self._entries[token_hash] = (time.monotonic() + settings.AUTH_CACHE_TTL, user)
+            self._entries.move_to_end(token_hash)
+            while len(self._entries) > settings.AUTH_CACHE_MAX_ENTRIES:
+                self._entries.popitem(last=False)
+
+    def _evict(self, token_hash: Optional[str], user_id: Optional[str]) -> None:
+        with self._lock:
+            if token_hash:
+                self._entries.pop(token_hash, None)
+            if user_id:
+                for key in [k for k, (_, u) in self._entries.items() if str(u.id) == user_id]:
+                    del self._entries[key]
+
+    def _ensure_listener(self) -> None:
+        # One subscriber thread per process (forked workers start their own).
+        if self._listener_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+        threading.Thread(target=self._listen, name="auth-cache-invalidation", daemon=True).start()
+
+    def _listen(self) -> None:
+        while True:
+            try:
+                pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(INVALIDATE_CHANNEL)
+                # Entries cached while disconnected may have missed an invalidation.
+                self.clear()
+                for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    data = json.loads(message["data"])
+                    self._evict(data.get("token_hash"), data.get("user_id"))
+            except Exception as e:
+                print(f"[AuthCache] Invalidation listener error: {e}")
+                self.clear()
+                time.sleep(5)
+
+
+token_cache = TokenCache()
@@ -4,11 +4,23 @@ Celery application configuration
 from celery import Celery
 from app.core.config import settings
 
+# Queues, one worker pool per queue (see run_celery.py profiles)
+QUEUE_OCR = "ocr-gpu"            # conversion and OCR, GPU-bound
+QUEUE_LLM = "llm-io"             # LLM extraction and DB writes, I/O-bound
+QUEUE_INDEXING = "indexing"      # semantic index, preview rendering, few-shot examples
+QUEUE_MAINTENANCE = "maintenance"  # folder scans, dispatchers, cleanup
+
+# Redis priorities: lower value is served first.
+PRIORITY_INTERACTIVE = 0  # user uploads waiting in the UI
+PRIORITY_NORMAL = 3
+PRIORITY_BULK = 6         # folder triggers, batch runs
+
 celery_app = Celery(
     "docflow",
     broker=settings.CELERY_BROKER_URL,
     backend=settings.CELERY_RESULT_BACKEND,
-    include=["app.tasks.document_tasks", "app.tasks.trigger_tasks"]
+    include=["app.tasks.document_tasks", "app.tasks.trigger_tasks", "app.tasks.render_tasks", "app.tasks.few_shot_tasks",
+             "app.tasks.layout_template_tasks"]
 )
 
 # Celery configuration
@@ -25,10 +37,38 @@ celery_app.conf.update(
     task_acks_late=True,  # Acknowledge after task completion
     task_reject_on_worker_lost=True,
     result_expires=3600,  # Results expire after 1 hour
+    task_default_queue=QUEUE_MAINTENANCE,
+    task_routes={
+        "app.tasks.document_tasks.process_document_task": {"queue": QUEUE_OCR},
+        "app.tasks.document_tasks.ocr_pages_task": {"queue": QUEUE_OCR},
+        "app.tasks.document_tasks.batch_process_documents_task": {"queue": QUEUE_OCR},
+        "app.tasks.document_tasks.ocr_page_batch_task": {"queue": QUEUE_OCR},
+        "process_trigger_file": {"queue": QUEUE_OCR},
+        "app.tasks.document_tasks.extract_document_task": {"queue": QUEUE_LLM},
+        "app.tasks.document_tasks.persist_document_task": {"queue": QUEUE_LLM},
+        "app.tasks.document_tasks.document_failed_task": {"queue": QUEUE_LLM},
+        "app.tasks.document_tasks.batch_extract_task": {"queue": QUEUE_LLM},
+        "app.tasks.document_tasks.batch_failed_task": {"queue": QUEUE_LLM},
+        "app.tasks.document_tasks.index_document_task": {"queue": QUEUE_INDEXING},
+        "app.tasks.render_tasks.*": {"queue": QUEUE_INDEXING},
+        "app.tasks.few_shot_tasks.*": {"queue": QUEUE_INDEXING},
+        "app.tasks.layout_template_tasks.*": {"queue": QUEUE_INDEXING},
+    },
+    task_default_priority=PRIORITY_NORMAL,
+    # Pipeline stages started by an interactive upload keep its priority.
+    task_inherit_parent_priority=True,
+    broker_transport_options={
+        "priority_steps": list(range(10)),
+        "sep": ":",
+        "queue_order_strategy": "priority",
+    },
     beat_schedule={
         "scan-folder-triggers": {
             "task": "scan_folder_triggers",
-            "schedule": 30.0,  # Every 30 seconds
+            "schedule": settings.TRIGGER_SCAN_INTERVAL,  # 30 seconds by default
         },
     },
 )
+
+# Signal handlers that keep the Redis task registry (GET /tasks/pending) up to date
+from app.services import task_registry  # noqa: E402,F401
@@ -9,12 +9,18 @@ class Settings(BaseSettings):
     APP_NAME: str = "Document Extraction API"
     DEBUG: bool = True
 
+    # Auth: verified tokens are cached per process (app/core/auth_cache.py)
+    AUTH_CACHE_TTL: float = 60.0  # seconds; 0 disables the cache
+    AUTH_CACHE_MAX_ENTRIES: int = 10000
+
     # CORS
     CORS_ORIGINS: list[str] = ["http://localhost:5173", "http://localhost:3000", "*"]
 
     # File Upload
     MAX_FILE_SIZE: int = 50 * 1024 * 1024  # 50MB
     ALLOWED_EXTENSIONS: set[str] = {"png", "jpg", "jpeg", "gif", "bmp", "tiff", "pdf", "doc", "docx"}
+    BULK_UPLOAD_MAX_FILES: int = 1000  # files per bulk upload (archives included)
+    BULK_UPLOAD_WORKERS: int = 16  # parallel uploads to storage
     UPLOAD_DIR: str = "uploads"
 
     # Storage for processed documents (MinIO / S3)
@@ -33,7 +39,30 @@ class Settings(BaseSettings):
     DEEPSEEK_BASE_SIZE: int = 1024
     DEEPSEEK_IMAGE_SIZE: int = 768
     DEEPSEEK_CLEAN_MARKDOWN: bool = True
+    # Let infer() write result.mmd/boxes images; _process_image reads them back
+    # when nothing was streamed, so turning it off drops that fallback
+    DEEPSEEK_SAVE_RESULTS: bool = True
     OCR_LOG_PREVIEW_CHARS: int = 500
+    # Documents with at least this many pages left to OCR fan out into per-page tasks
+    OCR_PAGE_FANOUT_MIN_PAGES: int = 8
+    OCR_PAGE_TIME_LIMIT: int = 300  # seconds per page task
+    # Soft time limits (seconds) of the other pipeline stages
+    PIPELINE_CONVERT_TIME_LIMIT: int = 300
+    PIPELINE_EXTRACT_TIME_LIMIT: int = 300
+    PIPELINE_INDEX_TIME_LIMIT: int = 120
+    # Batch runs: pages per OCR task (across documents) and concurrent LLM calls
+    BATCH_OCR_PAGES_PER_TASK: int = 16
+    BATCH_LLM_CONCURRENCY: int = 8
+
+    # Preview / highlight rendering
+    PREVIEW_WIDTHS: list[int] = [256, 768, 1600]
+    PREVIEW_FORMAT: str = "WEBP"  # WEBP or JPEG
+    PREVIEW_QUALITY: int = 80
+    RENDER_POOL_WORKERS: int = 2  # 0 renders inline in the API process
+
+    # Server-Sent Events of run progress
+    SSE_HEARTBEAT_SECONDS: float = 15.0
+    SSE_RETRY_MS: int = 3000  # client reconnect delay
 
     # Semantic indexing / search
     EMBEDDING_MODEL: str = "paraphrase-multilingual-MiniLM-L12-v2"
@@ -42,11 +71,60 @@ class Settings(BaseSettings):
 
     # OpenRouter API (Qwen2.5-VL)
     OPENROUTER_API_KEY: str = ""
+    # Shared LLM client per process (app/services/llm_pool.py)
+    LLM_MAX_CONCURRENCY: int = 256  # upper bound of the adaptive in-flight limit
+    LLM_MIN_CONCURRENCY: int = 4
+    LLM_MAX_QUEUE: int = 1000  # waiting requests beyond this are rejected (task retries later)
+    LLM_RATE_LIMIT_RPS: float = 20.0  # token bucket refill rate; 0 disables
+    LLM_RATE_LIMIT_BURST: int = 40
+    LLM_REQUEST_TIMEOUT: float = 60.0
+    LLM_MAX_RETRIES: int = 4  # on 429, 5xx and connection errors
+    LLM_RETRY_BASE_DELAY: float = 1.0
+    LLM_RETRY_MAX_DELAY: float = 60.0
+    LLM_METRICS_INTERVAL: float = 5.0  # seconds between metric updates in Redis
+    # Document context of prompts (app/services/context_builder.py)
+    LLM_CONTEXT_TOKENS: int = 1500  # max tokens of document text per prompt
+    LLM_CONTEXT_TOKENS_PER_FIELD: int = 150  # extraction budget: 300 + this per field, up to the max; 0 = max
+    LLM_CONTEXT_EMBEDDINGS: bool = True  # rank blocks by embedding similarity too (EMBEDDING_MODEL)
+    LLM_TOKENIZER: str = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"  # HF tokenizer for counting
+    # Tables of longer documents: concurrent chunk extractions per document; 0 = single ranked context
+    LLM_CHUNK_CONCURRENCY: int = 4
+    # Few-shot examples of reviewed documents (app/services/few_shot_store.py)
+    FEW_SHOT_STORE_SIZE: int = 200  # latest examples per document type kept in memory
+    FEW_SHOT_CACHE_CHECK_SECONDS: float = 30.0  # how often a process checks the store version
+    # Layout templates learned from reviewed documents (app/services/layout_templates.py)
+    LAYOUT_TEMPLATES_ENABLED: bool = True
+    LAYOUT_TEMPLATE_MIN_SUPPORT: int = 3  # documents a rule must be seen in and tried on
+    LAYOUT_TEMPLATE_MIN_CONFIDENCE: float = 0.9  # rule precision needed to skip the LLM for a field
+    LAYOUT_TEMPLATE_TRAIN_DOCUMENTS: int = 200  # latest reviewed / corrected documents per type
+    LAYOUT_TEMPLATE_TRAIN_DELAY: int = 60  # seconds; reviews within this window train once
+    LAYOUT_TEMPLATE_CACHE_CHECK_SECONDS: float = 30.0
+
+    # Folder triggers
+    TRIGGER_MAX_IN_FLIGHT: int = 4  # queued + processing files per trigger
+    TRIGGER_SCAN_LOCK_TIMEOUT: int = 300  # seconds before a crashed scan's lock expires
+    TRIGGER_FILE_STALE_AFTER: int = 3600  # in-flight files older than this are re-queued
+    # Failed files are retried by the scanner after TRIGGER_FILE_RETRY_BACKOFF * attempts seconds
+    TRIGGER_FILE_MAX_ATTEMPTS: int = 3
+    TRIGGER_FILE_RETRY_BACKOFF: int = 300
+    # Periodic full scan; with run_watcher.py running it only reconciles, so it can be raised
+    TRIGGER_SCAN_INTERVAL: float = 30.0
+    # A file counts as fully written once size/mtime are unchanged this long
+    TRIGGER_STABLE_SECONDS: float = 3.0
+    TRIGGER_WATCH_BACKEND: str = "auto"  # auto (inotify, polling on network mounts), inotify, poll
+    TRIGGER_POLL_INTERVAL: float = 5.0  # folder listing interval of the polling backend
+    TRIGGER_WATCH_RELOAD_INTERVAL: float = 60.0  # how often the watcher re-reads triggers
 
     # Celery + Redis
     REDIS_URL: str = "redis://localhost:6379/0"
     CELERY_BROKER_URL: str = "redis://localhost:6379/0"
     CELERY_RESULT_BACKEND: str = "redis://localhost:6379/0"
+    # Worker pools per queue (run_celery.py --profile)
+    CELERY_OCR_CONCURRENCY: int = 1
+    CELERY_LLM_POOL: str = "threads"  # or gevent, if installed
+    CELERY_LLM_CONCURRENCY: int = 64  # threads mostly wait on the shared LLM pool
+    CELERY_INDEXING_CONCURRENCY: int = 2
+    CELERY_MAINTENANCE_CONCURRENCY: int = 4
 
     class Config:
         env_file = ["../.env", ".env"]
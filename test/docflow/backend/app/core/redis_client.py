@@ -0,0 +1,17 @@
+"""
+Shared Redis client (same instance as the Celery broker by default).
+"""
+from typing import Optional
+
+import redis
+
+from app.core.config import settings
+
+_client: Optional[redis.Redis] = None
+
+
+def get_redis() -> redis.Redis:
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.REDIS_URL)
+    return _client
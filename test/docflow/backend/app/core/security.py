@@ -6,6 +6,7 @@ from typing import Optional
 from fastapi import Depends, Header, HTTPException, status
 from sqlalchemy.orm import Session
 
+from app.core.auth_cache import AuthenticatedUser, token_cache
 from app.core.database import get_db
 from app.models.user import User, UserRole
 
@@ -30,23 +31,33 @@ def create_token() -> str:
     return secrets.token_urlsafe(32)
 
 
+def hash_token(token: str) -> str:
+    """users.api_token stores this digest, never the token itself."""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
 def get_current_user(
     authorization: Optional[str] = Header(default=None),
     db: Session = Depends(get_db)
-) -> User:
+) -> AuthenticatedUser:
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
     token = authorization.split(" ", 1)[1].strip()
     if not token:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
 
-    user = db.query(User).filter(User.api_token == token).first()
+    token_hash = hash_token(token)
+    cached = token_cache.get(token_hash)
+    if cached:
+        return cached
+
+    user = db.query(User).filter(User.api_token == token_hash).first()
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-    return user
+    return token_cache.put(token_hash, user)
 
 
-def require_admin(current_user: User = Depends(get_current_user)) -> User:
+def require_admin(current_user: AuthenticatedUser = Depends(get_current_user)) -> AuthenticatedUser:
     if current_user.role != UserRole.ADMIN:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
     return current_user
@@ -0,0 +1,100 @@
+from datetime import datetime
+from uuid import UUID
+from sqlalchemy.orm import Session
+from sqlalchemy import cast, delete, func, or_, select
+from sqlalchemy.dialects.postgresql import JSONB, insert as pg_insert
+from app.models.few_shot_example import FewShotExample
+from app.models.processed_document import ProcessedDocument, DocumentStatus
+from app.models.processed_document_text import ProcessedDocumentText
+from app.models.processing_run import ProcessingRun
+
+
+def is_example_document():
+    """Documents that teach the model: reviewed, or with at least one corrected field."""
+    return or_(
+        ProcessedDocument.status == DocumentStatus.REVIEWED,
+        ProcessedDocument.extracted_fields.op("@>")(cast('[{"is_corrected": true}]', JSONB)),
+    )
+
+
+def get_examples(db: Session, document_type_id: UUID, limit: int) -> list[tuple]:
+    """(filename, snippet, embedding) of the latest examples of a document type."""
+    return db.execute(
+        select(FewShotExample.filename, FewShotExample.snippet, FewShotExample.embedding)
+        .where(FewShotExample.document_type_id == document_type_id)
+        .order_by(FewShotExample.updated_at.desc())
+        .limit(limit)
+    ).all()
+
+
+def get_example_sources(db: Session, document_ids: list[UUID], text_chars: int) -> list[tuple]:
+    """
+    (document id, document type id, filename, is example, extracted fields,
+    beginning of the text) of documents to refresh in the store.
+    """
+    return db.execute(
+        select(
+            ProcessedDocument.id,
+            ProcessingRun.document_type_id,
+            ProcessedDocument.filename,
+            is_example_document(),
+            ProcessedDocument.extracted_fields,
+            func.left(func.coalesce(ProcessedDocumentText.raw_text, ""), text_chars),
+        )
+        .join(ProcessingRun, ProcessedDocument.processing_run_id == ProcessingRun.id)
+        .outerjoin(ProcessedDocumentText, ProcessedDocumentText.document_id == ProcessedDocument.id)
+        .where(ProcessedDocument.id.in_(document_ids))
+    ).all()
+
+
+def get_example_document_ids(db: Session, document_type_id: UUID, limit: int) -> list[UUID]:
+    """Latest reviewed or corrected documents of a type (store rebuild)."""
+    return list(db.execute(
+        select(ProcessedDocument.id)
+        .join(ProcessingRun, ProcessedDocument.processing_run_id == ProcessingRun.id)
+        .where(ProcessingRun.document_type_id == document_type_id, is_example_document())
+        .order_by(ProcessedDocument.updated_at.desc())
+        .limit(limit)
+    ).scalars())
+
+
+def get_run_document_ids(db: Session, run_id: UUID) -> list[UUID]:
+    return list(db.execute(
+        select(ProcessedDocument.id).where(ProcessedDocument.processing_run_id == run_id)
+    ).scalars())
+
+
+def upsert_examples(db: Session, rows: list[dict], commit: bool = True) -> None:
+    """INSERT ... ON CONFLICT DO UPDATE; rows: {"document_id", "document_type_id", "filename", "snippet", "embedding"}."""
+    if not rows:
+        return
+    now = datetime.utcnow()
+    stmt = pg_insert(FewShotExample)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[FewShotExample.document_id],
+        set_={
+            "document_type_id": stmt.excluded.document_type_id,
+            "filename": stmt.excluded.filename,
+            "snippet": stmt.excluded.snippet,
+            "embedding": stmt.excluded.embedding,
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+    db.execute(stmt, [{**row, "created_at": now, "updated_at": now} for row in rows])
+    if commit:
+        db.commit()
+
+
+def delete_examples(db: Session, document_ids: list[UUID], commit: bool = True) -> list[UUID]:
+    """Delete the examples of the documents; returns the document types they belonged to."""
+    if not document_ids:
+        return []
+    type_ids = db.execute(
+        delete(FewShotExample)
+        .where(FewShotExample.document_id.in_(document_ids))
+        .returning(FewShotExample.document_type_id)
+    ).scalars().all()
+    if commit:
+        db.commit()
+    return list(set(type_ids))
+
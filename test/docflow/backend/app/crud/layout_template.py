@@ -0,0 +1,50 @@
+from datetime import datetime
+from typing import Iterator, Optional
+from uuid import UUID
+from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from app.crud.few_shot_example import is_example_document
+from app.models.layout_template import LayoutTemplate
+from app.models.processed_document import ProcessedDocument, DocumentStatus
+from app.models.processed_document_text import ProcessedDocumentText
+from app.models.processing_run import ProcessingRun
+
+
+def get_template(db: Session, document_type_id: UUID) -> Optional[LayoutTemplate]:
+    return db.get(LayoutTemplate, document_type_id)
+
+
+def save_template(db: Session, document_type_id: UUID, template: dict, documents: int) -> None:
+    now = datetime.utcnow()
+    stmt = pg_insert(LayoutTemplate).values(
+        document_type_id=document_type_id,
+        template=template,
+        documents=documents,
+        created_at=now,
+        updated_at=now,
+    )
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[LayoutTemplate.document_type_id],
+        set_={"template": stmt.excluded.template, "documents": stmt.excluded.documents, "updated_at": now},
+    ))
+    db.commit()
+
+
+def iter_training_documents(db: Session, document_type_id: UUID, limit: int) -> Iterator[tuple]:
+    """(is reviewed, extracted fields, OCR json_content) of the latest reviewed or corrected documents."""
+    rows = db.execute(
+        select(
+            ProcessedDocument.status == DocumentStatus.REVIEWED,
+            ProcessedDocument.extracted_fields,
+            ProcessedDocumentText.json_content,
+        )
+        .join(ProcessingRun, ProcessedDocument.processing_run_id == ProcessingRun.id)
+        .join(ProcessedDocumentText, ProcessedDocumentText.document_id == ProcessedDocument.id)
+        .where(ProcessingRun.document_type_id == document_type_id, is_example_document())
+        .order_by(ProcessedDocument.updated_at.desc())
+        .limit(limit)
+        .execution_options(yield_per=50)
+    )
+    for row in rows:
+        yield tuple(row)
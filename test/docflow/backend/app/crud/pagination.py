@@ -0,0 +1,50 @@
+"""
+Keyset pagination for lists ordered by (created_at DESC, id DESC).
+
+The cursor is an opaque url-safe string with the sort key of the last item
+of a page; the next page starts strictly after it, so it is served from the
+(…, created_at, id) indexes no matter how deep the client pages.
+"""
+import base64
+from datetime import datetime
+from typing import Optional, Sequence
+from uuid import UUID
+
+from sqlalchemy import desc, tuple_
+
+
+def encode_cursor(created_at: datetime, item_id: UUID) -> str:
+    raw = f"{created_at.isoformat()}|{item_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, UUID]:
+    """Raises ValueError for a malformed cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, item_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), UUID(item_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def keyset_page(query, created_column, id_column, cursor: Optional[str], limit: int, skip: int = 0):
+    """
+    Apply newest-first ordering, the cursor condition and the limit. skip
+    (OFFSET paging of old clients) is applied after the ordering; it is
+    ignored with a cursor.
+    """
+    if cursor:
+        created_at, item_id = decode_cursor(cursor)
+        query = query.filter(tuple_(created_column, id_column) < tuple_(created_at, item_id))
+    query = query.order_by(desc(created_column), desc(id_column))
+    if skip and not cursor:
+        query = query.offset(skip)
+    return query.limit(limit)
+
+
+def next_cursor(items: Sequence, limit: int) -> Optional[str]:
+    """Cursor of the page after items, or None if this was the last page."""
+    if len(items) < limit or not items:
+        return None
+    return encode_cursor(items[-1].created_at, items[-1].id)
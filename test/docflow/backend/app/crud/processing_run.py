@@ -1,10 +1,30 @@
+from datetime import datetime
 from typing import Optional
-from uuid import UUID
-from sqlalchemy.orm import Session, selectinload
-from sqlalchemy import desc
+from uuid import UUID, uuid4
+from sqlalchemy.orm import Session, load_only, selectinload, with_expression
+from sqlalchemy import Text, case, cast, column, func, insert, select, true, tuple_, update
+from sqlalchemy.dialects.postgresql import JSONB, insert as pg_insert
 from app.models.processing_run import ProcessingRun, ProcessingStatus, ProcessingSource
 from app.models.document_type import DocumentType
 from app.models.processed_document import ProcessedDocument, DocumentStatus
+from app.models.processed_document_text import ProcessedDocumentText, TEXT_KEYS
+from app.crud.pagination import keyset_page
+
+
+def _document_summaries():
+    """Load run documents as summaries only: no OCR metadata, no extracted fields."""
+    return selectinload(ProcessingRun.documents).options(
+        load_only(
+            ProcessedDocument.id,
+            ProcessedDocument.processing_run_id,
+            ProcessedDocument.filename,
+            ProcessedDocument.status,
+        ),
+        with_expression(
+            ProcessedDocument.extracted_fields_count,
+            func.coalesce(func.jsonb_array_length(ProcessedDocument.extracted_fields), 0),
+        ),
+    )
 
 
 def get_processing_run(db: Session, run_id: UUID) -> Optional[ProcessingRun]:
@@ -16,23 +36,57 @@ def get_processing_run(db: Session, run_id: UUID) -> Optional[ProcessingRun]:
     )
 
 
+def get_processing_run_summary(db: Session, run_id: UUID) -> Optional[ProcessingRun]:
+    """Run with document summaries (id, filename, status, fields count)."""
+    return (
+        db.query(ProcessingRun)
+        .options(selectinload(ProcessingRun.document_type), _document_summaries())
+        .filter(ProcessingRun.id == run_id)
+        .first()
+    )
+
+
+def get_processing_run_detail(db: Session, run_id: UUID) -> Optional[ProcessingRun]:
+    """Run with full documents and their text (without the OCR block list)."""
+    return (
+        db.query(ProcessingRun)
+        .options(
+            selectinload(ProcessingRun.document_type),
+            selectinload(ProcessingRun.documents)
+            .selectinload(ProcessedDocument.text)
+            .load_only(ProcessedDocumentText.raw_text, ProcessedDocumentText.raw_text_raw),
+        )
+        .filter(ProcessingRun.id == run_id)
+        .first()
+    )
+
+
+def _page_runs(query, skip: int, limit: int, cursor: Optional[str]) -> tuple[list[ProcessingRun], Optional[int]]:
+    """
+    Newest runs first. With a cursor the page is read by keyset and the
+    total is not counted again (None); skip is kept for old clients.
+    """
+    total = None if cursor else query.count()
+    runs = keyset_page(query, ProcessingRun.created_at, ProcessingRun.id, cursor, limit, skip=skip).all()
+    return runs, total
+
+
 def get_processing_runs_by_document_type(
     db: Session,
     document_type_id: UUID,
     skip: int = 0,
     limit: int = 50,
     user_id: Optional[UUID] = None,
-) -> tuple[list[ProcessingRun], int]:
+    cursor: Optional[str] = None,
+) -> tuple[list[ProcessingRun], Optional[int]]:
     query = (
         db.query(ProcessingRun)
-        .options(selectinload(ProcessingRun.document_type))
+        .options(selectinload(ProcessingRun.document_type), _document_summaries())
         .filter(ProcessingRun.document_type_id == document_type_id)
     )
     if user_id:
         query = query.filter(ProcessingRun.user_id == user_id)
-    total = query.count()
-    runs = query.order_by(desc(ProcessingRun.created_at)).offset(skip).limit(limit).all()
-    return runs, total
+    return _page_runs(query, skip, limit, cursor)
 
 
 def get_processing_runs(
@@ -40,13 +94,12 @@ def get_processing_runs(
     skip: int = 0,
     limit: int = 50,
     user_id: Optional[UUID] = None,
-) -> tuple[list[ProcessingRun], int]:
-    query = db.query(ProcessingRun).options(selectinload(ProcessingRun.document_type))
+    cursor: Optional[str] = None,
+) -> tuple[list[ProcessingRun], Optional[int]]:
+    query = db.query(ProcessingRun).options(selectinload(ProcessingRun.document_type), _document_summaries())
     if user_id:
         query = query.filter(ProcessingRun.user_id == user_id)
-    total = query.count()
-    runs = query.order_by(desc(ProcessingRun.created_at)).offset(skip).limit(limit).all()
-    return runs, total
+    return _page_runs(query, skip, limit, cursor)
 
 
 def create_processing_run(
@@ -76,21 +129,59 @@ def create_processing_run(
     return db_run
 
 
+# Single-statement updates: the changed row comes back via RETURNING, there is
+# no SELECT before and no refresh after. With commit=False the caller commits
+# (one transaction per task stage).
+_NO_SYNC = {"synchronize_session": False}
+
+
 def update_processing_run_status(
     db: Session,
     run_id: UUID,
     status: ProcessingStatus,
+    commit: bool = True,
 ) -> Optional[ProcessingRun]:
-    db_run = get_processing_run(db, run_id)
-    if not db_run:
-        return None
-
-    db_run.status = status
-    db.commit()
-    db.refresh(db_run)
+    db_run = db.execute(
+        update(ProcessingRun)
+        .where(ProcessingRun.id == run_id)
+        .values(status=status, updated_at=datetime.utcnow())
+        .returning(ProcessingRun)
+        .execution_options(**_NO_SYNC)
+    ).scalar()
+    if commit:
+        db.commit()
     return db_run
 
 
+def refresh_processing_run_status(
+    db: Session,
+    run_id: UUID,
+    commit: bool = True,
+) -> Optional[ProcessingStatus]:
+    """
+    Derive the run status from its document counters (one row, whatever the
+    run size): processing while any document is processing, error when all
+    failed, needs_review while any document awaits review, otherwise
+    reviewed. Runs without documents keep their status.
+    """
+    status = case(
+        (ProcessingRun.documents_processing > 0, ProcessingStatus.PROCESSING.value),
+        (ProcessingRun.documents_error == ProcessingRun.documents_total, ProcessingStatus.ERROR.value),
+        (ProcessingRun.documents_needs_review > 0, ProcessingStatus.NEEDS_REVIEW.value),
+        else_=ProcessingStatus.REVIEWED.value,
+    )
+    new_status = db.execute(
+        update(ProcessingRun)
+        .where(ProcessingRun.id == run_id, ProcessingRun.documents_total > 0)
+        .values(status=cast(status, ProcessingRun.status.type), updated_at=datetime.utcnow())
+        .returning(ProcessingRun.status)
+        .execution_options(**_NO_SYNC)
+    ).scalar()
+    if commit:
+        db.commit()
+    return new_status
+
+
 def update_processing_run_document_type(
     db: Session,
     run_id: UUID,
@@ -117,69 +208,56 @@ def delete_processing_run(db: Session, run_id: UUID) -> bool:
     return True
 
 
-def mark_run_as_reviewed(db: Session, run_id: UUID) -> Optional[ProcessingRun]:
-    db_run = get_processing_run(db, run_id)
-    if not db_run:
-        return None
+def delete_processed_documents(db: Session, document_ids: list[UUID]) -> int:
+    """Delete documents in one statement (texts cascade, run counters follow by trigger)."""
+    if not document_ids:
+        return 0
+    deleted = (
+        db.query(ProcessedDocument)
+        .filter(ProcessedDocument.id.in_(document_ids))
+        .delete(synchronize_session=False)
+    )
+    db.commit()
+    return deleted
 
-    db_run.status = ProcessingStatus.REVIEWED
-    for doc in db_run.documents:
-        doc.status = DocumentStatus.REVIEWED
 
-    db.commit()
-    db.refresh(db_run)
-    return db_run
+def _set_run_review_status(
+    db: Session,
+    run_id: UUID,
+    run_status: ProcessingStatus,
+    document_status: DocumentStatus,
+) -> Optional[ProcessingRun]:
+    db.execute(
+        update(ProcessedDocument)
+        .where(ProcessedDocument.processing_run_id == run_id)
+        .values(status=document_status, updated_at=datetime.utcnow())
+        .execution_options(**_NO_SYNC)
+    )
+    return update_processing_run_status(db, run_id, run_status)
 
 
-def cancel_run_review(db: Session, run_id: UUID) -> Optional[ProcessingRun]:
-    db_run = get_processing_run(db, run_id)
-    if not db_run:
-        return None
+def mark_run_as_reviewed(db: Session, run_id: UUID) -> Optional[ProcessingRun]:
+    return _set_run_review_status(db, run_id, ProcessingStatus.REVIEWED, DocumentStatus.REVIEWED)
 
-    db_run.status = ProcessingStatus.NEEDS_REVIEW
-    for doc in db_run.documents:
-        doc.status = DocumentStatus.NEEDS_REVIEW
 
-    db.commit()
-    db.refresh(db_run)
-    return db_run
+def cancel_run_review(db: Session, run_id: UUID) -> Optional[ProcessingRun]:
+    return _set_run_review_status(db, run_id, ProcessingStatus.NEEDS_REVIEW, DocumentStatus.NEEDS_REVIEW)
 
 
 def cancel_document_review(db: Session, document_id: UUID) -> Optional[ProcessedDocument]:
-    db_doc = get_processed_document(db, document_id)
-    if not db_doc:
+    run_id = _update_document(db, document_id, commit=False, status=DocumentStatus.NEEDS_REVIEW)
+    if not run_id:
         return None
-
-    db_doc.status = DocumentStatus.NEEDS_REVIEW
-
-    db_run = db_doc.processing_run
-    if db_run:
-        db_run.status = ProcessingStatus.NEEDS_REVIEW
-
-    db.commit()
-    db.refresh(db_doc)
-    return db_doc
+    update_processing_run_status(db, run_id, ProcessingStatus.NEEDS_REVIEW)
+    return get_processed_document(db, document_id)
 
 
 def mark_document_reviewed(db: Session, document_id: UUID) -> Optional[ProcessedDocument]:
-    db_doc = get_processed_document(db, document_id)
-    if not db_doc:
+    run_id = _update_document(db, document_id, commit=False, status=DocumentStatus.REVIEWED)
+    if not run_id:
         return None
-
-    db_doc.status = DocumentStatus.REVIEWED
-
-    db_run = db_doc.processing_run
-    if db_run:
-        all_reviewed = all(
-            doc.status == DocumentStatus.REVIEWED
-            for doc in db_run.documents
-        )
-        if all_reviewed:
-            db_run.status = ProcessingStatus.REVIEWED
-
-    db.commit()
-    db.refresh(db_doc)
-    return db_doc
+    refresh_processing_run_status(db, run_id)
+    return get_processed_document(db, document_id)
 
 
 # Document operations
@@ -197,57 +275,312 @@ def create_processed_document(
     mime_type: Optional[str] = None,
     status: DocumentStatus = DocumentStatus.PROCESSING,
 ) -> ProcessedDocument:
-    db_doc = ProcessedDocument(
-        processing_run_id=run_id,
-        filename=filename,
-        file_path=file_path,
-        file_size=file_size,
-        mime_type=mime_type,
-        status=status,
-        ocr_result={},
-        extracted_fields=[],
-    )
-    db.add(db_doc)
+    now = datetime.utcnow()
+    db_doc = db.execute(
+        insert(ProcessedDocument)
+        .values(
+            id=uuid4(),
+            processing_run_id=run_id,
+            filename=filename,
+            file_path=file_path,
+            file_size=file_size,
+            mime_type=mime_type,
+            status=status,
+            ocr_result={},
+            extracted_fields=[],
+            created_at=now,
+            updated_at=now,
+        )
+        .returning(ProcessedDocument)
+    ).scalar()
     db.commit()
-    db.refresh(db_doc)
     return db_doc
 
 
+def bulk_create_processed_documents(db: Session, run_id: UUID, documents: list[dict]) -> list[UUID]:
+    """
+    Insert many documents of a run with one executemany INSERT.
+    Each item: {"filename", "file_path", "file_size", "mime_type"}. Returns ids in order.
+    """
+    if not documents:
+        return []
+    now = datetime.utcnow()
+    rows = [
+        {
+            "id": uuid4(),
+            "processing_run_id": run_id,
+            "filename": doc["filename"],
+            "file_path": doc.get("file_path"),
+            "file_size": doc.get("file_size"),
+            "mime_type": doc.get("mime_type"),
+            "status": DocumentStatus.PROCESSING,
+            "ocr_result": {},
+            "extracted_fields": [],
+            "created_at": now,
+            "updated_at": now,
+        }
+        for doc in documents
+    ]
+    db.execute(insert(ProcessedDocument), rows)
+    db.commit()
+    return [row["id"] for row in rows]
+
+
+def get_document_file_paths(db: Session, run_id: UUID) -> list[str]:
+    rows = (
+        db.query(ProcessedDocument.file_path)
+        .filter(ProcessedDocument.processing_run_id == run_id, ProcessedDocument.file_path.isnot(None))
+        .all()
+    )
+    return [file_path for (file_path,) in rows]
+
+
+def get_export_run_ids(db: Session, document_type_id: UUID, user_id: Optional[UUID] = None) -> list[UUID]:
+    """Runs of a document type that have documents, oldest first."""
+    query = db.query(ProcessingRun.id).filter(
+        ProcessingRun.document_type_id == document_type_id,
+        ProcessingRun.documents_total > 0,
+    )
+    if user_id:
+        query = query.filter(ProcessingRun.user_id == user_id)
+    return [run_id for (run_id,) in query.order_by(ProcessingRun.created_at, ProcessingRun.id).all()]
+
+
+def get_export_columns(db: Session, run_ids: list[UUID]) -> tuple[list[str], dict[str, list[str]]]:
+    """
+    Columns of an export of the runs' documents: names of the scalar fields
+    and, per table group, the names of its columns. Ordered by position in
+    extracted_fields. Computed in the database: the JSONB of the documents
+    is not transferred.
+    """
+    if not run_ids:
+        return [], {}
+    elements = func.jsonb_array_elements(ProcessedDocument.extracted_fields).table_valued(
+        column("value", JSONB), with_ordinality="ordinality"
+    )
+    name = elements.c.value["name"].astext
+    group = func.coalesce(elements.c.value["group"].astext, "")
+    rows = (
+        db.query(group, name, func.min(elements.c.ordinality))
+        .select_from(ProcessedDocument)
+        .join(elements, true())
+        .filter(
+            ProcessedDocument.processing_run_id.in_(run_ids),
+            func.jsonb_typeof(ProcessedDocument.extracted_fields) == "array",
+            name.isnot(None),
+            name != "",
+        )
+        .group_by(group, name)
+        .order_by(func.min(elements.c.ordinality), group, name)
+        .all()
+    )
+    field_names: list[str] = []
+    table_columns: dict[str, list[str]] = {}
+    for group_name, field_name, _ in rows:
+        if group_name:
+            table_columns.setdefault(group_name, []).append(field_name)
+        else:
+            field_names.append(field_name)
+    return field_names, table_columns
+
+
+def iter_export_documents(db: Session, run_ids: list[UUID], chunk_size: int = 500):
+    """
+    (filename, extracted_fields) of the runs' documents in upload order,
+    read by keyset in chunks of chunk_size so memory does not grow with the run.
+    """
+    for run_id in run_ids:
+        after = None
+        while True:
+            query = db.query(
+                ProcessedDocument.created_at,
+                ProcessedDocument.id,
+                ProcessedDocument.filename,
+                ProcessedDocument.extracted_fields,
+            ).filter(ProcessedDocument.processing_run_id == run_id)
+            if after:
+                query = query.filter(tuple_(ProcessedDocument.created_at, ProcessedDocument.id) > tuple_(*after))
+            chunk = query.order_by(ProcessedDocument.created_at, ProcessedDocument.id).limit(chunk_size).all()
+            for row in chunk:
+                yield row.filename, row.extracted_fields
+            if len(chunk) < chunk_size:
+                break
+            after = (chunk[-1].created_at, chunk[-1].id)
+
+
+def _update_document(db: Session, document_id: UUID, commit: bool = True, **values) -> Optional[UUID]:
+    """UPDATE one document; returns its run id (None if the document does not exist)."""
+    run_id = db.execute(
+        update(ProcessedDocument)
+        .where(ProcessedDocument.id == document_id)
+        .values(**values, updated_at=datetime.utcnow())
+        .returning(ProcessedDocument.processing_run_id)
+        .execution_options(**_NO_SYNC)
+    ).scalar()
+    if commit:
+        db.commit()
+    return run_id
+
+
+def _split_ocr_result(document_id: UUID, ocr_result: dict) -> tuple[dict, dict]:
+    """Split an OCR result into processed_documents.ocr_result and a processed_document_texts row."""
+    light = {key: value for key, value in ocr_result.items() if key not in TEXT_KEYS}
+    text_row = {
+        "document_id": document_id,
+        "raw_text": ocr_result.get("raw_text") or "",
+        "raw_text_raw": ocr_result.get("raw_text_raw") or "",
+        "json_content": ocr_result.get("json_content") or {},
+    }
+    return light, text_row
+
+
+def _upsert_document_texts(db: Session, rows: list[dict]) -> None:
+    """INSERT ... ON CONFLICT DO UPDATE of OCR texts (executemany for several rows)."""
+    now = datetime.utcnow()
+    stmt = pg_insert(ProcessedDocumentText)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ProcessedDocumentText.document_id],
+        set_={
+            "raw_text": stmt.excluded.raw_text,
+            "raw_text_raw": stmt.excluded.raw_text_raw,
+            "json_content": stmt.excluded.json_content,
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+    db.execute(stmt, [{**row, "created_at": now, "updated_at": now} for row in rows])
+
+
 def update_document_extraction_results(
     db: Session,
     document_id: UUID,
     ocr_result: Optional[dict] = None,
     extracted_fields: Optional[list[dict]] = None,
     status: DocumentStatus = DocumentStatus.NEEDS_REVIEW,
-) -> Optional[ProcessedDocument]:
-    db_doc = get_processed_document(db, document_id)
-    if not db_doc:
-        return None
-
+    commit: bool = True,
+) -> Optional[UUID]:
+    """
+    ocr_result may contain raw_text / raw_text_raw / json_content: they are
+    stored in processed_document_texts. Returns the document's run id, or
+    None if the document does not exist.
+    """
+    values = {"status": status}
+    text_row = None
     if ocr_result is not None:
-        db_doc.ocr_result = ocr_result
+        values["ocr_result"], text_row = _split_ocr_result(document_id, ocr_result)
     if extracted_fields is not None:
-        db_doc.extracted_fields = extracted_fields
-    db_doc.status = status
+        values["extracted_fields"] = extracted_fields
+    run_id = _update_document(db, document_id, commit=False, **values)
+    if run_id and text_row:
+        _upsert_document_texts(db, [text_row])
+    if commit:
+        db.commit()
+    return run_id
+
+
+def bulk_update_document_extraction_results(db: Session, results: list[dict], commit: bool = True) -> int:
+    """
+    Write results of many documents with one executemany UPDATE (plus one
+    executemany upsert of their texts).
+    Each item: {"id", "ocr_result", "extracted_fields", "status"}.
+    """
+    if not results:
+        return 0
+    now = datetime.utcnow()
+    rows, text_rows = [], []
+    for item in results:
+        light, text_row = _split_ocr_result(item["id"], item["ocr_result"])
+        rows.append({**item, "ocr_result": light, "updated_at": now})
+        text_rows.append(text_row)
+    db.execute(update(ProcessedDocument), rows)
+    _upsert_document_texts(db, text_rows)
+    if commit:
+        db.commit()
+    return len(results)
+
+
+def get_document_raw_text(db: Session, document_id: UUID) -> str:
+    raw_text = db.execute(
+        select(ProcessedDocumentText.raw_text).where(ProcessedDocumentText.document_id == document_id)
+    ).scalar()
+    return raw_text or ""
+
+
+def get_document_index_source(db: Session, document_id: UUID, document_type_id: UUID):
+    """
+    What the index stage needs in one SELECT: (status, created_at, raw_text,
+    name of the document type) of the document, or None if it does not exist.
+    """
+    return db.execute(
+        select(
+            ProcessedDocument.status,
+            ProcessedDocument.created_at,
+            ProcessedDocumentText.raw_text,
+            DocumentType.name,
+        )
+        .select_from(ProcessedDocument)
+        .outerjoin(DocumentType, DocumentType.id == document_type_id)
+        .outerjoin(ProcessedDocumentText, ProcessedDocumentText.document_id == ProcessedDocument.id)
+        .where(ProcessedDocument.id == document_id)
+    ).first()
 
-    db.commit()
-    db.refresh(db_doc)
-    return db_doc
+
+def update_document_ocr_result(
+    db: Session,
+    document_id: UUID,
+    updates: dict,
+    commit: bool = True,
+) -> Optional[UUID]:
+    """
+    Merge top-level keys into a document's ocr_result in the database
+    (jsonb ||), so concurrent writers of different keys do not overwrite
+    each other. Returns the run id, or None if the document does not exist.
+    """
+    merged = func.coalesce(ProcessedDocument.ocr_result, cast({}, JSONB)).op("||")(cast(updates, JSONB))
+    return _update_document(db, document_id, commit=commit, ocr_result=merged)
+
+
+def set_document_stage_state(
+    db: Session,
+    document_id: UUID,
+    stage: str,
+    state,
+    commit: bool = True,
+) -> Optional[UUID]:
+    """Set ocr_result.stages[stage] (a string or {"state", "error"}) in one statement."""
+    ocr_result = func.coalesce(ProcessedDocument.ocr_result, cast({}, JSONB))
+    stages = func.coalesce(ProcessedDocument.ocr_result["stages"], cast({}, JSONB)).op("||")(
+        cast({stage: state}, JSONB)
+    )
+    merged = ocr_result.op("||")(func.jsonb_build_object(cast("stages", Text), stages))
+    return _update_document(db, document_id, commit=commit, ocr_result=merged)
 
 
 def update_document_status(
     db: Session,
     document_id: UUID,
     status: DocumentStatus,
-) -> Optional[ProcessedDocument]:
-    db_doc = get_processed_document(db, document_id)
-    if not db_doc:
-        return None
-
-    db_doc.status = status
+    commit: bool = True,
+) -> Optional[UUID]:
+    """Returns the document's run id, or None if the document does not exist."""
+    return _update_document(db, document_id, commit=commit, status=status)
+
+
+def start_document_processing(db: Session, document_id: UUID) -> Optional[str]:
+    """
+    Mark a document as processing and return its file_path in one statement.
+    Raises LookupError if the document does not exist.
+    """
+    row = db.execute(
+        update(ProcessedDocument)
+        .where(ProcessedDocument.id == document_id)
+        .values(status=DocumentStatus.PROCESSING, updated_at=datetime.utcnow())
+        .returning(ProcessedDocument.file_path)
+        .execution_options(**_NO_SYNC)
+    ).first()
+    if row is None:
+        raise LookupError(f"Document {document_id} not found")
     db.commit()
-    db.refresh(db_doc)
-    return db_doc
+    return row[0]
 
 
 def update_extracted_field(
@@ -278,7 +611,7 @@ def update_extracted_field(
     db.refresh(db_doc)
 
     try:
-        raw_text = db_doc.raw_text
+        raw_text = get_document_raw_text(db, db_doc.id)
         if raw_text:
             corrected = [
                 f"- {f.get('name')}: {f.get('value')}"
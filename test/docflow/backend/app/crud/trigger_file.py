@@ -0,0 +1,189 @@
+from datetime import datetime, timedelta
+from typing import Optional
+from uuid import UUID, uuid4
+from sqlalchemy.orm import Session
+from sqlalchemy import and_, case, func, or_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from app.models.trigger import Trigger
+from app.models.trigger_file import TriggerFile, TriggerFileStatus
+
+IN_FLIGHT_STATUSES = (TriggerFileStatus.QUEUED, TriggerFileStatus.PROCESSING)
+
+# Rows per INSERT ... ON CONFLICT statement when recording scan results
+_UPSERT_BATCH = 1000
+
+
+def get_trigger_file(db: Session, trigger_file_id: UUID) -> Optional[TriggerFile]:
+    return db.query(TriggerFile).filter(TriggerFile.id == trigger_file_id).first()
+
+
+def get_file_states(db: Session, trigger_id: UUID) -> dict[str, tuple[Optional[int], Optional[float]]]:
+    """Map path -> (size, mtime) of every file recorded for a trigger."""
+    rows = (
+        db.query(TriggerFile.path, TriggerFile.size, TriggerFile.mtime)
+        .filter(TriggerFile.trigger_id == trigger_id)
+        .all()
+    )
+    return {path: (size, mtime) for path, size, mtime in rows}
+
+
+def record_seen_files(db: Session, trigger_id: UUID, files: list[tuple[str, int, float]]) -> None:
+    """
+    Upsert (path, size, mtime) seen by a scan or the folder watcher.
+    New and changed files become pending; unchanged files and rows migrated
+    without stats keep their status. Files currently in flight are left
+    untouched so the change is picked up later.
+    """
+    now = datetime.utcnow()
+    for start in range(0, len(files), _UPSERT_BATCH):
+        batch = files[start:start + _UPSERT_BATCH]
+        stmt = pg_insert(TriggerFile).values([
+            {
+                "id": uuid4(),
+                "trigger_id": trigger_id,
+                "path": path,
+                "size": size,
+                "mtime": mtime,
+                "status": TriggerFileStatus.PENDING,
+                "created_at": now,
+                "updated_at": now,
+            }
+            for path, size, mtime in batch
+        ])
+        keep_status = or_(
+            TriggerFile.size.is_(None),
+            and_(TriggerFile.size == stmt.excluded.size, TriggerFile.mtime == stmt.excluded.mtime),
+        )
+        stmt = stmt.on_conflict_do_update(
+            constraint="uq_trigger_files_trigger_path",
+            set_={
+                "size": stmt.excluded.size,
+                "mtime": stmt.excluded.mtime,
+                "status": case((keep_status, TriggerFile.status), else_=stmt.excluded.status),
+                "error": case((keep_status, TriggerFile.error), else_=None),
+                "attempts": case((keep_status, TriggerFile.attempts), else_=0),
+                "updated_at": now,
+            },
+            where=TriggerFile.status.notin_(IN_FLIGHT_STATUSES),
+        )
+        db.execute(stmt)
+    db.commit()
+
+
+def claim_pending_files(db: Session, trigger_id: UUID, max_in_flight: int) -> list[TriggerFile]:
+    """
+    Move pending files to QUEUED up to the trigger's in-flight limit and assign
+    each a task id. The trigger row is locked so concurrent dispatchers (scan
+    and finishing tasks) cannot exceed the limit together.
+    """
+    db.query(Trigger.id).filter(Trigger.id == trigger_id).with_for_update().first()
+
+    in_flight = (
+        db.query(func.count(TriggerFile.id))
+        .filter(
+            TriggerFile.trigger_id == trigger_id,
+            TriggerFile.status.in_(IN_FLIGHT_STATUSES),
+        )
+        .scalar()
+    )
+    free_slots = max_in_flight - in_flight
+    if free_slots <= 0:
+        db.commit()
+        return []
+
+    files = (
+        db.query(TriggerFile)
+        .filter(
+            TriggerFile.trigger_id == trigger_id,
+            TriggerFile.status == TriggerFileStatus.PENDING,
+        )
+        .order_by(TriggerFile.created_at)
+        .limit(free_slots)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    for trigger_file in files:
+        trigger_file.status = TriggerFileStatus.QUEUED
+        trigger_file.task_id = str(uuid4())
+        trigger_file.error = None
+    db.commit()
+    return files
+
+
+def requeue_stale_files(db: Session, trigger_id: UUID, older_than: datetime) -> int:
+    """Return in-flight files whose task was lost (no update since older_than) to pending."""
+    result = db.execute(
+        update(TriggerFile)
+        .where(
+            TriggerFile.trigger_id == trigger_id,
+            TriggerFile.status.in_(IN_FLIGHT_STATUSES),
+            TriggerFile.updated_at < older_than,
+        )
+        .values(status=TriggerFileStatus.PENDING, task_id=None, updated_at=datetime.utcnow())
+    )
+    db.commit()
+    return result.rowcount
+
+
+def requeue_failed_files(db: Session, trigger_id: UUID, max_attempts: int, backoff_seconds: int) -> int:
+    """
+    Return failed files to pending once their backoff (backoff_seconds per
+    failed attempt) has passed, until they have failed max_attempts times.
+    Files failed for good (attempts = 0, e.g. missing) are left alone.
+    """
+    now = datetime.utcnow()
+    result = db.execute(
+        update(TriggerFile)
+        .where(
+            TriggerFile.trigger_id == trigger_id,
+            TriggerFile.status == TriggerFileStatus.ERROR,
+            TriggerFile.attempts > 0,
+            TriggerFile.attempts < max_attempts,
+            TriggerFile.updated_at < now - TriggerFile.attempts * timedelta(seconds=backoff_seconds),
+        )
+        .values(status=TriggerFileStatus.PENDING, task_id=None, updated_at=now)
+    )
+    db.commit()
+    return result.rowcount
+
+
+def update_trigger_file_status(
+    db: Session,
+    trigger_file_id: UUID,
+    status: TriggerFileStatus,
+    error: Optional[str] = None,
+    content_hash: Optional[str] = None,
+    attempts: Optional[int] = None,
+) -> Optional[TriggerFile]:
+    db_file = get_trigger_file(db, trigger_file_id)
+    if not db_file:
+        return None
+
+    db_file.status = status
+    db_file.error = error
+    if attempts is not None:
+        db_file.attempts = attempts
+    if content_hash is not None:
+        db_file.content_hash = content_hash
+    db.commit()
+    db.refresh(db_file)
+    return db_file
+
+
+def find_processed_duplicate(
+    db: Session,
+    trigger_id: UUID,
+    content_hash: str,
+    exclude_id: UUID,
+) -> Optional[TriggerFile]:
+    """A finished file of the same trigger with identical content, if any."""
+    return (
+        db.query(TriggerFile)
+        .filter(
+            TriggerFile.trigger_id == trigger_id,
+            TriggerFile.content_hash == content_hash,
+            TriggerFile.status == TriggerFileStatus.DONE,
+            TriggerFile.id != exclude_id,
+        )
+        .first()
+    )
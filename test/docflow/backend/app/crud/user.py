@@ -4,7 +4,8 @@ from sqlalchemy.orm import Session
 from sqlalchemy import asc
 from app.models.user import User, UserRole
 from app.schemas.user import UserCreate
-from app.core.security import hash_password, verify_password, create_token
+from app.core.auth_cache import token_cache
+from app.core.security import hash_password, verify_password, create_token, hash_token
 
 DEFAULT_ADMIN_USERNAME = "admin"
 DEFAULT_ADMIN_PASSWORD = "admin"
@@ -53,16 +54,26 @@ def authenticate_user(db: Session, username: str, password: str) -> Optional[Use
 
 
 def issue_token(db: Session, user: User) -> str:
+    """New token for the user; the previous one (one token per user) stops working."""
+    previous_hash = user.api_token
     token = create_token()
-    user.api_token = token
+    user.api_token = hash_token(token)
     db.commit()
     db.refresh(user)
+    if previous_hash:
+        token_cache.invalidate(token_hash=previous_hash)
     return token
 
 
-def clear_token(db: Session, user: User) -> None:
+def clear_token(db: Session, user_id: UUID) -> None:
+    user = get_user(db, user_id)
+    if not user:
+        return
+    previous_hash = user.api_token
     user.api_token = None
     db.commit()
+    if previous_hash:
+        token_cache.invalidate(token_hash=previous_hash, user_id=user_id)
 
 
 def ensure_default_admin(db: Session) -> User:
@@ -1,15 +1,23 @@
 from app.models.user import User
 from app.models.trigger import Trigger
+from app.models.trigger_file import TriggerFile
 from app.models.processing_run import ProcessingRun
 from app.models.processed_document import ProcessedDocument
+from app.models.processed_document_text import ProcessedDocumentText
 from app.models.document_query import DocumentQuery
 from app.models.document_type import DocumentType
+from app.models.few_shot_example import FewShotExample
+from app.models.layout_template import LayoutTemplate
 
 __all__ = [
     "User",
     "Trigger",
+    "TriggerFile",
     "ProcessingRun",
     "ProcessedDocument",
+    "ProcessedDocumentText",
     "DocumentQuery",
     "DocumentType",
+    "FewShotExample",
+    "LayoutTemplate",
 ]
@@ -0,0 +1,34 @@
+from sqlalchemy import Column, ForeignKey, Index, String, Text
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+from app.core.database import Base
+from app.models.base import TimestampMixin
+
+
+class FewShotExample(Base, TimestampMixin):
+    """
+    Pre-rendered few-shot example of a reviewed or corrected document
+    (app/services/few_shot_store.py), one per document.
+    """
+    __tablename__ = "few_shot_examples"
+    __table_args__ = (
+        Index("ix_few_shot_examples_type_updated", "document_type_id", "updated_at"),
+    )
+
+    document_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("processed_documents.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    document_type_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("type_of_documents.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    filename = Column(String(500), nullable=False)
+    # "  name: value" lines of the document's fields, ready for the prompt
+    snippet = Column(Text, nullable=False)
+    # Embedding of the beginning of the document text (EMBEDDING_MODEL); null if the model was unavailable
+    embedding = Column(JSONB, nullable=True)
+
+    def __repr__(self):
+        return f"<FewShotExample(document_id={self.document_id}, document_type_id={self.document_type_id})>"
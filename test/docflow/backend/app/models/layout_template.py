@@ -0,0 +1,25 @@
+from sqlalchemy import Column, ForeignKey, Integer
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+from app.core.database import Base
+from app.models.base import TimestampMixin
+
+
+class LayoutTemplate(Base, TimestampMixin):
+    """
+    Extraction rules of a document type learned from reviewed documents
+    (app/services/layout_templates.py).
+    """
+    __tablename__ = "layout_templates"
+
+    document_type_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("type_of_documents.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    # {"fields": {name: [rule, ...]}, "shapes": {name: str}}
+    template = Column(JSONB, nullable=False, default=dict)
+    # Reviewed / corrected documents the rules were learned from
+    documents = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<LayoutTemplate(document_type_id={self.document_type_id}, documents={self.documents})>"
@@ -1,7 +1,7 @@
 import enum
-from sqlalchemy import Column, String, Enum, ForeignKey, Integer
+from sqlalchemy import Column, String, Enum, ForeignKey, Index, Integer
 from sqlalchemy.dialects.postgresql import UUID, JSONB
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import query_expression, relationship
 from app.core.database import Base
 from app.models.base import TimestampMixin, UUIDMixin
 
@@ -16,6 +16,10 @@ class DocumentStatus(str, enum.Enum):
 class ProcessedDocument(Base, UUIDMixin, TimestampMixin):
     """Processed document model - represents a single document in a processing run"""
     __tablename__ = "processed_documents"
+    __table_args__ = (
+        # Run lookups and keyset reads of a run's documents in upload order (export)
+        Index("ix_processed_documents_run_created", "processing_run_id", "created_at", "id"),
+    )
 
     processing_run_id = Column(
         UUID(as_uuid=True),
@@ -32,34 +36,47 @@ class ProcessedDocument(Base, UUIDMixin, TimestampMixin):
         nullable=False
     )
 
-    # OCR Result as single JSONB
-    # Structure: {"raw_text": str, "raw_text_raw": str, "json_content": dict, "highlighted_image": str}
+    # Light OCR metadata as JSONB; text and blocks live in processed_document_texts
+    # Structure: {"highlighted_image": str, "preview_image": str, "page_images": [str | None],
+    #             "preview_variants": dict, "stages": dict}
     ocr_result = Column(JSONB, nullable=True, default=dict)
 
     # Extracted fields as JSONB array
-    # Structure: [{"name": str, "value": str, "confidence": float, "coordinate": [x1,y1,x2,y2], "original_value": str, "is_corrected": bool}]
+    # Structure: [{"name": str, "value": str, "confidence": float, "coordinate": [x1,y1,x2,y2], "page_index": int, "original_value": str, "is_corrected": bool}]
     extracted_fields = Column(JSONB, nullable=True, default=list)
 
     # Note: Vector embeddings are now stored in LangChain PGVector's own table
 
+    # Set by list queries (jsonb_array_length) that do not load extracted_fields
+    extracted_fields_count = query_expression()
+
     # Relationships
     processing_run = relationship("ProcessingRun", back_populates="documents")
+    text = relationship(
+        "ProcessedDocumentText",
+        back_populates="document",
+        uselist=False,
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
 
     @property
     def fields_count(self) -> int:
+        if self.extracted_fields_count is not None:
+            return self.extracted_fields_count
         return len(self.extracted_fields) if self.extracted_fields else 0
 
     @property
     def raw_text(self) -> str:
-        return (self.ocr_result or {}).get("raw_text", "")
+        return self.text.raw_text if self.text else ""
 
     @property
     def raw_text_raw(self) -> str:
-        return (self.ocr_result or {}).get("raw_text_raw", "")
+        return self.text.raw_text_raw if self.text else ""
 
     @property
     def json_content(self) -> dict:
-        return (self.ocr_result or {}).get("json_content", {})
+        return self.text.json_content if self.text else {}
 
     @property
     def highlighted_image(self) -> str | None:
@@ -69,5 +86,10 @@ class ProcessedDocument(Base, UUIDMixin, TimestampMixin):
     def preview_image(self) -> str | None:
         return (self.ocr_result or {}).get("preview_image")
 
+    @property
+    def page_count(self) -> int:
+        page_images = (self.ocr_result or {}).get("page_images") or []
+        return len(page_images) or 1
+
     def __repr__(self):
         return f"<ProcessedDocument(id={self.id}, filename='{self.filename}', status={self.status})>"
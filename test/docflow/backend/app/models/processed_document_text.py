@@ -0,0 +1,31 @@
+from sqlalchemy import Column, ForeignKey, Text
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+from sqlalchemy.orm import relationship
+from app.core.database import Base
+from app.models.base import TimestampMixin
+
+# Keys of the OCR result stored here instead of processed_documents.ocr_result
+TEXT_KEYS = ("raw_text", "raw_text_raw", "json_content")
+
+
+class ProcessedDocumentText(Base, TimestampMixin):
+    """
+    Heavy OCR payload of a processed document (text and block list), kept out
+    of processed_documents so run and document lists do not read it.
+    """
+    __tablename__ = "processed_document_texts"
+
+    document_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("processed_documents.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    raw_text = Column(Text, nullable=False, default="")
+    raw_text_raw = Column(Text, nullable=False, default="")
+    # jsonContent of the OCR result (blocks with coordinates)
+    json_content = Column(JSONB, nullable=False, default=dict)
+
+    document = relationship("ProcessedDocument", back_populates="text")
+
+    def __repr__(self):
+        return f"<ProcessedDocumentText(document_id={self.document_id}, chars={len(self.raw_text or '')})>"
@@ -1,5 +1,5 @@
 import enum
-from sqlalchemy import Column, String, Enum, ForeignKey
+from sqlalchemy import Column, String, Enum, ForeignKey, Index, Integer
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from app.core.database import Base
@@ -21,6 +21,12 @@ class ProcessingSource(str, enum.Enum):
 class ProcessingRun(Base, UUIDMixin, TimestampMixin):
     """Processing run model - represents a single execution of document processing"""
     __tablename__ = "processing_runs"
+    __table_args__ = (
+        # Newest-first lists (keyset on created_at, id), see crud/pagination.py
+        Index("ix_processing_runs_user_created", "user_id", "created_at", "id"),
+        Index("ix_processing_runs_type_created", "document_type_id", "created_at", "id"),
+        Index("ix_processing_runs_created", "created_at", "id"),
+    )
 
     document_type_id = Column(UUID(as_uuid=True), ForeignKey("type_of_documents.id", ondelete="CASCADE"), nullable=False)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -36,14 +42,23 @@ class ProcessingRun(Base, UUIDMixin, TimestampMixin):
         nullable=False
     )
 
+    # Document counters, maintained by statement triggers on processed_documents (migration 019)
+    documents_total = Column(Integer, nullable=False, default=0, server_default="0")
+    documents_processing = Column(Integer, nullable=False, default=0, server_default="0")
+    documents_needs_review = Column(Integer, nullable=False, default=0, server_default="0")
+    documents_reviewed = Column(Integer, nullable=False, default=0, server_default="0")
+    documents_error = Column(Integer, nullable=False, default=0, server_default="0")
+    fields_extracted = Column(Integer, nullable=False, default=0, server_default="0")
+
     # Relationships
     document_type = relationship("DocumentType", back_populates="processing_runs", lazy="selectin")
     user = relationship("User", back_populates="processing_runs")
+    # Loaded on access only: status updates must not pull every document's JSONB.
     documents = relationship(
         "ProcessedDocument",
         back_populates="processing_run",
         cascade="all, delete-orphan",
-        lazy="selectin"
+        lazy="select"
     )
 
     def __repr__(self):
@@ -1,5 +1,5 @@
-from sqlalchemy import Column, String, Boolean, ForeignKey
-from sqlalchemy.dialects.postgresql import UUID, JSONB
+from sqlalchemy import Column, String, Boolean, ForeignKey, Index, text
+from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from app.core.database import Base
 from app.models.base import TimestampMixin, UUIDMixin
@@ -8,13 +8,25 @@ from app.models.base import TimestampMixin, UUIDMixin
 class Trigger(Base, UUIDMixin, TimestampMixin):
     """Trigger configuration — monitors folder and auto-classifies documents."""
     __tablename__ = "triggers"
+    __table_args__ = (
+        # Beat scan: enabled folder triggers only
+        Index("ix_triggers_enabled", "id", postgresql_where=text("enabled AND folder IS NOT NULL")),
+        Index("ix_triggers_user_created", "user_id", "created_at"),
+    )
 
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     enabled = Column(Boolean, default=False, nullable=False)
     folder = Column(String(500), nullable=True)
-    processed_files = Column(JSONB, default=list, server_default="[]", nullable=False)
 
     user = relationship("User", back_populates="triggers")
+    # Seen-file state lives in its own table; never loaded eagerly.
+    files = relationship(
+        "TriggerFile",
+        back_populates="trigger",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+        lazy="noload",
+    )
 
     def __repr__(self):
         return f"<Trigger(id={self.id}, user_id={self.user_id}, enabled={self.enabled})>"
@@ -0,0 +1,47 @@
+import enum
+
+from sqlalchemy import Column, String, Text, BigInteger, Float, ForeignKey, Enum, Index, Integer, UniqueConstraint
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import relationship
+from app.core.database import Base
+from app.models.base import TimestampMixin, UUIDMixin
+
+
+class TriggerFileStatus(str, enum.Enum):
+    PENDING = "pending"          # seen by the scanner, waiting for a free slot
+    QUEUED = "queued"            # processing task sent to the queue
+    PROCESSING = "processing"
+    DONE = "done"
+    SKIPPED = "skipped"          # duplicate content or nothing to extract
+    ERROR = "error"
+
+
+class TriggerFile(Base, UUIDMixin, TimestampMixin):
+    """State of a file seen in a trigger folder (replaces triggers.processed_files)."""
+    __tablename__ = "trigger_files"
+    __table_args__ = (
+        UniqueConstraint("trigger_id", "path", name="uq_trigger_files_trigger_path"),
+        Index("ix_trigger_files_trigger_status", "trigger_id", "status"),
+        Index("ix_trigger_files_trigger_hash", "trigger_id", "content_hash"),
+    )
+
+    trigger_id = Column(UUID(as_uuid=True), ForeignKey("triggers.id", ondelete="CASCADE"), nullable=False)
+    # Path relative to the trigger folder
+    path = Column(String(1000), nullable=False)
+    size = Column(BigInteger, nullable=True)
+    mtime = Column(Float, nullable=True)
+    content_hash = Column(String(64), nullable=True)
+    status = Column(
+        Enum(TriggerFileStatus, values_callable=lambda x: [e.value for e in x], native_enum=False, length=20),
+        default=TriggerFileStatus.PENDING,
+        nullable=False,
+    )
+    task_id = Column(String(255), nullable=True)
+    error = Column(Text, nullable=True)
+    # Failed processing attempts since the file last changed (0: not retried)
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+
+    trigger = relationship("Trigger", back_populates="files")
+
+    def __repr__(self):
+        return f"<TriggerFile(id={self.id}, path='{self.path}', status={self.status})>"
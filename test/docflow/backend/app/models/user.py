@@ -18,6 +18,7 @@ class User(Base, UUIDMixin, TimestampMixin):
     full_name = Column(String(255), nullable=True)
     password_hash = Column(String(128), nullable=False)
     password_salt = Column(String(64), nullable=False)
+    # sha256 hex of the bearer token (app.core.security.hash_token)
     api_token = Column(String(255), nullable=True, index=True)
     role = Column(
         Enum(UserRole, values_callable=lambda x: [e.value for e in x]),
@@ -25,23 +26,24 @@ class User(Base, UUIDMixin, TimestampMixin):
         nullable=False
     )
 
+    # Loaded on access only: the user is loaded on every authenticated request.
     document_types = relationship(
         "DocumentType",
         back_populates="user",
         cascade="all, delete-orphan",
-        lazy="selectin"
+        lazy="select"
     )
     processing_runs = relationship(
         "ProcessingRun",
         back_populates="user",
         cascade="all, delete-orphan",
-        lazy="selectin"
+        lazy="select"
     )
     triggers = relationship(
         "Trigger",
         back_populates="user",
         cascade="all, delete-orphan",
-        lazy="selectin"
+        lazy="select"
     )
 
     def __repr__(self):
@@ -14,6 +14,7 @@ class ExtractedFieldResult(BaseModel):
     coordinate: Optional[list[float]] = None
     group: Optional[str] = None
     row_index: Optional[int] = None
+    page_index: Optional[int] = None
 
 
 class ExtractionResponse(BaseModel):
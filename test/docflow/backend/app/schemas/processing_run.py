@@ -25,8 +25,10 @@ class ExtractedField(BaseModel):
     coordinate: Optional[list[float]] = None
     group: Optional[str] = None
     row_index: Optional[int] = None
+    page_index: Optional[int] = None
     original_value: Optional[str] = None
     is_corrected: bool = False
+    source: Optional[str] = None  # "template" for fields found by a layout template
 
 
 class ExtractedFieldUpdate(BaseModel):
@@ -53,6 +55,7 @@ class ProcessedDocumentResponse(ProcessedDocumentBase):
     raw_text_raw: Optional[str] = None
     highlighted_image: Optional[str] = None
     preview_image: Optional[str] = None
+    page_count: int = 1
     fields_count: int = 0
     extracted_fields: list[ExtractedField] = []
     created_at: datetime
@@ -88,6 +91,12 @@ class ProcessingRunResponse(ProcessingRunBase):
     document_type_name: Optional[str] = None
     user_id: UUID
     status: ProcessingStatus
+    documents_total: int = 0
+    documents_processing: int = 0
+    documents_needs_review: int = 0
+    documents_reviewed: int = 0
+    documents_error: int = 0
+    fields_extracted: int = 0
     documents: list[ProcessedDocumentBrief] = []
     created_at: datetime
     updated_at: datetime
@@ -102,6 +111,12 @@ class ProcessingRunDetailResponse(ProcessingRunBase):
     document_type_name: Optional[str] = None
     user_id: UUID
     status: ProcessingStatus
+    documents_total: int = 0
+    documents_processing: int = 0
+    documents_needs_review: int = 0
+    documents_reviewed: int = 0
+    documents_error: int = 0
+    fields_extracted: int = 0
     documents: list[ProcessedDocumentResponse] = []
     created_at: datetime
     updated_at: datetime
@@ -116,4 +131,7 @@ class ProcessingRunDocumentTypeUpdate(BaseModel):
 
 class ProcessingRunListResponse(BaseModel):
     items: list[ProcessingRunResponse]
-    total: int
+    # Counted on the first page only (requests without a cursor)
+    total: Optional[int] = None
+    # Pass as ?cursor= to get the next page; None on the last page
+    next_cursor: Optional[str] = None
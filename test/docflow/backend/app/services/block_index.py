@@ -0,0 +1,163 @@
+"""
+Per-document lookup index over OCR blocks (parsing_res_list).
+
+Maps extracted values to the block (and bbox/page) that contains them
+without scanning every block for every value. Built once per OCR result
+and reused for all fields of the document.
+"""
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+# Substrings shorter than this cannot be narrowed down by the n-gram index.
+NGRAM_SIZE = 3
+
+# Number of recently used documents whose index is kept in memory.
+_INDEX_CACHE_SIZE = 16
+
+
+def _ngrams(text: str) -> set[str]:
+    return {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+
+class BlockIndex:
+    """Character n-gram index over OCR blocks with a valid bbox."""
+
+    def __init__(self, blocks: list[dict]):
+        self.source_size = len(blocks)
+        self.blocks: list[dict] = []
+        self._texts: list[str] = []
+        self._ngram_postings: dict[str, set[int]] = {}
+        self._gram_counts: list[int] = []
+        self._short_blocks: list[int] = []
+        self._containing_cache: dict[str, list[int]] = {}
+        self._lookup_cache: dict[str, Optional[dict]] = {}
+        self._overlap_cache: dict[str, Optional[dict]] = {}
+
+        for block in blocks:
+            content = block.get("block_content", "")
+            bbox = block.get("block_bbox")
+            if not content or not bbox or len(bbox) != 4:
+                continue
+            block_pos = len(self.blocks)
+            # Stripping never changes whether a stripped value is contained
+            text = content.lower().strip()
+            grams = _ngrams(text)
+            self.blocks.append(block)
+            self._texts.append(text)
+            self._gram_counts.append(len(grams))
+            if not grams:
+                self._short_blocks.append(block_pos)
+            for gram in grams:
+                self._ngram_postings.setdefault(gram, set()).add(block_pos)
+
+    def _candidates(self, needle: str) -> list[int]:
+        if len(needle) < NGRAM_SIZE:
+            return list(range(len(self.blocks)))
+
+        candidates: Optional[set[int]] = None
+        postings = sorted(
+            (self._ngram_postings.get(gram, set()) for gram in _ngrams(needle)),
+            key=len,
+        )
+        for posting in postings:
+            candidates = set(posting) if candidates is None else candidates & posting
+            if not candidates:
+                return []
+        return sorted(candidates or ())
+
+    def blocks_containing(self, needle: str) -> list[int]:
+        """Positions of blocks whose lowercased text contains `needle`, in document order."""
+        cached = self._containing_cache.get(needle)
+        if cached is not None:
+            return cached
+        result = [pos for pos in self._candidates(needle) if needle in self._texts[pos]]
+        self._containing_cache[needle] = result
+        return result
+
+    def blocks_within(self, haystack: str) -> list[int]:
+        """Positions of blocks whose lowercased text occurs in `haystack`, in document order."""
+        hits: dict[int, int] = {}
+        for gram in _ngrams(haystack):
+            for pos in self._ngram_postings.get(gram, ()):
+                hits[pos] = hits.get(pos, 0) + 1
+        # Only blocks with all of their n-grams in the haystack can occur in it
+        candidates = [pos for pos, count in hits.items() if count == self._gram_counts[pos]]
+        return sorted(pos for pos in candidates + self._short_blocks if self._texts[pos] in haystack)
+
+    def find_block(self, value: object) -> Optional[dict]:
+        """
+        Find the block for a value: first block containing the whole value,
+        otherwise the first block containing at least half of its words.
+        """
+        value_lower = str(value).lower().strip()
+        if value_lower in self._lookup_cache:
+            return self._lookup_cache[value_lower]
+
+        block = None
+        exact = self.blocks_containing(value_lower)
+        if exact:
+            block = self.blocks[exact[0]]
+        else:
+            value_words = value_lower.split()
+            if len(value_words) >= 2:
+                threshold = len(value_words) * 0.5
+                counts: dict[int, int] = {}
+                for word in value_words:
+                    for pos in self.blocks_containing(word):
+                        counts[pos] = counts.get(pos, 0) + 1
+                matched = [pos for pos, count in counts.items() if count >= threshold]
+                if matched:
+                    block = self.blocks[min(matched)]
+
+        self._lookup_cache[value_lower] = block
+        return block
+
+    def find_coordinate(self, value: object) -> Optional[list[float]]:
+        block = self.find_block(value)
+        return block.get("block_bbox") if block else None
+
+    def find_overlapping_block(self, value: object) -> Optional[dict]:
+        """
+        Highlight fallback: the first block that contains the value or is
+        contained in it (a value spanning several blocks, e.g. a multi-line
+        address, still gets the box of one of them). No partial word matches.
+        """
+        value_lower = str(value).lower().strip()
+        if not value_lower:
+            return None
+        if value_lower in self._overlap_cache:
+            return self._overlap_cache[value_lower]
+
+        positions = set(self.blocks_containing(value_lower)) | set(self.blocks_within(value_lower))
+        block = self.blocks[min(positions)] if positions else None
+        self._overlap_cache[value_lower] = block
+        return block
+
+    def find_overlapping_coordinate(self, value: object) -> Optional[list[float]]:
+        block = self.find_overlapping_block(value)
+        return block.get("block_bbox") if block else None
+
+
+_index_cache: "OrderedDict[int, tuple[dict, BlockIndex]]" = OrderedDict()
+_index_lock = threading.Lock()
+
+
+def get_block_index(json_content: dict) -> BlockIndex:
+    """Return the (cached) block index for an OCR json_content payload."""
+    blocks = json_content.get("parsing_res_list") or []
+    key = id(json_content)
+    with _index_lock:
+        cached = _index_cache.get(key)
+        if cached and cached[0] is json_content and cached[1].source_size == len(blocks):
+            _index_cache.move_to_end(key)
+            return cached[1]
+
+    index = BlockIndex(blocks)
+    with _index_lock:
+        # Keep a reference to json_content so its id() stays unique while cached.
+        _index_cache[key] = (json_content, index)
+        _index_cache.move_to_end(key)
+        while len(_index_cache) > _INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return index
@@ -0,0 +1,198 @@
+"""
+Bulk ingest of many files (multipart or ZIP/TAR archives) into one run.
+
+Uploads are spooled to temp files without reading them into memory,
+archives are unpacked, storage keys are allocated in memory (a new run's
+prefix is empty, so no HEAD probing is needed) and files are uploaded to
+storage in parallel. Database rows are created by the caller in one bulk
+INSERT and the run is processed by one batch task.
+"""
+import mimetypes
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Iterable, Optional
+
+from app.core.config import settings
+from app.services.storage_service import storage_service
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz")
+_COPY_CHUNK = 1024 * 1024
+
+
+@dataclass
+class IngestedFile:
+    filename: str
+    temp_path: str
+    file_size: int
+    mime_type: Optional[str]
+    storage_key: Optional[str] = None
+
+
+def is_archive(filename: str) -> bool:
+    return filename.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def _allowed(filename: str) -> bool:
+    return "." in filename and filename.rsplit(".", 1)[1].lower() in settings.ALLOWED_EXTENSIONS
+
+
+def _safe_name(name: str) -> str:
+    # Archive members and multipart names may carry directories; keep only the base name.
+    return os.path.basename(name.replace("\\", "/"))
+
+
+class BulkIngest:
+    """
+    Collects files of one bulk upload as temp files. The batch task removes
+    them once converted (workers on other hosts read from storage instead).
+    """
+
+    def __init__(self):
+        self.files: list[IngestedFile] = []
+        self.skipped: list[dict] = []
+        self.uploaded = False
+
+    @staticmethod
+    def _target_path(filename: str) -> str:
+        # Keep the extension: conversion detects the file type by it.
+        fd, path = tempfile.mkstemp(prefix="docflow-bulk-", suffix=Path(filename).suffix.lower())
+        os.close(fd)
+        return path
+
+    def _check_limits(self, filename: str, size: Optional[int]) -> bool:
+        if not _allowed(filename):
+            self.skipped.append({"filename": filename, "reason": "File type not allowed"})
+            return False
+        if size is not None and size > settings.MAX_FILE_SIZE:
+            self.skipped.append({"filename": filename, "reason": "File too large"})
+            return False
+        if len(self.files) >= settings.BULK_UPLOAD_MAX_FILES:
+            self.skipped.append({"filename": filename, "reason": "Too many files"})
+            return False
+        return True
+
+    def _add_stream(self, filename: str, stream: BinaryIO, mime_type: Optional[str]) -> None:
+        target = self._target_path(filename)
+        with open(target, "wb") as out:
+            shutil.copyfileobj(stream, out, _COPY_CHUNK)
+        size = os.path.getsize(target)
+        if size > settings.MAX_FILE_SIZE:
+            os.remove(target)
+            self.skipped.append({"filename": filename, "reason": "File too large"})
+            return
+        self.files.append(IngestedFile(
+            filename=filename,
+            temp_path=target,
+            file_size=size,
+            mime_type=mime_type or mimetypes.guess_type(filename)[0],
+        ))
+
+    def add_upload(self, filename: str, stream: BinaryIO, content_type: Optional[str]) -> None:
+        """Add one uploaded file; archives are unpacked."""
+        filename = _safe_name(filename or "")
+        if is_archive(filename):
+            archive_path = self._target_path(filename)
+            with open(archive_path, "wb") as out:
+                shutil.copyfileobj(stream, out, _COPY_CHUNK)
+            try:
+                self._add_archive(archive_path)
+            except (zipfile.BadZipFile, tarfile.TarError) as e:
+                self.skipped.append({"filename": filename, "reason": f"Invalid archive: {e}"})
+            finally:
+                os.remove(archive_path)
+            return
+        if self._check_limits(filename, None):
+            self._add_stream(filename, stream, content_type)
+
+    def _add_archive(self, archive_path: str) -> None:
+        if archive_path.lower().endswith(".zip"):
+            with zipfile.ZipFile(archive_path) as archive:
+                for info in archive.infolist():
+                    name = _safe_name(info.filename)
+                    if info.is_dir() or not name or info.filename.startswith("__MACOSX/"):
+                        continue
+                    if self._check_limits(name, info.file_size):
+                        with archive.open(info) as member:
+                            self._add_stream(name, member, None)
+            return
+
+        with tarfile.open(archive_path) as archive:
+            for info in archive:
+                name = _safe_name(info.name)
+                if not info.isfile() or not name:
+                    continue
+                if self._check_limits(name, info.size):
+                    member = archive.extractfile(info)
+                    if member is not None:
+                        with member:
+                            self._add_stream(name, member, None)
+
+    def allocate_keys(self, prefix_parts: Iterable[str], taken: Iterable[str] = ()) -> None:
+        """
+        Assign unique storage keys (name, name_1, ...) in memory. taken: keys
+        already used under the prefix (documents of an existing run).
+        """
+        used = set(taken)
+        prefix_parts = list(prefix_parts)
+        for item in self.files:
+            stem, suffix = Path(item.filename).stem, Path(item.filename).suffix
+            counter = 0
+            while True:
+                candidate = f"{stem}{suffix}" if counter == 0 else f"{stem}_{counter}{suffix}"
+                key = storage_service.build_key(*prefix_parts, candidate)
+                if key not in used:
+                    break
+                counter += 1
+            used.add(key)
+            item.storage_key = key
+
+    def upload_all(self) -> list[IngestedFile]:
+        """Upload files to storage in parallel; files that fail are moved to skipped."""
+        def upload(item: IngestedFile) -> Optional[str]:
+            try:
+                storage_service.save_file(item.temp_path, item.storage_key, content_type=item.mime_type)
+                return None
+            except Exception as e:
+                return str(e)
+
+        with ThreadPoolExecutor(max_workers=max(1, settings.BULK_UPLOAD_WORKERS)) as pool:
+            errors = list(pool.map(upload, self.files))
+
+        uploaded = []
+        for item, error in zip(self.files, errors):
+            if error:
+                print(f"Bulk upload of {item.filename} failed: {error}")
+                self.skipped.append({"filename": item.filename, "reason": "Upload failed"})
+                try:
+                    os.remove(item.temp_path)
+                except OSError:
+                    pass
+            else:
+                uploaded.append(item)
+        self.files = uploaded
+        self.uploaded = True
+        return uploaded
+
+    def delete_uploaded(self) -> None:
+        """Remove the stored objects again (the request failed after upload_all)."""
+        if not self.uploaded:
+            return
+        for item in self.files:
+            try:
+                storage_service.delete(item.storage_key)
+            except Exception as e:
+                print(f"Failed to delete {item.storage_key} from storage: {e}")
+
+    def cleanup(self) -> None:
+        """Remove the temp files (when the upload is not handed over to a task)."""
+        for item in self.files:
+            try:
+                os.remove(item.temp_path)
+            except OSError:
+                pass
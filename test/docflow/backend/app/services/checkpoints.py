@@ -0,0 +1,94 @@
+"""
+Durable checkpoints for document processing, stored in object storage.
+
+Checkpoints are keyed by the SHA-256 of the source file, so a retry (or a
+re-upload of the same file) reuses work that already finished. OCR results
+additionally depend on the OCR configuration, which is part of their key.
+
+Layout under checkpoints/<sha256>/:
+    convert.json, pages/page_N.png       conversion output
+    ocr-<fingerprint>/page_NNNN.json     per-page OCR
+    ocr-<fingerprint>/merged.json        merged OCR text and blocks
+    extract/<document>-<fields>.json     LLM extraction of one document
+"""
+import hashlib
+import json
+from typing import Optional
+
+from app.core.config import settings
+from app.services.storage_service import storage_service
+
+CHECKPOINT_ROOT = "checkpoints"
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def ocr_fingerprint() -> str:
+    """Short hash of the settings that change OCR output."""
+    payload = json.dumps([
+        settings.OCR_ENGINE,
+        settings.DEEPSEEK_MODEL,
+        settings.DEEPSEEK_BASE_SIZE,
+        settings.DEEPSEEK_IMAGE_SIZE,
+        settings.DEEPSEEK_CLEAN_MARKDOWN,
+    ])
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
+
+
+class DocumentCheckpoints:
+    """Checkpoints of one source file (identified by its content hash)."""
+
+    def __init__(self, content_hash: str):
+        self.content_hash = content_hash
+        self.prefix = storage_service.build_key(CHECKPOINT_ROOT, content_hash)
+        self._ocr_prefix = storage_service.build_key(self.prefix, f"ocr-{ocr_fingerprint()}")
+
+    def _save_json(self, key: str, payload: dict) -> None:
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        storage_service.save_bytes(data, key, content_type="application/json")
+
+    @staticmethod
+    def _load_json(key: str) -> Optional[dict]:
+        if not storage_service.exists(key):
+            return None
+        return json.loads(storage_service.read_bytes(key).decode("utf-8"))
+
+    def stage_key(self, name: str) -> str:
+        return storage_service.build_key(self.prefix, f"{name}.json")
+
+    def save_stage(self, name: str, payload: dict) -> str:
+        key = self.stage_key(name)
+        self._save_json(key, payload)
+        return key
+
+    def load_stage(self, name: str) -> Optional[dict]:
+        return self._load_json(self.stage_key(name))
+
+    def page_image_key(self, page_index: int) -> str:
+        """Converted page image (PDF/Word), shared by all uploads of the same file."""
+        return storage_service.build_key(self.prefix, "pages", f"page_{page_index + 1}.png")
+
+    def merged_ocr_stage(self) -> str:
+        """Stage name of the merged OCR result for the current OCR settings."""
+        return f"ocr-{ocr_fingerprint()}/merged"
+
+    def page_key(self, page_index: int) -> str:
+        return storage_service.build_key(self._ocr_prefix, f"page_{page_index + 1:04d}.json")
+
+    def has_page(self, page_index: int) -> bool:
+        return storage_service.exists(self.page_key(page_index))
+
+    def save_page(self, page: dict) -> None:
+        self._save_json(self.page_key(page["page_index"]), page)
+
+    def load_page(self, page_index: int) -> Optional[dict]:
+        return self._load_json(self.page_key(page_index))
+
+    def missing_pages(self, page_indices: list[int]) -> list[int]:
+        return [i for i in page_indices if not self.has_page(i)]
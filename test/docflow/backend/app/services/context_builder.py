@@ -0,0 +1,418 @@
+"""
+Document context for LLM prompts.
+
+Prompts used to carry the first 4000 characters of the document: on long
+documents the fields on later pages were never seen, on short requests most
+of the text was irrelevant. The context builder splits the document into
+OCR blocks (parsing_res_list, or paragraphs of the text when there are no
+blocks), ranks them against the requested fields or the question, lexically
+(stem overlap weighted by rarity) plus embedding similarity, and packs the
+best blocks into a token budget counted with a real tokenizer
+(LLM_TOKENIZER). Every query first gets its best blocks, the rest of the
+budget goes to the highest combined scores; the blocks are emitted in
+document order. Documents that fit the budget are sent whole.
+
+Documents whose tables do not fit the budget are extracted chunk by chunk
+instead (split_chunks, map-reduce in llm_service.extract_fields).
+
+Token counts of the full and the sent text are added up in Redis per
+purpose (extract / classify / query), see GET /tasks/llm-metrics.
+"""
+import math
+import re
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+from app.core.config import settings
+
+CONTEXT_STATS_KEY = "docflow:llm-context"
+GAP_MARKER = "[...]"
+# Label blocks shorter than this take the next block along (value below the label)
+LABEL_BLOCK_CHARS = 40
+# Embedding similarity weight relative to the normalized lexical score
+EMBEDDING_WEIGHT = 0.6
+MAX_EMBEDDED_BLOCKS = 256
+# Paragraph blocks of plain text are cut to about this many characters
+TEXT_BLOCK_CHARS = 600
+
+_WORD_RE = re.compile(r"[0-9a-zа-яё]+", re.IGNORECASE)
+_STEM_LENGTH = 6
+
+_tokenizer = None
+_tokenizer_failed = False
+_embeddings_failed = False
+_tokenizer_lock = threading.Lock()
+
+
+@dataclass
+class LLMContext:
+    text: str
+    tokens: int
+    source_tokens: int
+    blocks_used: int
+    blocks_total: int
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.source_tokens - self.tokens
+
+
+def _get_tokenizer():
+    global _tokenizer, _tokenizer_failed
+    if _tokenizer is not None or _tokenizer_failed:
+        return _tokenizer
+    with _tokenizer_lock:
+        if _tokenizer is None and not _tokenizer_failed:
+            try:
+                from transformers import AutoTokenizer
+
+                _tokenizer = AutoTokenizer.from_pretrained(settings.LLM_TOKENIZER)
+            except Exception as e:
+                _tokenizer_failed = True
+                print(f"[Context] Tokenizer {settings.LLM_TOKENIZER} unavailable, estimating tokens: {e}")
+    return _tokenizer
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    tokenizer = _get_tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.encode(text, add_special_tokens=False))
+    # ~3 characters per token for mixed Russian/English text
+    return len(text) // 3 + 1
+
+
+def _stems(text: str) -> set[str]:
+    return {word[:_STEM_LENGTH] for word in _WORD_RE.findall(text.lower()) if len(word) > 1}
+
+
+def _text_blocks(text: str) -> list[str]:
+    """Paragraphs of plain text, long ones cut at line breaks."""
+    blocks = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        while len(paragraph) > TEXT_BLOCK_CHARS:
+            cut = paragraph.rfind("\n", 0, TEXT_BLOCK_CHARS)
+            if cut <= 0:
+                cut = TEXT_BLOCK_CHARS
+            blocks.append(paragraph[:cut].strip())
+            paragraph = paragraph[cut:].strip()
+        if paragraph:
+            blocks.append(paragraph)
+    return blocks
+
+
+def _document_blocks(text: str, json_content: Optional[dict]) -> list[str]:
+    if json_content:
+        blocks = [
+            str(block.get("block_content") or "").strip()
+            for block in json_content.get("parsing_res_list") or []
+        ]
+        blocks = [block for block in blocks if block]
+        if blocks:
+            return blocks
+    return _text_blocks(text or "")
+
+
+def _lexical_scores(queries: list[str], blocks: list[str]) -> list[list[float]]:
+    """Per query, per block: sum of idf of the query stems found in the block, normalized to 0..1."""
+    block_stems = [_stems(block) for block in blocks]
+    doc_freq: dict[str, int] = {}
+    for stems in block_stems:
+        for stem in stems:
+            doc_freq[stem] = doc_freq.get(stem, 0) + 1
+
+    scores = []
+    for query in queries:
+        query_stems = _stems(query)
+        idf = {stem: math.log(1 + len(blocks) / doc_freq[stem]) for stem in query_stems if stem in doc_freq}
+        row = [sum(idf.get(stem, 0.0) for stem in stems & query_stems) for stems in block_stems]
+        top = max(row, default=0.0)
+        scores.append([score / top for score in row] if top else row)
+    return scores
+
+
+def _embedding_scores(queries: list[str], blocks: list[str]) -> Optional[list[list[float]]]:
+    global _embeddings_failed
+    if not settings.LLM_CONTEXT_EMBEDDINGS or _embeddings_failed:
+        return None
+    try:
+        from app.services.embedding_service import embedding_service
+
+        vectors = embedding_service.embed_batch(list(queries) + blocks)
+    except ImportError as e:
+        _embeddings_failed = True
+        print(f"[Context] Embedding model unavailable, ranking lexically: {e}")
+        return None
+    except Exception as e:
+        print(f"[Context] Embedding ranking skipped: {e}")
+        return None
+
+    def normalize(vector):
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    vectors = [normalize(v) for v in vectors]
+    query_vectors, block_vectors = vectors[:len(queries)], vectors[len(queries):]
+    return [
+        [max(0.0, sum(a * b for a, b in zip(q, v))) for v in block_vectors]
+        for q in query_vectors
+    ]
+
+
+def _rank(queries: list[str], blocks: list[str]) -> list[list[float]]:
+    """Combined relevance of every block for every query."""
+    scores = _lexical_scores(queries, blocks)
+    candidates = list(range(len(blocks)))
+    if len(blocks) > MAX_EMBEDDED_BLOCKS:
+        # Embed only the lexically best blocks of long documents
+        best = sorted(candidates, key=lambda i: max(row[i] for row in scores), reverse=True)
+        candidates = sorted(best[:MAX_EMBEDDED_BLOCKS])
+    embedded = _embedding_scores(queries, [blocks[i] for i in candidates])
+    if embedded:
+        for row, similarities in zip(scores, embedded):
+            for i, similarity in zip(candidates, similarities):
+                row[i] += EMBEDDING_WEIGHT * similarity
+    return scores
+
+
+def _pack(blocks: list[str], scores: list[list[float]], budget: int) -> list[int]:
+    """Positions of the blocks that fit the budget: round-robin over queries, then by best score."""
+    costs = [count_tokens(block) + 1 for block in blocks]
+    per_query = [
+        [i for i in sorted(range(len(blocks)), key=lambda i: row[i], reverse=True) if row[i] > 0]
+        for row in scores
+    ]
+    best_score = [max((row[i] for row in scores), default=0.0) for i in range(len(blocks))]
+    order: list[int] = []
+    seen: set[int] = set()
+    for rank in range(max((len(ranked) for ranked in per_query), default=0)):
+        for ranked in per_query:
+            if rank < len(ranked) and ranked[rank] not in seen:
+                seen.add(ranked[rank])
+                order.append(ranked[rank])
+        if rank >= 2:
+            break
+    order += [i for i in sorted(range(len(blocks)), key=lambda i: best_score[i], reverse=True) if i not in seen]
+
+    chosen: set[int] = set()
+    used = 0
+    for i in order:
+        if i in chosen:
+            continue
+        group = [i]
+        if len(blocks[i]) < LABEL_BLOCK_CHARS and i + 1 < len(blocks) and i + 1 not in chosen:
+            group.append(i + 1)
+        cost = sum(costs[j] for j in group)
+        if used + cost > budget:
+            if used + costs[i] > budget:
+                continue
+            group, cost = [i], costs[i]
+        chosen.update(group)
+        used += cost
+    return sorted(chosen)
+
+
+def extraction_budget(field_count: int) -> int:
+    if settings.LLM_CONTEXT_TOKENS_PER_FIELD <= 0:
+        return settings.LLM_CONTEXT_TOKENS
+    return min(settings.LLM_CONTEXT_TOKENS, 300 + settings.LLM_CONTEXT_TOKENS_PER_FIELD * field_count)
+
+
+_ROW_RE = re.compile(r"<tr[\s>].*?</tr>", re.IGNORECASE | re.DOTALL)
+PAGE_SEPARATOR = "\n\n---\n\n"
+_SPLIT_WORD_RE = re.compile(r"\S+\s*|\s+")
+
+
+def _split_block(block: str, budget: int) -> list[str]:
+    """
+    A block over the budget: HTML tables by rows, other text by lines. The
+    first row is repeated in every part as the header (OCR tables use <td>
+    for it too, see ocr_service._PreparedTable).
+    """
+    rows = _ROW_RE.findall(block)
+    if len(rows) > 1:
+        header, body = rows[0], rows[1:]
+        parts, current, used = [], [], count_tokens(header) + 4
+        for row in body:
+            cost = count_tokens(row)
+            if current and used + cost > budget:
+                parts.append(f"<table>{header}{''.join(current)}</table>")
+                current, used = [], count_tokens(header) + 4
+            current.append(row)
+            used += cost
+        if current:
+            parts.append(f"<table>{header}{''.join(current)}</table>")
+        return parts
+
+    parts, current, used = [], [], 0
+    for line in block.splitlines():
+        cost = count_tokens(line) + 1
+        if current and used + cost > budget:
+            parts.append("\n".join(current))
+            current, used = [], 0
+        current.append(line)
+        used += cost
+    if current:
+        parts.append("\n".join(current))
+    return parts
+
+
+def _split_text(text: str, budget: int) -> list[str]:
+    """A single line over the budget: between words, a word over the budget between characters."""
+    parts, current, used = [], "", 0
+    for word in _SPLIT_WORD_RE.findall(text):
+        cost = count_tokens(word)
+        if cost + 1 > budget:
+            # No whitespace to cut at: slices of the word that fit
+            while word:
+                cut = len(word)
+                while cut > 1 and count_tokens(word[:cut]) + 1 > budget:
+                    cut = max(1, cut * (budget - 1) // (count_tokens(word[:cut]) + 1))
+                if current:
+                    parts.append(current)
+                parts.append(word[:cut])
+                current, used, word = "", 0, word[cut:]
+            continue
+        if current and used + cost + 1 > budget:
+            parts.append(current)
+            current, used = "", 0
+        current += word
+        used += cost
+    if current:
+        parts.append(current)
+    return [part.strip() for part in parts if part.strip()]
+
+
+def _fit_blocks(blocks: list[str], budget: int) -> list[str]:
+    """Blocks cut into pieces of at most `budget` tokens; no text is dropped."""
+    fitted = []
+    for block in blocks:
+        if count_tokens(block) + 1 <= budget:
+            fitted.append(block)
+            continue
+        for piece in _split_block(block, budget):
+            if count_tokens(piece) + 1 <= budget:
+                fitted.append(piece)
+            else:
+                fitted.extend(_split_text(piece, budget))
+    return fitted
+
+
+def split_chunks(text: str, json_content: Optional[dict], budget: int) -> list[str]:
+    """
+    The whole document in parts of up to `budget` tokens for map-reduce
+    extraction. Whole pages are kept together where possible, a page over the
+    budget is cut between its blocks, a table over the budget between its rows.
+    """
+    text = text or ""
+    if count_tokens(text) <= budget:
+        return [text]
+
+    pages: list[list[str]] = []
+    blocks = [
+        block for block in (json_content or {}).get("parsing_res_list") or []
+        if str(block.get("block_content") or "").strip()
+    ]
+    if blocks:
+        by_page: dict[int, list[str]] = {}
+        for block in blocks:
+            by_page.setdefault(int(block.get("page_index") or 0), []).append(str(block["block_content"]).strip())
+        pages = [by_page[page] for page in sorted(by_page)]
+    else:
+        pages = [_text_blocks(page) for page in text.split(PAGE_SEPARATOR)]
+
+    chunks: list[str] = []
+    current: list[str] = []
+    used = 0
+
+    def flush():
+        nonlocal current, used
+        if current:
+            chunks.append("\n\n".join(current))
+        current, used = [], 0
+
+    for page in pages:
+        page_cost = sum(count_tokens(block) + 1 for block in page)
+        if current and used + page_cost > budget:
+            flush()
+        for block in page:
+            for piece in _fit_blocks([block], budget):
+                cost = count_tokens(piece) + 1
+                if current and used + cost > budget:
+                    flush()
+                current.append(piece)
+                used += cost
+    flush()
+    return chunks
+
+
+def build_context(
+    text: str,
+    queries: list[str],
+    json_content: Optional[dict] = None,
+    budget: Optional[int] = None,
+    purpose: str = "extract",
+) -> LLMContext:
+    """Document text for a prompt about `queries` (field names or a question) within `budget` tokens."""
+    budget = budget or settings.LLM_CONTEXT_TOKENS
+    text = text or ""
+    source_tokens = count_tokens(text)
+    if source_tokens <= budget:
+        context = LLMContext(text, source_tokens, source_tokens, 1, 1)
+        _record(purpose, context)
+        return context
+
+    # A block over the whole budget would never be packed: an empty context
+    blocks = _fit_blocks(_document_blocks(text, json_content), budget)
+    queries = [query for query in queries if query and query.strip()]
+    scores = _rank(queries, blocks) if queries else []
+    if not scores or not any(any(row) for row in scores):
+        # Nothing to rank by: keep the beginning of the document
+        scores = [[1.0 / (i + 1) for i in range(len(blocks))]]
+
+    parts: list[str] = []
+    previous = -1
+    positions = _pack(blocks, scores, budget)
+    for i in positions:
+        if i != previous + 1:
+            parts.append(GAP_MARKER)
+        parts.append(blocks[i])
+        previous = i
+    if previous != len(blocks) - 1 and parts:
+        parts.append(GAP_MARKER)
+
+    packed = "\n\n".join(parts)
+    context = LLMContext(packed, count_tokens(packed), source_tokens, len(positions), len(blocks))
+    _record(purpose, context)
+    return context
+
+
+def _record(purpose: str, context: LLMContext) -> None:
+    try:
+        from app.core.redis_client import get_redis
+
+        pipe = get_redis().pipeline()
+        pipe.hincrby(CONTEXT_STATS_KEY, f"{purpose}:prompts", 1)
+        pipe.hincrby(CONTEXT_STATS_KEY, f"{purpose}:source_tokens", context.source_tokens)
+        pipe.hincrby(CONTEXT_STATS_KEY, f"{purpose}:sent_tokens", context.tokens)
+        pipe.execute()
+    except Exception as e:
+        print(f"[Context] Failed to record token stats: {e}")
+
+
+def collect_stats() -> dict:
+    """Prompts, document tokens and tokens actually sent, per purpose."""
+    from app.core.redis_client import get_redis
+
+    stats: dict[str, dict] = {}
+    for key, value in get_redis().hgetall(CONTEXT_STATS_KEY).items():
+        key = key.decode() if isinstance(key, bytes) else key
+        purpose, name = key.split(":", 1)
+        stats.setdefault(purpose, {})[name] = int(value)
+    for values in stats.values():
+        source = values.get("source_tokens", 0)
+        values["saved_ratio"] = round(1 - values.get("sent_tokens", 0) / source, 3) if source else 0.0
+    return stats
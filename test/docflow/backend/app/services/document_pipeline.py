@@ -0,0 +1,379 @@
+"""
+Stages of the asynchronous document pipeline: convert → OCR → extract → persist → index.
+
+Each stage reads the previous stage's output from durable checkpoints
+(object storage, keyed by the file's content hash) or the database and
+writes its own, so a retried Celery task resumes from the last completed
+stage instead of starting over. Celery wiring, retry policies and time
+limits per stage live in app/tasks/document_tasks.py.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Optional
+from uuid import UUID
+
+from app.core.config import settings
+from app.crud import processing_run as run_crud
+from app.models.processed_document import DocumentStatus
+from app.services import ocr_service, progress
+from app.services.checkpoints import DocumentCheckpoints
+from app.services.document_converter import convert_document_for_ocr
+from app.services.llm_pool import LLMOverloadedError
+from app.services.semantic_index_service import semantic_index_service
+from app.services.storage_service import storage_service
+from app.tasks.render_tasks import enqueue_preview_rendering
+
+STAGES = ("convert", "ocr", "extract", "persist", "index")
+
+
+def _fields_fingerprint(job: dict) -> str:
+    payload = json.dumps([job["document_type_id"], job["fields_to_extract"]], ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
+
+
+def _extract_stage(job: dict) -> str:
+    return f"extract/{job['document_id']}-{_fields_fingerprint(job)}"
+
+
+def _progress(job: dict, stage: str, **data) -> None:
+    progress.publish(job["processing_run_id"], stage, document_id=job["document_id"], **data)
+
+
+def _set_stage_state(
+    db,
+    document_id: UUID,
+    stage: str,
+    state: str,
+    error: Optional[str] = None,
+    commit: bool = True,
+) -> None:
+    value = state if not error else {"state": state, "error": error[:500]}
+    run_crud.set_document_stage_state(db, document_id, stage, value, commit=commit)
+
+
+def run_convert(job: dict, local_path: Optional[str]) -> dict:
+    """
+    Convert PDF/Word into page images (stored once per content hash).
+    Returns {"original_type", "page_images", "ocr_sources", "extracted_text"};
+    ocr_sources lists [page_index, object key] of every page to OCR.
+    """
+    checkpoints = DocumentCheckpoints(job["content_hash"])
+    converted = checkpoints.load_stage("convert")
+
+    if converted is None:
+        if not local_path or not os.path.exists(local_path):
+            raise FileNotFoundError("Source file is required for conversion")
+        temp_dir = tempfile.mkdtemp()
+        try:
+            conversion = convert_document_for_ocr(local_path, temp_dir)
+            page_images: list[Optional[str]] = []
+            if conversion["original_type"] != "image":
+                for page_index, page_path in enumerate(conversion["images"]):
+                    if page_path.endswith(".txt"):
+                        page_images.append(None)
+                        continue
+                    key = checkpoints.page_image_key(page_index)
+                    storage_service.save_file(page_path, key, content_type="image/png")
+                    page_images.append(key)
+            converted = {
+                "original_type": conversion["original_type"],
+                "page_images": page_images,
+                "extracted_text": conversion["extracted_text"],
+            }
+            checkpoints.save_stage("convert", converted)
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    if converted["original_type"] == "image":
+        # The upload itself is the only page.
+        sources = [[0, job["file_path"]]]
+    else:
+        sources = [[i, key] for i, key in enumerate(converted["page_images"]) if key]
+    _progress(job, "convert", status="done", pages_total=len(sources))
+    return {**converted, "ocr_sources": sources}
+
+
+def _page_done(target: Optional[dict], page_index: int) -> None:
+    """Publish "page n/m" for a document, or pages done of a whole batch run."""
+    if not target:
+        return
+    run_id, document_id = target["processing_run_id"], target.get("document_id")
+    done = progress.increment(run_id, f"ocr:{document_id or 'batch'}")
+    progress.publish(
+        run_id,
+        "ocr",
+        document_id=document_id,
+        page=page_index + 1,
+        pages_done=min(done, target["pages_total"]),
+        pages_total=target["pages_total"],
+    )
+
+
+def ocr_pages(content_hash: str, pages: list[list], target: Optional[dict] = None) -> list[int]:
+    """
+    OCR [page_index, image key] pairs that have no checkpoint yet.
+    target: {"processing_run_id", "document_id", "pages_total"} for progress events.
+    """
+    checkpoints = DocumentCheckpoints(content_hash)
+    done = []
+    for page_index, image_key in pages:
+        if checkpoints.has_page(page_index):
+            done.append(page_index)
+            _page_done(target, page_index)
+            continue
+        if not ocr_service.is_paddle_initialized():
+            raise RuntimeError("PaddleOCR not initialized")
+
+        suffix = os.path.splitext(image_key)[1] or ".png"
+        fd, image_path = tempfile.mkstemp(suffix=suffix)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(storage_service.read_bytes(image_key))
+            checkpoints.save_page(ocr_service.ocr_page(image_path, page_index))
+        finally:
+            os.remove(image_path)
+        done.append(page_index)
+        _page_done(target, page_index)
+    return done
+
+
+def ocr_page_batch(items: list[list], target: Optional[dict] = None) -> int:
+    """
+    OCR [content_hash, page_index, image key] items of several documents in
+    one pass on an already loaded model. Returns the number of pages done.
+    """
+    by_file: dict[str, list[list]] = {}
+    for content_hash, page_index, image_key in items:
+        by_file.setdefault(content_hash, []).append([page_index, image_key])
+    return sum(len(ocr_pages(content_hash, pages, target)) for content_hash, pages in by_file.items())
+
+
+def load_merged(job: dict) -> dict:
+    """Merged OCR result of a document, built from page checkpoints on first use."""
+    checkpoints = DocumentCheckpoints(job["content_hash"])
+    merged_stage = checkpoints.merged_ocr_stage()
+    merged = checkpoints.load_stage(merged_stage)
+    if merged is None:
+        pages = []
+        for page_index in job["page_indices"]:
+            page = checkpoints.load_page(page_index)
+            if page is None:
+                raise RuntimeError(f"OCR checkpoint for page {page_index + 1} is missing")
+            pages.append(page)
+        merged = ocr_service.merge_pages(pages, job.get("extracted_text"))
+        checkpoints.save_stage(merged_stage, merged)
+    return merged
+
+
+def run_extract(job: dict) -> dict:
+    """Merge page checkpoints and run LLM extraction; both results are checkpointed."""
+    checkpoints = DocumentCheckpoints(job["content_hash"])
+    merged = load_merged(job)
+
+    extracted = checkpoints.load_stage(_extract_stage(job))
+    if extracted is None:
+        fields = []
+        if job["fields_to_extract"]:
+            fields = ocr_service.extract_fields_with_llm_resilient(
+                merged["rawText"],
+                job["fields_to_extract"],
+                merged["jsonContent"],
+                document_type_id=job["document_type_id"],
+            )
+        extracted = {"fields": fields}
+        checkpoints.save_stage(_extract_stage(job), extracted)
+
+    _progress(job, "extract", status="done", fields_extracted=len(extracted["fields"]))
+    return {"merged": merged, "fields": extracted["fields"]}
+
+
+def run_batch_extract(jobs: list[dict], document_type_id: str) -> dict[str, str]:
+    """
+    Extract stage of a batch run. Few-shot examples are picked per document
+    from the type's example store and LLM calls run concurrently, at most
+    BATCH_LLM_CONCURRENCY at a time. Documents with an extraction checkpoint
+    are skipped. Returns document id -> error for documents that failed.
+    """
+    errors: dict[str, str] = {}
+    pending: list[tuple[dict, dict]] = []
+    for job in jobs:
+        try:
+            merged = load_merged(job)
+        except Exception as e:
+            errors[job["document_id"]] = str(e)
+            continue
+        if DocumentCheckpoints(job["content_hash"]).load_stage(_extract_stage(job)) is None:
+            pending.append((job, merged))
+
+    fields_to_extract = jobs[0]["fields_to_extract"] if jobs else []
+    if not pending or not fields_to_extract:
+        for job, _ in pending:
+            DocumentCheckpoints(job["content_hash"]).save_stage(_extract_stage(job), {"fields": []})
+        return errors
+
+    async def extract_all():
+        semaphore = asyncio.Semaphore(max(1, settings.BATCH_LLM_CONCURRENCY))
+
+        async def extract_one(merged: dict):
+            async with semaphore:
+                return await ocr_service.extract_fields_resilient_async(
+                    merged["rawText"],
+                    fields_to_extract,
+                    merged["jsonContent"],
+                    document_type_id=document_type_id,
+                )
+
+        return await asyncio.gather(
+            *(extract_one(merged) for _, merged in pending),
+            return_exceptions=True,
+        )
+
+    overloaded = None
+    for (job, _), fields in zip(pending, asyncio.run(extract_all())):
+        if isinstance(fields, LLMOverloadedError):
+            overloaded = fields
+            continue
+        if isinstance(fields, Exception):
+            errors[job["document_id"]] = str(fields)
+            continue
+        DocumentCheckpoints(job["content_hash"]).save_stage(_extract_stage(job), {"fields": fields})
+        _progress(job, "extract", status="done", fields_extracted=len(fields))
+    if overloaded is not None:
+        # Finished documents are checkpointed; the task retries the rest.
+        raise overloaded
+    return errors
+
+
+def _persist_values(job: dict) -> dict:
+    """Column values of a processed document built from its checkpoints."""
+    checkpoints = DocumentCheckpoints(job["content_hash"])
+    merged = checkpoints.load_stage(checkpoints.merged_ocr_stage())
+    extracted = checkpoints.load_stage(_extract_stage(job))
+    if merged is None or extracted is None:
+        raise RuntimeError("Extraction checkpoint is missing")
+
+    extracted_fields = [
+        {
+            "name": f["name"],
+            "value": f["value"],
+            "confidence": f.get("confidence", 0.0),
+            "coordinate": f.get("coordinate"),
+            "group": f.get("group"),
+            "row_index": f.get("row_index"),
+            "page_index": f.get("page_index"),
+            "original_value": f["value"],
+            "is_corrected": False,
+        }
+        for f in extracted["fields"]
+    ]
+
+    page_image_keys = job["page_image_keys"]
+    raw_text = merged.get("rawText", "")
+    ocr_result = {
+        "raw_text": raw_text,
+        "raw_text_raw": merged.get("rawTextRaw", ""),
+        "json_content": merged.get("jsonContent", {}),
+        # The first page image doubles as the full-size preview
+        "preview_image": page_image_keys[0] if page_image_keys else None,
+        "page_images": page_image_keys,
+        "content_hash": job["content_hash"],
+        "stages": {
+            "convert": "done",
+            "ocr": "done",
+            "extract": "done",
+            "persist": "done",
+            "index": "pending" if raw_text else "skipped",
+        },
+    }
+    return {
+        "id": UUID(job["document_id"]),
+        "ocr_result": ocr_result,
+        "extracted_fields": extracted_fields,
+        "status": DocumentStatus.NEEDS_REVIEW,
+    }
+
+
+def run_persist(db, job: dict) -> bool:
+    """
+    Save OCR text and extracted fields on the document (overwrites, so it is
+    safe to repeat). Returns True if there is text to index.
+    """
+    values = _persist_values(job)
+    doc_uuid = values["id"]
+    run_crud.update_document_extraction_results(
+        db,
+        doc_uuid,
+        ocr_result=values["ocr_result"],
+        extracted_fields=values["extracted_fields"],
+        status=values["status"],
+        commit=False,
+    )
+    run_crud.refresh_processing_run_status(db, UUID(job["processing_run_id"]), commit=False)
+    db.commit()
+    enqueue_preview_rendering(doc_uuid)
+    _progress(job, "persist", status=DocumentStatus.NEEDS_REVIEW.value)
+    return bool(values["ocr_result"]["raw_text"])
+
+
+def run_batch_persist(db, jobs: list[dict]) -> list[dict]:
+    """
+    Persist stage of a batch run: one bulk UPDATE for all documents and one
+    run status update. Returns the jobs that have text to index.
+    """
+    rows = [_persist_values(job) for job in jobs]
+    run_crud.bulk_update_document_extraction_results(db, rows, commit=False)
+    if jobs:
+        run_crud.refresh_processing_run_status(db, UUID(jobs[0]["processing_run_id"]), commit=False)
+    db.commit()
+    for job, row in zip(jobs, rows):
+        enqueue_preview_rendering(row["id"])
+        _progress(job, "persist", status=DocumentStatus.NEEDS_REVIEW.value)
+    return [job for job, row in zip(jobs, rows) if row["ocr_result"]["raw_text"]]
+
+
+def run_index(db, job: dict) -> None:
+    """(Re)index the document in the semantic index; replaces any previous entry."""
+    doc_uuid = UUID(job["document_id"])
+    # Document, text and type name in one statement
+    source = run_crud.get_document_index_source(db, doc_uuid, UUID(job["document_type_id"]))
+    if not source or not source.raw_text:
+        return
+
+    semantic_index_service.update_document(
+        document_id=doc_uuid,
+        text=source.raw_text,
+        metadata={
+            "filename": job["original_filename"],
+            "document_type_id": job["document_type_id"],
+            "document_type_name": source.name or "",
+            "run_id": job["processing_run_id"],
+            "user_id": job["user_id"],
+            "status": source.status.value,
+            "created_at": source.created_at.isoformat() if source.created_at else "",
+        },
+    )
+    _set_stage_state(db, doc_uuid, "index", "done")
+    _progress(job, "index", status="done")
+
+
+def mark_index_failed(db, job: dict, error: str) -> None:
+    """Index failures are recorded on the document but never fail the run."""
+    _set_stage_state(db, UUID(job["document_id"]), "index", "error", error=error)
+    _progress(job, "index", status="error", error=error[:500])
+
+
+def mark_failed(db, job: dict, stage: str, error: str) -> None:
+    _progress(job, stage, status=DocumentStatus.ERROR.value, error=error[:500])
+    try:
+        db.rollback()
+        doc_uuid = UUID(job["document_id"])
+        run_crud.update_document_status(db, doc_uuid, DocumentStatus.ERROR, commit=False)
+        _set_stage_state(db, doc_uuid, stage, "error", error=error, commit=False)
+        run_crud.refresh_processing_run_status(db, UUID(job["processing_run_id"]), commit=False)
+        db.commit()
+    except Exception:
+        db.rollback()
@@ -0,0 +1,250 @@
+"""
+Streaming export of processed documents to CSV and XLSX.
+
+An export is a list of sheets: the first has one row per document with its
+scalar fields, then one sheet per table group ("table:<group>::<column>"
+fields) with one row per (document, row_index). All sheets are filled in a
+single pass over the documents, read by keyset in chunks (see
+run_crud.iter_export_documents) in a session of their own, because the
+response body is generated after the request's session is closed.
+
+CSV (one sheet) is sent as it is written. XLSX is written by a write-only
+openpyxl workbook (rows go to temp files, not to a cell tree) with named
+styles, and the finished file is streamed from disk. Column widths are
+estimated from the first WIDTH_SAMPLE_ROWS rows of each sheet instead of a
+second pass over all cells.
+"""
+import csv
+import io
+import tempfile
+from dataclasses import dataclass
+from itertools import chain
+from typing import Iterable, Iterator, Optional
+from urllib.parse import quote
+from uuid import UUID
+
+from app.core.database import SessionLocal
+from app.crud import processing_run as run_crud
+
+EXPORT_CHUNK_SIZE = 500
+CSV_FLUSH_ROWS = 500
+WIDTH_SAMPLE_ROWS = 200
+MAX_COLUMN_WIDTH = 60
+_FILE_CHUNK = 64 * 1024
+_SHEET_TITLE_JUNK = set('[]:*?/\\')
+
+CSV_MEDIA_TYPE = "text/csv; charset=utf-8"
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+@dataclass
+class ExportSheet:
+    title: str
+    headers: list[str]
+    # None for the documents sheet, otherwise the table group and its columns
+    group: Optional[str] = None
+    columns: Optional[list[str]] = None
+
+
+def safe_filename(name: Optional[str]) -> str:
+    return "".join(c if c.isalnum() or c in "._- " else "_" for c in (name or "export"))
+
+
+def content_disposition(name: str, extension: str) -> str:
+    """Attachment header; HTTP headers are latin-1, so non-ASCII names go to filename*."""
+    filename = f"{name}.{extension}"
+    fallback = filename.encode("ascii", "replace").decode().replace("?", "_")
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
+
+
+def _sheet_title(name: str, used: set[str]) -> str:
+    # Excel: max 31 chars, no []:*?/\, unique case-insensitively
+    base = "".join("_" if c in _SHEET_TITLE_JUNK else c for c in name).strip() or "Sheet"
+    title, n = base[:31], 2
+    while title.lower() in used:
+        suffix = f" ({n})"
+        title, n = base[:31 - len(suffix)] + suffix, n + 1
+    used.add(title.lower())
+    return title
+
+
+def build_sheets(
+    title: str,
+    field_names: list[str],
+    table_columns: dict[str, list[str]],
+    export_keys: dict,
+) -> list[ExportSheet]:
+    """
+    Documents sheet plus one sheet per table group. export_keys maps a field
+    name (or "table:<group>::<column>" for a table column) to its column name.
+    """
+    used: set[str] = set()
+    sheets = [ExportSheet(
+        title=_sheet_title(title, used),
+        headers=["Файл"] + [export_keys.get(name, name) for name in field_names],
+    )]
+    for group, columns in table_columns.items():
+        headers = ["Файл", "Строка"]
+        for name in columns:
+            headers.append(export_keys.get(f"table:{group}::{name}", export_keys.get(name, name)))
+        sheets.append(ExportSheet(
+            title=_sheet_title(group, used),
+            headers=headers,
+            group=group,
+            columns=columns,
+        ))
+    return sheets
+
+
+def iter_rows(
+    run_ids: list[UUID],
+    field_names: list[str],
+    sheets: list[ExportSheet],
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+) -> Iterator[tuple[int, list[str]]]:
+    """
+    (sheet index, row) for every document of the runs: its row of scalar
+    fields in the documents sheet, then its table rows in the sheets of
+    their groups. Only the given sheets are produced (e.g. a CSV of one table).
+    """
+    documents_sheet = next((idx for idx, sheet in enumerate(sheets) if sheet.group is None), None)
+    table_sheets = [(idx, sheet) for idx, sheet in enumerate(sheets) if sheet.group is not None]
+    db = SessionLocal()
+    try:
+        for filename, extracted_fields in run_crud.iter_export_documents(db, run_ids, chunk_size):
+            field_map: dict = {}
+            tables: dict[str, dict[int, dict]] = {}
+            for f in extracted_fields or []:
+                group = f.get("group")
+                if group:
+                    # Cells are keyed by row: a row must not overwrite the same column of another
+                    tables.setdefault(group, {}).setdefault(f.get("row_index") or 0, {})[f.get("name")] = f.get("value")
+                else:
+                    field_map[f.get("name")] = f.get("value")
+
+            if documents_sheet is not None:
+                yield documents_sheet, [filename] + [str(field_map.get(name, "")) for name in field_names]
+            for idx, sheet in table_sheets:
+                rows = tables.get(sheet.group, {})
+                for row_index in sorted(rows):
+                    cells = rows[row_index]
+                    yield idx, [filename, str(row_index + 1)] + [str(cells.get(name, "")) for name in sheet.columns]
+    finally:
+        db.close()
+
+
+def csv_stream(headers: list[str], rows: Iterable[tuple[int, list[str]]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    buffer.write("\ufeff")  # BOM for Excel compatibility
+    writer = csv.writer(buffer)
+    writer.writerow(headers)
+    for count, (_, row) in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % CSV_FLUSH_ROWS == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def _add_styles(wb) -> None:
+    from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+
+    side = Side(style="thin", color="DEE2E6")
+    border = Border(left=side, right=side, top=side, bottom=side)
+    wb.add_named_style(NamedStyle(
+        name="export_header",
+        font=Font(bold=True, color="FFFFFF", size=11),
+        fill=PatternFill(start_color="107572", end_color="107572", fill_type="solid"),
+        alignment=Alignment(horizontal="center", vertical="center", wrap_text=True),
+        border=border,
+    ))
+    wb.add_named_style(NamedStyle(
+        name="export_cell",
+        alignment=Alignment(vertical="center", wrap_text=True),
+        border=border,
+    ))
+    wb.add_named_style(NamedStyle(
+        name="export_cell_alt",
+        alignment=Alignment(vertical="center", wrap_text=True),
+        border=border,
+        fill=PatternFill(start_color="F8F9FA", end_color="F8F9FA", fill_type="solid"),
+    ))
+
+
+def _column_widths(headers: list[str], sample: list[list[str]]) -> list[int]:
+    widths = [len(str(header)) for header in headers]
+    for row in sample:
+        for idx, value in enumerate(row[:len(widths)]):
+            widths[idx] = max(widths[idx], len(value))
+    return [min(width + 4, MAX_COLUMN_WIDTH) for width in widths]
+
+
+class _SheetWriter:
+    """
+    Rows of one write-only sheet. The first WIDTH_SAMPLE_ROWS rows are held
+    back: a write-only sheet takes its column widths before the first row.
+    """
+
+    def __init__(self, wb, sheet: ExportSheet):
+        self.ws = wb.create_sheet(title=sheet.title)
+        self.headers = sheet.headers
+        self.sample: Optional[list[list[str]]] = []
+        self.row_idx = 1
+
+    def append(self, row: list[str]) -> None:
+        if self.sample is None:
+            self._write(row)
+            return
+        self.sample.append(row)
+        if len(self.sample) >= WIDTH_SAMPLE_ROWS:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.sample is None:
+            return
+        from openpyxl.utils import get_column_letter
+
+        for idx, width in enumerate(_column_widths(self.headers, self.sample), 1):
+            self.ws.column_dimensions[get_column_letter(idx)].width = width
+        self.ws.freeze_panes = "A2"
+        sample, self.sample = self.sample, None
+        for row in chain([self.headers], sample):
+            self._write(row)
+
+    def _write(self, row: list[str]) -> None:
+        from openpyxl.cell import WriteOnlyCell
+
+        if self.row_idx == 1:
+            style = "export_header"
+        else:
+            style = "export_cell_alt" if self.row_idx % 2 == 0 else "export_cell"
+        cells = []
+        for value in row:
+            cell = WriteOnlyCell(self.ws, value=value)
+            cell.style = style
+            cells.append(cell)
+        self.ws.append(cells)
+        self.row_idx += 1
+
+
+def write_xlsx(sheets: list[ExportSheet], rows: Iterable[tuple[int, list[str]]], target) -> None:
+    """Write (sheet index, row) rows into the sheets; target is a file or file-like object."""
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    _add_styles(wb)
+    writers = [_SheetWriter(wb, sheet) for sheet in sheets]
+    for idx, row in rows:
+        writers[idx].append(row)
+    for writer in writers:
+        writer.flush()
+    wb.save(target)
+
+
+def xlsx_stream(sheets: list[ExportSheet], rows: Iterable[tuple[int, list[str]]]) -> Iterator[bytes]:
+    with tempfile.TemporaryFile() as tmp:
+        write_xlsx(sheets, rows, tmp)
+        tmp.seek(0)
+        while chunk := tmp.read(_FILE_CHUNK):
+            yield chunk
@@ -0,0 +1,241 @@
+"""
+Few-shot examples of extraction prompts, per document type.
+
+Every LLM extraction used to query the latest five documents of its type
+(full rows, OCR included) and render their fields on the spot. Examples now
+come from a store: reviewed documents and documents with corrected fields
+get a pre-rendered snippet and an embedding of the beginning of their text
+in few_shot_examples, refreshed by a Celery task whenever a document is
+reviewed, corrected or its run changes type. Each process keeps the latest
+FEW_SHOT_STORE_SIZE examples of a type in memory; a refresh bumps the
+type's version in Redis, which processes check at most every
+FEW_SHOT_CACHE_CHECK_SECONDS. A prompt gets the examples most similar to its
+document (cosine of the embeddings), or the latest ones if the embedding
+model is unavailable.
+"""
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+from uuid import UUID
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.redis_client import get_redis
+from app.crud import few_shot_example as example_crud
+
+VERSION_KEY_PREFIX = "docflow:few-shot:version"
+REBUILD_LOCK_PREFIX = "docflow:few-shot:rebuild"
+REBUILD_LOCK_SECONDS = 3600
+# Beginning of the document text that is embedded (example and query alike)
+EMBED_CHARS = 1000
+SNIPPET_VALUE_CHARS = 200
+SNIPPET_TABLE_ROWS = 3
+_EMPTY_VALUES = ("", "Не найдено", "Ошибка извлечения")
+
+
+@dataclass
+class _Example:
+    filename: str
+    snippet: str
+    vector: Optional[list[float]]
+
+
+@dataclass
+class _TypeExamples:
+    version: Optional[int]
+    checked_at: float
+    examples: list[_Example]
+
+
+def _normalize(vector) -> Optional[list[float]]:
+    if not vector:
+        return None
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+def render_snippet(fields: Optional[list]) -> str:
+    """Scalar fields and the first rows of every table, one "  name: value" line each."""
+    lines: list[str] = []
+    rows: dict[str, dict[int, list[str]]] = {}
+    for f in fields or []:
+        if not isinstance(f, dict):
+            continue
+        name = str(f.get("name") or "")
+        value = str(f.get("value") or "").strip()
+        if not name or value in _EMPTY_VALUES:
+            continue
+        value = value[:SNIPPET_VALUE_CHARS]
+        group = f.get("group")
+        if group:
+            rows.setdefault(group, {}).setdefault(int(f.get("row_index") or 0), []).append(f"{name}={value}")
+        else:
+            lines.append(f"  {name}: {value}")
+    for group, group_rows in rows.items():
+        for row_index in sorted(group_rows)[:SNIPPET_TABLE_ROWS]:
+            lines.append(f"  {group}[{row_index + 1}]: " + "; ".join(group_rows[row_index]))
+    return "\n".join(lines)
+
+
+class FewShotStore:
+    """Per-process cache of the example store with Redis-versioned invalidation."""
+
+    def __init__(self):
+        self._types: dict[str, _TypeExamples] = {}
+        self._lock = threading.Lock()
+        self._embeddings_failed = False
+
+    # Embeddings
+
+    def _embed(self, texts: list[str]) -> Optional[list[list[float]]]:
+        if self._embeddings_failed or not texts:
+            return None
+        try:
+            from app.services.embedding_service import embedding_service
+
+            return embedding_service.embed_batch(texts)
+        except ImportError as e:
+            self._embeddings_failed = True
+            print(f"[FewShot] Embedding model unavailable, using latest examples: {e}")
+        except Exception as e:
+            print(f"[FewShot] Embedding failed: {e}")
+        return None
+
+    # Cache
+
+    def _version(self, document_type_id: str) -> Optional[int]:
+        try:
+            raw = get_redis().get(f"{VERSION_KEY_PREFIX}:{document_type_id}")
+        except Exception as e:
+            print(f"[FewShot] Redis version lookup failed: {e}")
+            return None
+        return int(raw) if raw else 0
+
+    def _examples(self, document_type_id: str) -> list[_Example]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._types.get(document_type_id)
+        if entry and now - entry.checked_at < settings.FEW_SHOT_CACHE_CHECK_SECONDS:
+            return entry.examples
+
+        version = self._version(document_type_id)
+        if entry and version is not None and version == entry.version:
+            entry.checked_at = now
+            return entry.examples
+
+        db = SessionLocal()
+        try:
+            rows = example_crud.get_examples(db, UUID(document_type_id), settings.FEW_SHOT_STORE_SIZE)
+        finally:
+            db.close()
+        examples = [_Example(filename, snippet, _normalize(embedding)) for filename, snippet, embedding in rows]
+        with self._lock:
+            self._types[document_type_id] = _TypeExamples(version, now, examples)
+        if not examples:
+            self._request_rebuild(document_type_id)
+        return examples
+
+    def _request_rebuild(self, document_type_id: str) -> None:
+        """Types without stored examples (e.g. right after the migration) are rebuilt once an hour at most."""
+        try:
+            if not get_redis().set(f"{REBUILD_LOCK_PREFIX}:{document_type_id}", 1, nx=True, ex=REBUILD_LOCK_SECONDS):
+                return
+            from app.tasks.few_shot_tasks import rebuild_few_shot_examples_task
+
+            rebuild_few_shot_examples_task.delay(document_type_id)
+        except Exception as e:
+            print(f"[FewShot] Failed to request rebuild of {document_type_id}: {e}")
+
+    def invalidate(self, document_type_ids) -> None:
+        """Drop the types here and make other processes reload them."""
+        for document_type_id in {str(type_id) for type_id in document_type_ids if type_id}:
+            with self._lock:
+                self._types.pop(document_type_id, None)
+            try:
+                get_redis().incr(f"{VERSION_KEY_PREFIX}:{document_type_id}")
+            except Exception as e:
+                print(f"[FewShot] Failed to publish invalidation of {document_type_id}: {e}")
+
+    # Reading
+
+    def select(self, document_type_id: Optional[str], text: str = "", max_examples: int = 5) -> str:
+        """Prompt block of the examples most similar to `text` (the latest ones without text)."""
+        if not document_type_id:
+            return ""
+        try:
+            examples = self._examples(str(document_type_id))
+        except Exception as e:
+            print(f"[FewShot] Failed to load examples: {e}")
+            return ""
+        if not examples:
+            return ""
+
+        chosen = examples[:max_examples]
+        if text and len(examples) > max_examples and any(example.vector for example in examples):
+            vectors = self._embed([text[:EMBED_CHARS]])
+            query = _normalize(vectors[0]) if vectors else None
+            if query:
+                scored = sorted(
+                    range(len(examples)),
+                    key=lambda i: sum(a * b for a, b in zip(query, examples[i].vector)) if examples[i].vector else -1.0,
+                    reverse=True,
+                )
+                chosen = [examples[i] for i in scored[:max_examples]]
+
+        return "\n\n".join(
+            f"Пример {n} ({example.filename or 'Документ'}):\n{example.snippet}"
+            for n, example in enumerate(chosen, 1)
+        )
+
+    # Writing (Celery, see app/tasks/few_shot_tasks.py)
+
+    def refresh_documents(self, document_ids: list[UUID]) -> list[str]:
+        """
+        Re-render the examples of the documents; those no longer reviewed or
+        corrected are removed. Returns the document types whose examples changed.
+        """
+        if not document_ids:
+            return []
+        db = SessionLocal()
+        try:
+            sources = example_crud.get_example_sources(db, document_ids, EMBED_CHARS)
+            rows = []
+            for document_id, document_type_id, filename, is_example, fields, text in sources:
+                snippet = render_snippet(fields) if is_example and document_type_id else ""
+                if snippet:
+                    rows.append({
+                        "document_id": document_id,
+                        "document_type_id": document_type_id,
+                        "filename": filename,
+                        "snippet": snippet,
+                        "text": text or snippet,
+                    })
+            vectors = self._embed([row.pop("text") for row in rows]) or [None] * len(rows)
+            for row, vector in zip(rows, vectors):
+                row["embedding"] = list(vector) if vector is not None else None
+
+            # Old rows first: a run may have moved to another document type.
+            # One transaction, so a failed upsert does not leave the examples deleted
+            changed_types = set(example_crud.delete_examples(db, list(document_ids), commit=False))
+            example_crud.upsert_examples(db, rows, commit=False)
+            db.commit()
+            changed_types.update(row["document_type_id"] for row in rows)
+        finally:
+            db.close()
+        self.invalidate(changed_types)
+        return sorted(str(type_id) for type_id in changed_types)
+
+    def rebuild_type(self, document_type_id: str) -> list[str]:
+        db = SessionLocal()
+        try:
+            document_ids = example_crud.get_example_document_ids(
+                db, UUID(document_type_id), settings.FEW_SHOT_STORE_SIZE
+            )
+        finally:
+            db.close()
+        return self.refresh_documents(document_ids)
+
+
+few_shot_store = FewShotStore()
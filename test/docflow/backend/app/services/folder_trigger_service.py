@@ -1,22 +1,35 @@
 """
 Service for folder-based triggers.
 Scans configured folders for new files and processes them via OCR + auto-classification.
+Seen-file state is kept in trigger_files; each file is processed by its own task.
 """
+import hashlib
 import os
 import shutil
-import tempfile
+import time
+from datetime import datetime, timedelta
 from pathlib import Path
+from typing import Optional
 from uuid import UUID
 
+from redis.exceptions import LockError
+
+from app.core.celery_app import PRIORITY_BULK
 from app.core.config import settings
 from app.core.database import SessionLocal
+from app.core.redis_client import get_redis
 from app.models.trigger import Trigger
+from app.models.trigger_file import TriggerFileStatus
 from app.services import ocr_service
+from app.services.highlight_service import save_page_images
 from app.services.llm_service import llm_service
 from app.services.semantic_index_service import semantic_index_service
 from app.services.storage_service import storage_service
+from app.tasks.render_tasks import enqueue_preview_rendering
 from app.crud import processing_run as run_crud
 from app.crud import document_type as document_type_crud
+from app.crud import trigger as trigger_crud
+from app.crud import trigger_file as trigger_file_crud
 from app.models.processed_document import DocumentStatus
 from app.models.processing_run import ProcessingStatus
 from app.schemas.processing_run import ProcessingSource
@@ -77,13 +90,15 @@ def _classify_document_type_sync(text: str, db):
     return None, items
 
 
-def _process_file(filepath: str, filename: str, trigger: Trigger, db):
-    """Process a single file: OCR → classify → extract fields → save."""
+def _process_file(filepath: str, filename: str, trigger: Trigger, db) -> bool:
+    """
+    Process a single file: OCR → classify → extract fields → save.
+    Returns False if the file was skipped (no text, unknown type).
+    """
     print(f"[FolderTrigger] Processing: {filename}")
 
     if not ocr_service.is_ocr_initialized():
-        print("[FolderTrigger] OCR not initialized, skipping")
-        return
+        raise RuntimeError("OCR not initialized")
 
     # Step 1: OCR without field extraction
     result = ocr_service.extract_document(filepath, [], document_type_id=None)
@@ -92,18 +107,18 @@ def _process_file(filepath: str, filename: str, trigger: Trigger, db):
         text = result.get("rawText") or result.get("rawTextRaw") or ""
         if not text.strip():
             print(f"[FolderTrigger] No text extracted from {filename}, skipping")
-            return
+            return False
 
         # Step 2: Classify document type
         document_type_id, candidates = _classify_document_type_sync(text, db)
         if not document_type_id:
             print(f"[FolderTrigger] Could not classify {filename}, skipping")
-            return
+            return False
 
         document_type = document_type_crud.get_document_type(db, document_type_id)
         if not document_type:
             print(f"[FolderTrigger] Document type {document_type_id} not found")
-            return
+            return False
 
         # Step 3: Create processing run
         trigger_name = Path(trigger.folder or "").name or "Триггер"
@@ -121,15 +136,9 @@ def _process_file(filepath: str, filename: str, trigger: Trigger, db):
         storage_key = storage_service.find_available_key([storage_prefix], filename)
         storage_service.save_file(filepath, storage_key, content_type=None)
 
-        # Save preview image
-        preview_path = None
-        page_images = result.get("pageImages", [])
-        if page_images:
-            first_page = page_images[0]
-            if os.path.exists(first_page) and not first_page.endswith(".txt"):
-                preview_key = storage_service.build_key(storage_prefix, f"{original_name}_preview.png")
-                storage_service.save_file(first_page, preview_key, content_type="image/png")
-                preview_path = preview_key
+        # Save page images; the first page doubles as the full-size preview
+        page_image_keys = save_page_images(result.get("pageImages", []), storage_prefix, original_name)
+        preview_path = page_image_keys[0] if page_image_keys else None
 
         file_size = os.path.getsize(filepath)
         document = run_crud.create_processed_document(
@@ -160,6 +169,7 @@ def _process_file(filepath: str, filename: str, trigger: Trigger, db):
                 "coordinate": f.get("coordinate"),
                 "group": f.get("group"),
                 "row_index": f.get("row_index"),
+                "page_index": f.get("page_index"),
                 "original_value": f["value"],
                 "is_corrected": False,
             }
@@ -172,6 +182,7 @@ def _process_file(filepath: str, filename: str, trigger: Trigger, db):
             "json_content": result.get("jsonContent", {}),
             "highlighted_image": None,
             "preview_image": preview_path,
+            "page_images": page_image_keys,
         }
 
         run_crud.update_document_extraction_results(
@@ -181,6 +192,7 @@ def _process_file(filepath: str, filename: str, trigger: Trigger, db):
             extracted_fields=extracted_fields_payload,
             status=DocumentStatus.NEEDS_REVIEW,
         )
+        enqueue_preview_rendering(document.id)
 
         # Step 6: Index in vector store
         raw_text = result.get("rawText", "")
@@ -204,6 +216,7 @@ def _process_file(filepath: str, filename: str, trigger: Trigger, db):
 
         run_crud.update_processing_run_status(db, processing_run.id, ProcessingStatus.NEEDS_REVIEW)
         print(f"[FolderTrigger] Successfully processed {filename} -> {document_type.name}")
+        return True
 
     finally:
         temp_dir = result.get("_temp_dir")
@@ -213,61 +226,199 @@ def _process_file(filepath: str, filename: str, trigger: Trigger, db):
 
 def scan_folder_triggers():
     """
-    Scan all enabled folder triggers for new files.
+    Fan out one scan task per enabled folder trigger.
     Called periodically by Celery beat.
     """
+    from app.tasks.trigger_tasks import scan_folder_trigger_task
+
     db = SessionLocal()
     try:
-        triggers = db.query(Trigger).filter(
-            Trigger.enabled == True,
-            Trigger.folder.isnot(None),
-        ).all()
+        trigger_ids = [
+            row.id for row in db.query(Trigger.id).filter(
+                Trigger.enabled == True,
+                Trigger.folder.isnot(None),
+            ).all()
+        ]
+    finally:
+        db.close()
+
+    for trigger_id in trigger_ids:
+        scan_folder_trigger_task.delay(str(trigger_id))
 
-        if not triggers:
+
+def scan_folder_trigger(trigger_id: str):
+    """
+    Enumerate one trigger folder and record new or changed files.
+    Only files whose (size, mtime) differ from the stored state are written;
+    processing itself happens in per-file tasks dispatched under the trigger's
+    concurrency limit. A Redis lock keeps scans of the same trigger from overlapping.
+    """
+    lock = get_redis().lock(
+        f"docflow:trigger-scan:{trigger_id}",
+        timeout=settings.TRIGGER_SCAN_LOCK_TIMEOUT,
+    )
+    if not lock.acquire(blocking=False):
+        print(f"[FolderTrigger] Scan of trigger {trigger_id} already running, skipping")
+        return
+
+    db = SessionLocal()
+    try:
+        trigger = trigger_crud.get_trigger(db, UUID(trigger_id))
+        if not trigger or not trigger.enabled or not trigger.folder:
+            return
+
+        folder = trigger.folder
+        if not os.path.isdir(folder):
+            print(f"[FolderTrigger] Folder not found: {folder}")
             return
 
-        for trigger in triggers:
-            folder = trigger.folder
-            if not folder or not os.path.isdir(folder):
-                print(f"[FolderTrigger] Folder not found: {folder}")
+        known = trigger_file_crud.get_file_states(db, trigger.id)
+        changed = []
+        # Files modified very recently may still be written; the next scan gets them.
+        settled_before = time.time() - settings.TRIGGER_STABLE_SECONDS
+        for entry in os.scandir(folder):
+            if not entry.is_file() or not _allowed_file(entry.name):
+                continue
+            stat = entry.stat()
+            if stat.st_mtime > settled_before:
                 continue
+            if known.get(entry.name) != (stat.st_size, stat.st_mtime):
+                changed.append((entry.name, stat.st_size, stat.st_mtime))
+
+        if changed:
+            print(f"[FolderTrigger] Found {len(changed)} new or changed file(s) in {folder}")
+            trigger_file_crud.record_seen_files(db, trigger.id, changed)
+
+        stale_before = datetime.utcnow() - timedelta(seconds=settings.TRIGGER_FILE_STALE_AFTER)
+        requeued = trigger_file_crud.requeue_stale_files(db, trigger.id, stale_before)
+        if requeued:
+            print(f"[FolderTrigger] Re-queued {requeued} stale file(s) in {folder}")
+        retried = trigger_file_crud.requeue_failed_files(
+            db, trigger.id, settings.TRIGGER_FILE_MAX_ATTEMPTS, settings.TRIGGER_FILE_RETRY_BACKOFF
+        )
+        if retried:
+            print(f"[FolderTrigger] Retrying {retried} failed file(s) in {folder}")
 
-            processed = set(trigger.processed_files or [])
-            new_files = []
+        dispatch_pending_files(db, trigger.id)
 
-            for entry in os.scandir(folder):
-                if not entry.is_file():
-                    continue
-                if not _allowed_file(entry.name):
-                    continue
-                if entry.name in processed:
-                    continue
-                new_files.append(entry.name)
+    except Exception as e:
+        print(f"[FolderTrigger] Scan of trigger {trigger_id} failed: {e}")
+        import traceback
+        traceback.print_exc()
+    finally:
+        db.close()
+        try:
+            lock.release()
+        except LockError:
+            pass
 
-            if not new_files:
-                continue
 
-            print(f"[FolderTrigger] Found {len(new_files)} new file(s) in {folder}")
+def register_ready_file(trigger_id: str, filename: str, size: int, mtime: float):
+    """Record a file reported by the folder watcher and dispatch it if a slot is free."""
+    if "/" in filename or os.sep in filename or not _allowed_file(filename):
+        return
+
+    db = SessionLocal()
+    try:
+        trigger = trigger_crud.get_trigger(db, UUID(trigger_id))
+        if not trigger or not trigger.enabled or not trigger.folder:
+            return
+        trigger_file_crud.record_seen_files(db, trigger.id, [(filename, size, mtime)])
+        dispatch_pending_files(db, trigger.id)
+    finally:
+        db.close()
+
+
+def dispatch_pending_files(db, trigger_id: UUID) -> int:
+    """Send processing tasks for pending files while the trigger has free slots."""
+    from app.tasks.trigger_tasks import process_trigger_file_task
+
+    files = trigger_file_crud.claim_pending_files(db, trigger_id, settings.TRIGGER_MAX_IN_FLIGHT)
+    for trigger_file in files:
+        try:
+            process_trigger_file_task.apply_async(
+                args=[str(trigger_file.id)],
+                task_id=trigger_file.task_id,
+                priority=PRIORITY_BULK,
+            )
+        except Exception as e:
+            print(f"[FolderTrigger] Failed to enqueue {trigger_file.path}: {e}")
+            trigger_file_crud.update_trigger_file_status(db, trigger_file.id, TriggerFileStatus.PENDING)
+    return len(files)
+
 
-            for filename in new_files:
-                filepath = os.path.join(folder, filename)
-                try:
-                    _process_file(filepath, filename, trigger, db)
-                    processed.add(filename)
-                except Exception as e:
-                    print(f"[FolderTrigger] Error processing {filename}: {e}")
-                    import traceback
-                    traceback.print_exc()
-                    # Still mark as processed to avoid retrying broken files forever
-                    processed.add(filename)
+def _file_hash(filepath: str) -> str:
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-            # Update processed files list
-            trigger.processed_files = list(processed)
-            db.commit()
+
+def process_trigger_file(trigger_file_id: str, task_id: Optional[str] = None):
+    """
+    Process one recorded trigger file. Files with the same content as an
+    already processed file of the trigger are skipped. Frees the slot and
+    dispatches the next pending file when done.
+    """
+    db = SessionLocal()
+    trigger_file = trigger_file_crud.get_trigger_file(db, UUID(trigger_file_id))
+    if not trigger_file:
+        db.close()
+        return
+    # A newer dispatch of the same file (after a stale re-queue) owns it now.
+    if task_id and trigger_file.task_id != task_id:
+        db.close()
+        return
+
+    trigger_id = trigger_file.trigger_id
+    try:
+        trigger = trigger_crud.get_trigger(db, trigger_id)
+        if not trigger or not trigger.enabled or not trigger.folder:
+            # Picked up again once the trigger is re-enabled.
+            trigger_file_crud.update_trigger_file_status(db, trigger_file.id, TriggerFileStatus.PENDING)
+            return
+
+        filepath = os.path.join(trigger.folder, trigger_file.path)
+        if not os.path.isfile(filepath):
+            trigger_file_crud.update_trigger_file_status(
+                db, trigger_file.id, TriggerFileStatus.ERROR, error="File not found", attempts=0
+            )
+            return
+
+        trigger_file_crud.update_trigger_file_status(db, trigger_file.id, TriggerFileStatus.PROCESSING)
+        content_hash = _file_hash(filepath)
+        duplicate = trigger_file_crud.find_processed_duplicate(db, trigger_id, content_hash, trigger_file.id)
+        if duplicate:
+            print(f"[FolderTrigger] {trigger_file.path} duplicates {duplicate.path}, skipping")
+            trigger_file_crud.update_trigger_file_status(
+                db, trigger_file.id, TriggerFileStatus.SKIPPED,
+                error=f"Duplicate of {duplicate.path}", content_hash=content_hash,
+            )
+            return
+
+        processed = _process_file(filepath, trigger_file.path, trigger, db)
+        trigger_file_crud.update_trigger_file_status(
+            db,
+            trigger_file.id,
+            TriggerFileStatus.DONE if processed else TriggerFileStatus.SKIPPED,
+            content_hash=content_hash,
+        )
 
     except Exception as e:
-        print(f"[FolderTrigger] Scan failed: {e}")
+        print(f"[FolderTrigger] Error processing {trigger_file.path}: {e}")
         import traceback
         traceback.print_exc()
+        db.rollback()
+        # Retried by the scanner after a backoff (requeue_failed_files); a changed file starts over.
+        failed = trigger_file_crud.get_trigger_file(db, UUID(trigger_file_id))
+        trigger_file_crud.update_trigger_file_status(
+            db, UUID(trigger_file_id), TriggerFileStatus.ERROR, error=str(e)[:1000],
+            attempts=(failed.attempts or 0) + 1 if failed else None,
+        )
     finally:
+        try:
+            dispatch_pending_files(db, trigger_id)
+        except Exception as e:
+            print(f"[FolderTrigger] Failed to dispatch pending files of trigger {trigger_id}: {e}")
         db.close()
@@ -0,0 +1,291 @@
+"""
+Event-driven watcher for folder triggers.
+
+Runs as a long-lived process (run_watcher.py) next to the Celery workers.
+Local folders are watched with inotify through watchdog; network mounts and
+hosts without watchdog fall back to polling with os.scandir. A file is
+reported once it is fully written: on close-after-write, or when its size and
+mtime have not changed for TRIGGER_STABLE_SECONDS. Ready files are sent to the
+task queue, where they are recorded in trigger_files and dispatched under the
+trigger's concurrency limit. The periodic beat scan stays as reconciliation.
+"""
+import os
+import queue
+import threading
+import time
+from typing import Callable, Optional
+
+from app.core.config import settings
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # pragma: no cover - optional dependency
+    FileSystemEventHandler = object
+    Observer = None
+
+# Filesystems where inotify does not see changes made by other hosts.
+NETWORK_FS_TYPES = {
+    "nfs", "nfs4", "cifs", "smb3", "smbfs", "9p", "afs", "ceph", "glusterfs",
+    "davfs", "fuse.sshfs", "fuse.rclone", "fuse.s3fs", "fuse.gcsfuse",
+}
+
+# Emit callback: (trigger_id, file name, size, mtime)
+ReadyCallback = Callable[[str, str, int, float], None]
+
+
+def _allowed_file(filename: str) -> bool:
+    return "." in filename and filename.rsplit(".", 1)[1].lower() in settings.ALLOWED_EXTENSIONS
+
+
+def filesystem_type(path: str) -> Optional[str]:
+    """Filesystem type of the mount containing path (Linux /proc/mounts), if known."""
+    try:
+        with open("/proc/mounts", encoding="utf-8") as f:
+            mounts = [line.split()[1:3] for line in f if line.strip()]
+    except OSError:
+        return None
+
+    path = os.path.realpath(path)
+    best_mount, best_type = "", None
+    for mount_point, fs_type in mounts:
+        mount_point = mount_point.replace("\\040", " ")
+        inside = path == mount_point or path.startswith(mount_point.rstrip("/") + "/")
+        if inside and len(mount_point) > len(best_mount):
+            best_mount, best_type = mount_point, fs_type
+    return best_type
+
+
+def choose_backend(folder: str, preferred: str = "auto") -> str:
+    """'inotify' or 'poll' for a folder given TRIGGER_WATCH_BACKEND."""
+    if preferred == "poll" or Observer is None:
+        return "poll"
+    if preferred == "inotify":
+        return "inotify"
+    return "poll" if filesystem_type(folder) in NETWORK_FS_TYPES else "inotify"
+
+
+class StableFileTracker:
+    """Holds candidate files until they are fully written."""
+
+    def __init__(self, stable_seconds: float):
+        self.stable_seconds = stable_seconds
+        # path -> (size, mtime, time of last observed change, closed after write)
+        self._candidates: dict[str, tuple[int, float, float, bool]] = {}
+
+    def __len__(self) -> int:
+        return len(self._candidates)
+
+    def touch(self, path: str, now: float, closed: bool = False) -> None:
+        """Register a change (or close-after-write) of a file."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._candidates.pop(path, None)
+            return
+        self._candidates[path] = (stat.st_size, stat.st_mtime, now, closed)
+
+    def discard(self, path: str) -> None:
+        self._candidates.pop(path, None)
+
+    def pop_ready(self, now: float) -> list[tuple[str, int, float]]:
+        """Files that were closed or kept the same size and mtime long enough."""
+        ready = []
+        for path, (size, mtime, changed_at, closed) in list(self._candidates.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self._candidates[path]
+                continue
+            if (stat.st_size, stat.st_mtime) != (size, mtime):
+                self._candidates[path] = (stat.st_size, stat.st_mtime, now, False)
+                continue
+            if closed or now - changed_at >= self.stable_seconds:
+                del self._candidates[path]
+                ready.append((path, size, mtime))
+        return ready
+
+
+class _EventHandler(FileSystemEventHandler):
+    """Forwards watchdog events of interest to the watcher's queue."""
+
+    def __init__(self, trigger_id: str, events: "queue.Queue[tuple[str, str, bool]]"):
+        super().__init__()
+        self.trigger_id = trigger_id
+        self.events = events
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.events.put((self.trigger_id, event.src_path, False))
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.events.put((self.trigger_id, event.src_path, False))
+
+    def on_moved(self, event):
+        # Files are often written to a temp name and renamed when complete.
+        if not event.is_directory:
+            self.events.put((self.trigger_id, event.dest_path, True))
+
+    def on_closed(self, event):
+        if not event.is_directory:
+            self.events.put((self.trigger_id, event.src_path, True))
+
+
+class _WatchedFolder:
+    def __init__(self, trigger_id: str, folder: str, backend: str):
+        self.trigger_id = trigger_id
+        self.folder = folder
+        self.backend = backend
+        self.tracker = StableFileTracker(settings.TRIGGER_STABLE_SECONDS)
+        self.watch = None
+        # Poll backend: last listing, name -> (size, mtime)
+        self.snapshot: dict[str, tuple[int, float]] = {}
+        self.next_poll = 0.0
+
+
+class FolderWatcher:
+    """Watches trigger folders and reports files that are ready for processing."""
+
+    def __init__(
+        self,
+        on_ready: ReadyCallback,
+        backend: Optional[str] = None,
+        poll_interval: Optional[float] = None,
+    ):
+        self.on_ready = on_ready
+        self.backend = backend or settings.TRIGGER_WATCH_BACKEND
+        self.poll_interval = poll_interval if poll_interval is not None else settings.TRIGGER_POLL_INTERVAL
+        self._folders: dict[str, _WatchedFolder] = {}
+        self._events: "queue.Queue[tuple[str, str, bool]]" = queue.Queue()
+        self._observer = None
+
+    @property
+    def folders(self) -> dict[str, str]:
+        return {trigger_id: watched.folder for trigger_id, watched in self._folders.items()}
+
+    def sync(self, folders: dict[str, str]) -> None:
+        """Start/stop watches so that exactly the given trigger folders are watched."""
+        for trigger_id, watched in list(self._folders.items()):
+            if folders.get(trigger_id) != watched.folder:
+                self._unwatch(watched)
+                del self._folders[trigger_id]
+
+        for trigger_id, folder in folders.items():
+            if trigger_id in self._folders or not os.path.isdir(folder):
+                continue
+            watched = _WatchedFolder(trigger_id, folder, choose_backend(folder, self.backend))
+            # Files already present are the beat scanner's backlog, not new events.
+            watched.snapshot = self._list_folder(folder)
+            if watched.backend == "inotify":
+                if self._observer is None:
+                    self._observer = Observer()
+                    self._observer.start()
+                watched.watch = self._observer.schedule(
+                    _EventHandler(trigger_id, self._events), folder, recursive=False
+                )
+            self._folders[trigger_id] = watched
+            print(f"[FolderWatcher] Watching {folder} ({watched.backend})")
+
+    def _unwatch(self, watched: _WatchedFolder) -> None:
+        if watched.watch is not None and self._observer is not None:
+            self._observer.unschedule(watched.watch)
+        print(f"[FolderWatcher] Stopped watching {watched.folder}")
+
+    @staticmethod
+    def _list_folder(folder: str) -> dict[str, tuple[int, float]]:
+        listing = {}
+        try:
+            for entry in os.scandir(folder):
+                if entry.is_file() and _allowed_file(entry.name):
+                    stat = entry.stat()
+                    listing[entry.name] = (stat.st_size, stat.st_mtime)
+        except OSError as e:
+            print(f"[FolderWatcher] Cannot list {folder}: {e}")
+        return listing
+
+    def _poll(self, watched: _WatchedFolder, now: float) -> None:
+        listing = self._list_folder(watched.folder)
+        for name, stats in listing.items():
+            if watched.snapshot.get(name) != stats:
+                watched.tracker.touch(os.path.join(watched.folder, name), now)
+        watched.snapshot = listing
+
+    def _drain_events(self, now: float) -> None:
+        while True:
+            try:
+                trigger_id, path, closed = self._events.get_nowait()
+            except queue.Empty:
+                return
+            watched = self._folders.get(trigger_id)
+            if watched is None or os.path.dirname(path) != watched.folder.rstrip(os.sep):
+                continue
+            if _allowed_file(os.path.basename(path)):
+                watched.tracker.touch(path, now, closed=closed)
+
+    def tick(self, now: Optional[float] = None) -> int:
+        """Process pending events/polls and emit ready files. Returns number emitted."""
+        now = time.monotonic() if now is None else now
+        self._drain_events(now)
+
+        emitted = 0
+        for watched in list(self._folders.values()):
+            if watched.backend == "poll" and now >= watched.next_poll:
+                self._poll(watched, now)
+                watched.next_poll = now + self.poll_interval
+
+            for path, size, mtime in watched.tracker.pop_ready(now):
+                try:
+                    self.on_ready(watched.trigger_id, os.path.basename(path), size, mtime)
+                    emitted += 1
+                except Exception as e:
+                    print(f"[FolderWatcher] Failed to report {path}: {e}")
+                    # Try again on a later tick.
+                    watched.tracker.touch(path, now)
+        return emitted
+
+    def run(self, load_folders: Callable[[], dict[str, str]], stop: threading.Event) -> None:
+        """Main loop: refresh the trigger list periodically and tick once per second."""
+        next_sync = 0.0
+        try:
+            while not stop.is_set():
+                now = time.monotonic()
+                if now >= next_sync:
+                    try:
+                        self.sync(load_folders())
+                    except Exception as e:
+                        print(f"[FolderWatcher] Failed to load triggers: {e}")
+                    next_sync = now + settings.TRIGGER_WATCH_RELOAD_INTERVAL
+                self.tick(now)
+                stop.wait(1.0)
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout=5)
+            self._observer = None
+
+
+def load_trigger_folders() -> dict[str, str]:
+    """Enabled folder triggers as trigger id -> folder."""
+    from app.core.database import SessionLocal
+    from app.models.trigger import Trigger
+
+    db = SessionLocal()
+    try:
+        rows = db.query(Trigger.id, Trigger.folder).filter(
+            Trigger.enabled == True,
+            Trigger.folder.isnot(None),
+        ).all()
+        return {str(trigger_id): folder for trigger_id, folder in rows if folder}
+    finally:
+        db.close()
+
+
+def enqueue_ready_file(trigger_id: str, filename: str, size: int, mtime: float) -> None:
+    """Default ReadyCallback: hand the file over to the task queue."""
+    from app.tasks.trigger_tasks import trigger_file_ready_task
+
+    trigger_file_ready_task.delay(trigger_id, filename, size, mtime)
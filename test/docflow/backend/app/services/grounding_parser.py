@@ -0,0 +1,169 @@
+"""
+Incremental parser for DeepSeek OCR 2 grounding output.
+
+DeepSeek output format:
+<|ref|>label<|/ref|><|det|>[[x1, y1, x2, y2]]<|/det|>
+text content (on next lines until next <|ref|> or end)
+
+The parser consumes the output once, either as a whole string or chunk by
+chunk while generate() is still streaming, and produces grounding blocks,
+clean markdown and HTML tables in the same pass.
+"""
+import re
+from typing import Optional
+
+REF_OPEN = "<|ref|>"
+DET_CLOSE = "<|/det|>"
+
+_HEADER_RE = re.compile(r"^([^<]*)<\|/ref\|><\|det\|>([\s\S]*)$")
+_BOX_RE = re.compile(r"^\[\[(\d+),\s*(\d+),\s*(\d+),\s*(\d+)\]\]$")
+_SPECIAL_TAG_RE = re.compile(r"<\|/?[^|]+\|>")
+_EXTRA_NEWLINES_RE = re.compile(r"\n{3,}")
+_TABLE_HTML_RE = re.compile(r"<table[\s\S]*?</table>", re.IGNORECASE)
+
+# DeepSeek coordinates are normalized to a 1000x1000 grid.
+GROUNDING_SCALE = 1000
+
+
+class GroundingStreamParser:
+    """Single-pass grounding parser that can be fed while tokens are generated."""
+
+    def __init__(self, img_width: int, img_height: int):
+        self.img_width = img_width
+        self.img_height = img_height
+        self.blocks: list[dict] = []
+        self.tables: list[str] = []
+        self._markdown_parts: list[str] = []
+        self._raw_parts: list[str] = []
+        self._pending = ""
+        self._in_header = False
+        # Whitespace right after a grounding header is not part of the content
+        self._skip_whitespace = False
+        # Block the current content belongs to (None for preamble/malformed refs)
+        self._current_block: Optional[dict] = None
+        self._content_parts: list[str] = []
+        self._closed = False
+
+    def feed(self, chunk: str) -> list[dict]:
+        """Consume a chunk of model output and return blocks completed by it."""
+        if not chunk or self._closed:
+            return []
+        self._raw_parts.append(chunk)
+        self._pending += chunk
+        completed_before = len(self.blocks)
+        self._consume(final=False)
+        return self.blocks[completed_before:]
+
+    def close(self) -> dict:
+        """Flush buffered output and return the parse result."""
+        if not self._closed:
+            self._consume(final=True)
+            self._closed = True
+        markdown = "".join(self._markdown_parts)
+        markdown = _EXTRA_NEWLINES_RE.sub("\n\n", markdown).strip()
+        return {
+            "blocks": self.blocks,
+            "markdown": markdown,
+            "tables": self.tables,
+            "raw": "".join(self._raw_parts),
+        }
+
+    def _consume(self, final: bool) -> None:
+        while True:
+            if self._in_header:
+                if not self._consume_header(final):
+                    return
+            else:
+                if not self._consume_content(final):
+                    return
+
+    def _consume_content(self, final: bool) -> bool:
+        if self._skip_whitespace:
+            self._pending = self._pending.lstrip()
+            if not self._pending and not final:
+                return False
+            self._skip_whitespace = False
+
+        pos = self._pending.find(REF_OPEN)
+        if pos == -1:
+            # Keep a tail that might be the beginning of a split <|ref|> marker.
+            keep = 0 if final else len(REF_OPEN) - 1
+            cut = max(0, len(self._pending) - keep)
+            if cut:
+                self._content_parts.append(self._pending[:cut])
+                self._pending = self._pending[cut:]
+            if final:
+                self._finish_segment()
+            return False
+
+        self._content_parts.append(self._pending[:pos])
+        self._pending = self._pending[pos + len(REF_OPEN):]
+        self._finish_segment()
+        self._in_header = True
+        return True
+
+    def _consume_header(self, final: bool) -> bool:
+        det_pos = self._pending.find(DET_CLOSE)
+        ref_pos = self._pending.find(REF_OPEN)
+        if det_pos == -1 or (ref_pos != -1 and ref_pos < det_pos):
+            if ref_pos == -1 and not final:
+                return False
+            # Malformed reference: keep its text as plain content.
+            end = ref_pos if ref_pos != -1 else len(self._pending)
+            self._content_parts.append(self._pending[:end])
+            self._pending = self._pending[end:]
+            self._in_header = False
+            return True
+
+        header = self._pending[:det_pos]
+        self._pending = self._pending[det_pos + len(DET_CLOSE):]
+        self._in_header = False
+        self._skip_whitespace = True
+        self._start_block(header)
+        return True
+
+    def _start_block(self, header: str) -> None:
+        match = _HEADER_RE.match(header)
+        box = _BOX_RE.match(match.group(2).strip()) if match else None
+        if not match or not box:
+            # Grounded but not a single box: content stays in markdown only.
+            self._current_block = None
+            return
+
+        x1, y1, x2, y2 = (int(v) for v in box.groups())
+        block = {
+            "block_id": len(self.blocks),
+            "block_label": match.group(1).strip(),
+            "block_content": "",
+            "block_bbox": [
+                int(x1 * self.img_width / GROUNDING_SCALE),
+                int(y1 * self.img_height / GROUNDING_SCALE),
+                int(x2 * self.img_width / GROUNDING_SCALE),
+                int(y2 * self.img_height / GROUNDING_SCALE),
+            ],
+        }
+        self._current_block = block
+
+    def _finish_segment(self) -> None:
+        content = "".join(self._content_parts)
+        self._content_parts = []
+        block = self._current_block
+        self._current_block = None
+
+        if block is not None:
+            block["block_content"] = content.strip()
+            self.blocks.append(block)
+
+        if not content:
+            return
+        cleaned = _SPECIAL_TAG_RE.sub("", content)
+        self._markdown_parts.append(_EXTRA_NEWLINES_RE.sub("\n\n", cleaned))
+        if "<table" in content.lower():
+            self.tables.extend(_TABLE_HTML_RE.findall(content))
+
+
+def parse_grounding(text: str, img_width: int, img_height: int) -> dict:
+    """Parse a complete grounding output string."""
+    parser = GroundingStreamParser(img_width, img_height)
+    parser.feed(text or "")
+    return parser.close()
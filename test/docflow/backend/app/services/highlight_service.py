@@ -0,0 +1,157 @@
+"""
+Per-page highlight and preview rendering for processed documents.
+
+Page images are stored once during processing; highlighted pages are
+rendered lazily on first request and cached in storage under a key that
+depends on the fields drawn, so corrected values produce a fresh tile.
+Downscaled preview variants are rendered after extraction by a Celery task.
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Optional
+
+from app.core.config import settings
+from app.services.document_converter import is_pdf, is_word
+from app.services.image_rendering import (
+    IMAGE_CONTENT_TYPES,
+    IMAGE_EXTENSIONS,
+    render_highlight,
+    render_variants,
+    run_rendering,
+)
+from app.services.storage_service import storage_service
+
+
+def save_page_images(page_images: list[str], storage_prefix: str, original_name: str) -> list[Optional[str]]:
+    """
+    Upload page images of a converted document and return their object keys.
+    The list is aligned with page indices; non-image pages map to None.
+    """
+    keys: list[Optional[str]] = []
+    for page_index, page_path in enumerate(page_images or []):
+        if page_path.endswith(".txt") or not os.path.exists(page_path):
+            keys.append(None)
+            continue
+        key = storage_service.build_key(storage_prefix, f"{original_name}_pages", f"page_{page_index + 1}.png")
+        storage_service.save_file(page_path, key, content_type="image/png")
+        keys.append(key)
+    return keys
+
+
+def get_page_image_key(document, page_index: int) -> Optional[str]:
+    """Object key of the source image for a page of a processed document."""
+    page_keys = (document.ocr_result or {}).get("page_images") or []
+    if page_keys:
+        return page_keys[page_index] if 0 <= page_index < len(page_keys) else None
+    # Single image uploads are their own first page.
+    if page_index == 0 and document.file_path and not (is_pdf(document.filename) or is_word(document.filename)):
+        return document.file_path
+    return None
+
+
+def _page_fields(document, page_index: int) -> list[dict]:
+    return [
+        f for f in (document.extracted_fields or [])
+        if (f.get("page_index") or 0) == page_index
+    ]
+
+
+def _rendered_format() -> tuple[str, str, str]:
+    image_format = settings.PREVIEW_FORMAT.upper()
+    if image_format not in IMAGE_EXTENSIONS:
+        image_format = "WEBP"
+    return image_format, IMAGE_EXTENSIONS[image_format], IMAGE_CONTENT_TYPES[image_format]
+
+
+def _storage_prefix(document) -> str:
+    return document.file_path.rsplit("/", 1)[0] if "/" in (document.file_path or "") else ""
+
+
+def _highlight_key(document, page_index: int, fields: list[dict], extension: str) -> str:
+    payload = json.dumps(
+        [[f.get("name"), f.get("value"), f.get("coordinate")] for f in fields],
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    digest = hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
+    stem = Path(document.filename).stem
+    return storage_service.build_key(
+        _storage_prefix(document), f"{stem}_highlights", f"page_{page_index + 1}_{digest}.{extension}"
+    )
+
+
+def get_page_highlight_key(document, page_index: int) -> Optional[str]:
+    """
+    Return the object key of the highlighted page, rendering it on first use.
+    Falls back to the plain page image when nothing on the page is highlighted.
+    Rendering runs in the render process pool, not in the request thread.
+    """
+    page_key = get_page_image_key(document, page_index)
+    if not page_key:
+        return None
+
+    fields = _page_fields(document, page_index)
+    if not fields:
+        return page_key
+
+    image_format, extension, content_type = _rendered_format()
+    highlight_key = _highlight_key(document, page_index, fields, extension)
+    if storage_service.exists(highlight_key):
+        return highlight_key
+
+    rendered = run_rendering(
+        render_highlight,
+        storage_service.read_bytes(page_key),
+        fields,
+        document.json_content or {},
+        page_index=page_index,
+        image_format=image_format,
+        quality=settings.PREVIEW_QUALITY,
+    )
+    if not rendered:
+        return page_key
+
+    storage_service.save_bytes(rendered, highlight_key, content_type=content_type)
+    return highlight_key
+
+
+def render_preview_variants(document) -> dict[str, str]:
+    """
+    Render downscaled first-page previews for every configured width.
+    Returns map width (as str, JSON-friendly) -> object key.
+    """
+    page_key = get_page_image_key(document, 0)
+    if not page_key:
+        return {}
+
+    image_format, extension, content_type = _rendered_format()
+    rendered = run_rendering(
+        render_variants,
+        storage_service.read_bytes(page_key),
+        settings.PREVIEW_WIDTHS,
+        image_format=image_format,
+        quality=settings.PREVIEW_QUALITY,
+    )
+
+    stem = Path(document.filename).stem
+    variants: dict[str, str] = {}
+    for width, data in rendered.items():
+        key = storage_service.build_key(_storage_prefix(document), f"{stem}_previews", f"w{width}.{extension}")
+        storage_service.save_bytes(data, key, content_type=content_type)
+        variants[str(width)] = key
+    return variants
+
+
+def pick_preview_variant(variants: dict[str, str], width: Optional[int]) -> Optional[str]:
+    """Pick the smallest variant at least `width` wide, else the largest one."""
+    if not variants:
+        return None
+    sizes = sorted(int(w) for w in variants)
+    if width is None:
+        return variants[str(sizes[-1])]
+    for size in sizes:
+        if size >= width:
+            return variants[str(size)]
+    return variants[str(sizes[-1])]
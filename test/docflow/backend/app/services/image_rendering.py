@@ -0,0 +1,201 @@
+"""
+CPU-bound image rendering: field highlights and downscaled preview variants.
+
+Functions here take and return bytes and import nothing heavy, so they can
+run in a separate process pool without loading the OCR model.
+"""
+import io
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from app.core.config import settings
+from app.services.block_index import get_block_index
+
+# Color palette for different fields: (outline, semi-transparent fill)
+FIELD_COLORS = [
+    ((231, 76, 60), (231, 76, 60, 80)),      # Red
+    ((52, 152, 219), (52, 152, 219, 80)),    # Blue
+    ((155, 89, 182), (155, 89, 182, 80)),    # Purple
+    ((46, 204, 113), (46, 204, 113, 80)),    # Green
+    ((243, 156, 18), (243, 156, 18, 80)),    # Orange
+    ((26, 188, 156), (26, 188, 156, 80)),    # Teal
+    ((230, 126, 34), (230, 126, 34, 80)),    # Dark Orange
+    ((22, 160, 133), (22, 160, 133, 80)),    # Dark Teal
+]
+
+IMAGE_CONTENT_TYPES = {
+    "WEBP": "image/webp",
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+}
+
+IMAGE_EXTENSIONS = {
+    "WEBP": "webp",
+    "JPEG": "jpg",
+    "PNG": "png",
+}
+
+
+def draw_field_highlights(img, extracted_fields: list[dict], json_content: dict, page_index: Optional[int] = None) -> int:
+    """
+    Draw extracted fields onto a PIL image in place.
+
+    Fields without a coordinate are located by value in json_content. If
+    page_index is set, only fields and blocks of that page are used (items
+    without a page index belong to the first page).
+
+    Returns:
+        Number of highlighted fields
+    """
+    from PIL import ImageDraw, ImageFont
+
+    if page_index is not None:
+        extracted_fields = [
+            f for f in extracted_fields
+            if (f.get("page_index") or 0) == page_index
+        ]
+        json_content = {
+            "parsing_res_list": [
+                b for b in json_content.get("parsing_res_list", [])
+                if (b.get("page_index") or 0) == page_index
+            ]
+        }
+
+    draw = ImageDraw.Draw(img, 'RGBA')
+
+    # Value -> block lookup over json_content for fields without coordinates
+    block_index = get_block_index(json_content)
+
+    # Try to load a font for labels
+    try:
+        font = ImageFont.truetype("arial.ttf", 14)
+    except Exception:
+        font = ImageFont.load_default()
+
+    field_colors = {}
+    color_idx = 0
+    highlighted_count = 0
+
+    for field in extracted_fields:
+        field_name = field.get("name", "")
+        field_value = field.get("value", "")
+
+        # Skip "Не найдено" fields
+        if field_value == "Не найдено":
+            continue
+
+        # Get bbox from field's coordinate or try to find by value
+        bbox = field.get("coordinate")
+        if not bbox:
+            bbox = block_index.find_overlapping_coordinate(field_value)
+
+        if not bbox or len(bbox) != 4:
+            continue
+
+        # Assign color to field
+        if field_name not in field_colors:
+            field_colors[field_name] = FIELD_COLORS[color_idx % len(FIELD_COLORS)]
+            color_idx += 1
+
+        line_color, fill_color = field_colors[field_name]
+
+        x1, y1, x2, y2 = (int(v) for v in bbox)
+
+        # Draw semi-transparent fill
+        draw.rectangle([x1, y1, x2, y2], fill=fill_color, outline=line_color, width=2)
+
+        # Draw label above the box
+        label = f"{field_name}: {field_value[:30]}..." if len(str(field_value)) > 30 else f"{field_name}: {field_value}"
+        text_bbox = draw.textbbox((x1, y1 - 18), label, font=font)
+
+        # Background for label
+        draw.rectangle(
+            [text_bbox[0] - 2, text_bbox[1] - 2, text_bbox[2] + 2, text_bbox[3] + 2],
+            fill=line_color
+        )
+        draw.text((x1, y1 - 18), label, fill=(255, 255, 255), font=font)
+        highlighted_count += 1
+
+    return highlighted_count
+
+
+def _encode(img, image_format: str, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    if image_format == "PNG":
+        img.save(buffer, format="PNG", optimize=True)
+    elif image_format == "WEBP":
+        img.save(buffer, format="WEBP", quality=quality, method=4)
+    else:
+        img.save(buffer, format=image_format, quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def render_highlight(
+    image_bytes: bytes,
+    extracted_fields: list[dict],
+    json_content: dict,
+    page_index: Optional[int] = None,
+    image_format: str = "WEBP",
+    quality: int = 85,
+) -> Optional[bytes]:
+    """Render highlighted fields on an encoded page image; None if nothing was drawn."""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(image_bytes)) as source:
+        img = source.convert('RGB')
+    if draw_field_highlights(img, extracted_fields, json_content, page_index=page_index) == 0:
+        return None
+    return _encode(img, image_format, quality)
+
+
+def render_variants(
+    image_bytes: bytes,
+    widths: list[int],
+    image_format: str = "WEBP",
+    quality: int = 80,
+) -> dict[int, bytes]:
+    """
+    Downscale an encoded image to each target width. Widths above the source
+    width are skipped; the original image already serves those requests.
+    """
+    from PIL import Image
+
+    variants: dict[int, bytes] = {}
+    with Image.open(io.BytesIO(image_bytes)) as source:
+        img = source.convert('RGB')
+        for width in sorted(set(widths), reverse=True):
+            if width <= 0 or width > img.width:
+                continue
+            target_height = max(1, round(img.height * width / img.width))
+            resized = img if width == img.width else img.resize((width, target_height), Image.LANCZOS)
+            variants[width] = _encode(resized, image_format, quality)
+            # Next (smaller) size is computed from the already reduced image.
+            img = resized
+    return variants
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> Optional[ProcessPoolExecutor]:
+    global _pool
+    if settings.RENDER_POOL_WORKERS <= 0:
+        return None
+    # Daemonic processes (e.g. Celery prefork children) cannot spawn a pool.
+    if multiprocessing.current_process().daemon:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=settings.RENDER_POOL_WORKERS)
+        return _pool
+
+
+def run_rendering(func, *args, **kwargs):
+    """Run a rendering function in the render process pool, or inline if unavailable."""
+    pool = _get_pool()
+    if pool is None:
+        return func(*args, **kwargs)
+    return pool.submit(func, *args, **kwargs).result()
@@ -0,0 +1,563 @@
+"""
+Layout templates: deterministic extraction of scalar fields for document
+types whose documents share a layout.
+
+A template is learned from the reviewed documents of a type (and the
+corrected fields of unreviewed ones): for every field, where its value sat
+in the OCR blocks. Three kinds of rules are proposed per document:
+
+- inline:   the value follows an anchor text in the same block line, or is
+            the line below it ("ИНН 7701234567", "Поставщик:\\nООО Ромашка");
+- neighbor: the value is a block at a fixed offset from a label block
+            ("Итого:" on the left or above);
+- position: the value is the block at a fixed place on the page.
+
+Anchors keep their words; number-like tokens match any number, so
+"Счёт № 4711 от" matches every invoice. Rules proposed by at least
+LAYOUT_TEMPLATE_MIN_SUPPORT documents are replayed on every training
+document; the share of correct values (hits / (tries + 1)) is the rule's
+precision. A rule whose anchor is missing does not count, such documents go
+to the LLM. When a new document comes in, a field whose best applicable rule
+reaches LAYOUT_TEMPLATE_MIN_CONFIDENCE (and whose value has the usual shape,
+e.g. 99.99.9999 for dates) is taken without the LLM; the LLM is called only
+for the remaining fields. Table groups always go to the LLM.
+
+Templates are retrained by a Celery task a minute after documents of the
+type are reviewed or corrected, cached per process and invalidated through
+a version in Redis like the few-shot store. Hit rate and latency per
+document are counted per type, see GET /document-types/{id}/layout-template.
+"""
+import math
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Iterable, Optional
+from uuid import UUID
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.redis_client import get_redis
+from app.crud import layout_template as template_crud
+
+VERSION_KEY_PREFIX = "docflow:layout-template:version"
+STATS_KEY_PREFIX = "docflow:layout-template:stats"
+TRAIN_LOCK_PREFIX = "docflow:layout-template:train"
+MISSING_TRAIN_INTERVAL = 3600  # types without a template are trained at most once an hour
+
+# Rules replayed per field during training and kept per field afterwards
+MAX_CANDIDATE_RULES = 8
+MAX_FIELD_RULES = 3
+MIN_RULE_PRECISION = 0.5
+# A field keeps its value shape only if most training values have it
+SHAPE_SHARE = 0.8
+SHAPE_MISMATCH_PENALTY = 0.5
+ANCHOR_WORDS = 5
+LABEL_MAX_CHARS = 60
+# Offsets and positions are fractions of the page size
+POSITION_TOLERANCE = 0.03
+OFFSET_BUCKET = 0.02
+NUMBER_TOKEN = "<n>"
+_EMPTY_VALUES = ("", "Не найдено", "Ошибка извлечения")
+_ANCHOR_TRIM = " \t:;-–—|"
+_VALUE_TRIM = " \t:;-–—|"
+
+
+@dataclass
+class _Block:
+    text: str
+    page: int
+    x: float
+    y: float
+    x2: float
+    y2: float
+    bbox: list
+
+    @property
+    def lines(self) -> list[str]:
+        return [line.strip() for line in self.text.split("\n") if line.strip()]
+
+
+def _norm(value) -> str:
+    return " ".join(str(value or "").lower().split())
+
+
+def _shape(value: str) -> str:
+    """12.03.2026 -> 9.9.9, ООО Ромашка -> a a."""
+    shape = re.sub(r"\d+", "9", value.strip())
+    return re.sub(r"[^\W\d_]+", "a", shape)
+
+
+def _layout(json_content: Optional[dict]) -> list[_Block]:
+    """OCR blocks with bboxes scaled to their page (0..1)."""
+    if not json_content:
+        return []
+    raw = [
+        block for block in json_content.get("parsing_res_list") or []
+        if str(block.get("block_content") or "").strip() and len(block.get("block_bbox") or []) == 4
+    ]
+    sizes = {
+        page.get("page_index"): (page.get("width"), page.get("height"))
+        for page in json_content.get("pages") or []
+    }
+    extents: dict[int, tuple[float, float]] = {}
+    for block in raw:
+        page = int(block.get("page_index") or 0)
+        x2, y2 = block["block_bbox"][2], block["block_bbox"][3]
+        width, height = extents.get(page, (0.0, 0.0))
+        extents[page] = (max(width, x2), max(height, y2))
+
+    blocks = []
+    for block in raw:
+        page = int(block.get("page_index") or 0)
+        width, height = sizes.get(page) or (json_content.get("width"), json_content.get("height"))
+        width = width or extents[page][0] or 1.0
+        height = height or extents[page][1] or 1.0
+        x1, y1, x2, y2 = block["block_bbox"]
+        blocks.append(_Block(
+            text=str(block["block_content"]).strip(),
+            page=page,
+            x=x1 / width,
+            y=y1 / height,
+            x2=x2 / width,
+            y2=y2 / height,
+            bbox=block["block_bbox"],
+        ))
+    return blocks
+
+
+# Anchors
+
+def _anchor(text: str) -> str:
+    """Last words of a label, number-like tokens generalized."""
+    words = text.strip(_ANCHOR_TRIM).lower().split()[-ANCHOR_WORDS:]
+    words = [NUMBER_TOKEN if any(c.isdigit() for c in word) else word for word in words]
+    while words and words[0] == NUMBER_TOKEN:
+        words.pop(0)
+    if not any(len(word) > 1 and any(c.isalpha() for c in word) for word in words):
+        return ""
+    return " ".join(words)
+
+
+_pattern_cache: dict[str, re.Pattern] = {}
+
+
+def _anchor_pattern(anchor: str) -> re.Pattern:
+    pattern = _pattern_cache.get(anchor)
+    if pattern is None:
+        parts = [r"\S*\d\S*" if word == NUMBER_TOKEN else re.escape(word) for word in anchor.split()]
+        pattern = re.compile(r"(?<!\w)" + r"\s+".join(parts), re.IGNORECASE)
+        _pattern_cache[anchor] = pattern
+    return pattern
+
+
+def _take_mode(value: str, text: str):
+    """How the value is cut from the text after its anchor: whole block, first line or N words."""
+    if _norm(text) == _norm(value):
+        return "block"
+    first_line = text.strip(_VALUE_TRIM).split("\n")[0]
+    if _norm(first_line) == _norm(value):
+        return "line"
+    return len(value.split())
+
+
+def _take(text: str, mode) -> str:
+    text = text.strip(_VALUE_TRIM)
+    if mode == "block":
+        return text
+    if mode == "line":
+        return text.split("\n")[0].strip()
+    return " ".join(text.split()[:int(mode)])
+
+
+# Rules
+
+def _candidate_rules(value: str, blocks: list[_Block]) -> list[dict]:
+    needle = value.lower()
+    rules = []
+    for block in blocks:
+        lines = block.lines
+        for line_no, line in enumerate(lines):
+            pos = line.lower().find(needle)
+            if pos < 0:
+                continue
+            after = "\n".join([line[pos:]] + lines[line_no + 1:])
+            anchor = _anchor(line[:pos])
+            if anchor:
+                rules.append({"kind": "inline", "anchor": anchor, "line": 0, "take": _take_mode(value, after)})
+            elif line_no > 0 and _anchor(lines[line_no - 1]):
+                rules.append({
+                    "kind": "inline",
+                    "anchor": _anchor(lines[line_no - 1]),
+                    "line": 1,
+                    "take": _take_mode(value, after),
+                })
+            if pos == 0 and line_no == 0:
+                take = _take_mode(value, block.text)
+                label = _label_of(block, blocks)
+                if label is not None:
+                    rules.append({
+                        "kind": "neighbor",
+                        "anchor": _anchor(label.lines[-1]),
+                        "dx": round(round((block.x - label.x) / OFFSET_BUCKET) * OFFSET_BUCKET, 3),
+                        "dy": round(round((block.y - label.y) / OFFSET_BUCKET) * OFFSET_BUCKET, 3),
+                        "take": take,
+                    })
+                rules.append({
+                    "kind": "position",
+                    "page": block.page,
+                    "x": round(round(block.x / OFFSET_BUCKET) * OFFSET_BUCKET, 3),
+                    "y": round(round(block.y / OFFSET_BUCKET) * OFFSET_BUCKET, 3),
+                    "take": take,
+                })
+        if rules:
+            # The first block holding the value, like BlockIndex.find_block
+            break
+    return rules
+
+
+def _label_of(block: _Block, blocks: list[_Block]) -> Optional[_Block]:
+    """Closest short text block on the left (same row) or above (same column)."""
+    best, best_distance = None, None
+    for other in blocks:
+        if other is block or other.page != block.page or len(other.text) > LABEL_MAX_CHARS:
+            continue
+        if not other.lines or not _anchor(other.lines[-1]):
+            continue
+        if other.y < block.y2 and other.y2 > block.y and other.x2 <= block.x + POSITION_TOLERANCE:
+            distance = block.x - other.x2
+        elif other.x < block.x2 and other.x2 > block.x and other.y2 <= block.y + POSITION_TOLERANCE:
+            distance = block.y - other.y2
+        else:
+            continue
+        if best_distance is None or distance < best_distance:
+            best, best_distance = other, distance
+    return best
+
+
+def _rule_key(rule: dict) -> tuple:
+    return tuple(sorted(rule.items()))
+
+
+def _nearest(blocks: list[_Block], page: int, x: float, y: float, exclude=None) -> Optional[_Block]:
+    best, best_distance = None, POSITION_TOLERANCE
+    for block in blocks:
+        if block.page != page or block is exclude:
+            continue
+        distance = math.hypot(block.x - x, block.y - y)
+        if distance <= best_distance:
+            best, best_distance = block, distance
+    return best
+
+
+def _apply(rule: dict, blocks: list[_Block]) -> Optional[tuple[str, _Block]]:
+    """(value, block) the rule points to in a document; None if the rule does not apply."""
+    kind = rule["kind"]
+    if kind == "inline":
+        pattern = _anchor_pattern(rule["anchor"])
+        for block in blocks:
+            lines = block.lines
+            for line_no, line in enumerate(lines):
+                match = pattern.search(line)
+                if not match:
+                    continue
+                if rule["line"]:
+                    if match.end() < len(line.rstrip(_ANCHOR_TRIM)) or line_no + 1 >= len(lines):
+                        continue
+                    after = "\n".join(lines[line_no + 1:])
+                else:
+                    after = "\n".join([line[match.end():]] + lines[line_no + 1:])
+                value = _take(after, rule["take"])
+                if value:
+                    return value, block
+        return None
+
+    if kind == "neighbor":
+        pattern = _anchor_pattern(rule["anchor"])
+        for label in blocks:
+            if len(label.text) > LABEL_MAX_CHARS or not label.lines:
+                continue
+            if not pattern.fullmatch(label.lines[-1].strip(_ANCHOR_TRIM)):
+                continue
+            block = _nearest(blocks, label.page, label.x + rule["dx"], label.y + rule["dy"], exclude=label)
+            if block:
+                value = _take(block.text, rule["take"])
+                if value:
+                    return value, block
+        return None
+
+    block = _nearest(blocks, rule["page"], rule["x"], rule["y"])
+    if block:
+        value = _take(block.text, rule["take"])
+        if value:
+            return value, block
+    return None
+
+
+def _truths(fields: Optional[list], reviewed: bool) -> tuple[dict[str, str], set[str]]:
+    """Field values to learn from (all fields of reviewed documents, corrected ones otherwise) and corrected names."""
+    values: dict[str, list[str]] = {}
+    corrected: set[str] = set()
+    for f in fields or []:
+        if not isinstance(f, dict) or f.get("group"):
+            continue
+        name, value = f.get("name"), str(f.get("value") or "").strip()
+        if not name or value in _EMPTY_VALUES:
+            continue
+        if f.get("is_corrected") and f.get("original_value") not in (None, value):
+            corrected.add(name)
+        if reviewed or f.get("is_corrected"):
+            values.setdefault(name, []).append(value)
+    # Fields found several times have no single place
+    return {name: found[0] for name, found in values.items() if len(found) == 1}, corrected
+
+
+def train(documents: Iterable[tuple]) -> tuple[dict, int]:
+    """Template from (is reviewed, extracted fields, json_content) of documents; returns (template, documents used)."""
+    samples: list[tuple[list[_Block], dict[str, str]]] = []
+    support: dict[str, Counter] = {}
+    rules_by_key: dict[tuple, dict] = {}
+    corrections: Counter = Counter()
+    for reviewed, fields, json_content in documents:
+        blocks = _layout(json_content)
+        truths, corrected = _truths(fields, bool(reviewed))
+        if not blocks or not truths:
+            continue
+        corrections.update(corrected & set(truths))
+        samples.append((blocks, truths))
+        for name, value in truths.items():
+            keys = set()
+            for rule in _candidate_rules(value, blocks):
+                key = _rule_key(rule)
+                rules_by_key[key] = rule
+                keys.add(key)
+            support.setdefault(name, Counter()).update(keys)
+
+    template: dict = {"fields": {}, "shapes": {}, "corrections": {}}
+    for name, counter in support.items():
+        values = [truths[name] for _, truths in samples if name in truths]
+        shape, count = Counter(_shape(value) for value in values).most_common(1)[0]
+        if count >= SHAPE_SHARE * len(values):
+            template["shapes"][name] = shape
+        if corrections[name]:
+            # How often the LLM got the field wrong, for the template report
+            template["corrections"][name] = round(corrections[name] / len(values), 3)
+
+        scored = []
+        for key, proposed in counter.most_common(MAX_CANDIDATE_RULES):
+            if proposed < settings.LAYOUT_TEMPLATE_MIN_SUPPORT:
+                break
+            hits = tries = 0
+            for blocks, truths in samples:
+                if name not in truths:
+                    continue
+                found = _apply(rules_by_key[key], blocks)
+                if found is None:
+                    continue
+                tries += 1
+                hits += _norm(found[0]) == _norm(truths[name])
+            if tries < settings.LAYOUT_TEMPLATE_MIN_SUPPORT:
+                continue
+            precision = hits / (tries + 1)
+            if precision >= MIN_RULE_PRECISION:
+                scored.append({**rules_by_key[key], "precision": round(precision, 4), "hits": hits, "tries": tries})
+        scored.sort(key=lambda rule: (rule["precision"], rule["tries"]), reverse=True)
+        if scored:
+            template["fields"][name] = scored[:MAX_FIELD_RULES]
+    return template, len(samples)
+
+
+@dataclass
+class _CachedTemplate:
+    version: Optional[int]
+    checked_at: float
+    template: Optional[dict]
+
+
+class LayoutTemplateStore:
+    """Per-process cache of the templates with Redis-versioned invalidation."""
+
+    def __init__(self):
+        self._types: dict[str, _CachedTemplate] = {}
+        self._lock = threading.Lock()
+
+    def _version(self, document_type_id: str) -> Optional[int]:
+        try:
+            raw = get_redis().get(f"{VERSION_KEY_PREFIX}:{document_type_id}")
+        except Exception as e:
+            print(f"[Templates] Redis version lookup failed: {e}")
+            return None
+        return int(raw) if raw else 0
+
+    def _template(self, document_type_id: str) -> Optional[dict]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._types.get(document_type_id)
+        if entry and now - entry.checked_at < settings.LAYOUT_TEMPLATE_CACHE_CHECK_SECONDS:
+            return entry.template
+
+        version = self._version(document_type_id)
+        if entry and version is not None and version == entry.version:
+            entry.checked_at = now
+            return entry.template
+
+        db = SessionLocal()
+        try:
+            row = template_crud.get_template(db, UUID(document_type_id))
+            template = row.template if row else None
+        finally:
+            db.close()
+        with self._lock:
+            self._types[document_type_id] = _CachedTemplate(version, now, template)
+        if row is None:
+            self.request_training([document_type_id], missing=True)
+        return template
+
+    def invalidate(self, document_type_id: str) -> None:
+        with self._lock:
+            self._types.pop(document_type_id, None)
+        try:
+            get_redis().incr(f"{VERSION_KEY_PREFIX}:{document_type_id}")
+        except Exception as e:
+            print(f"[Templates] Failed to publish invalidation of {document_type_id}: {e}")
+
+    def request_training(self, document_type_ids, missing: bool = False) -> None:
+        """
+        Train the types after LAYOUT_TEMPLATE_TRAIN_DELAY seconds; requests
+        arriving in the meantime (a run being reviewed) are covered by it.
+        Types without a template (missing) are requested at most once an hour.
+        """
+        delay = settings.LAYOUT_TEMPLATE_TRAIN_DELAY
+        for document_type_id in {str(type_id) for type_id in document_type_ids if type_id}:
+            try:
+                if missing:
+                    lock, expires = f"{TRAIN_LOCK_PREFIX}:missing:{document_type_id}", MISSING_TRAIN_INTERVAL
+                else:
+                    lock, expires = f"{TRAIN_LOCK_PREFIX}:{document_type_id}", max(1, delay)
+                if not get_redis().set(lock, 1, nx=True, ex=expires):
+                    continue
+                from app.tasks.layout_template_tasks import train_layout_template_task
+
+                train_layout_template_task.apply_async((document_type_id,), countdown=delay)
+            except Exception as e:
+                print(f"[Templates] Failed to schedule training of {document_type_id}: {e}")
+
+    def train_type(self, document_type_id: str) -> dict:
+        db = SessionLocal()
+        try:
+            started = time.perf_counter()
+            template, documents = train(template_crud.iter_training_documents(
+                db, UUID(document_type_id), settings.LAYOUT_TEMPLATE_TRAIN_DOCUMENTS
+            ))
+            template_crud.save_template(db, UUID(document_type_id), template, documents)
+        finally:
+            db.close()
+        self.invalidate(document_type_id)
+        print(
+            f"[Templates] {document_type_id}: {len(template['fields'])} fields from {documents} documents "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+        return {"documents": documents, "fields": len(template["fields"])}
+
+    def extract(self, document_type_id: Optional[str], json_content: Optional[dict], fields: list[str]) -> dict[str, dict]:
+        """Confidently matched fields of a document: name -> extracted field."""
+        if not settings.LAYOUT_TEMPLATES_ENABLED or not document_type_id or not json_content or not fields:
+            return {}
+        try:
+            template = self._template(str(document_type_id))
+        except Exception as e:
+            print(f"[Templates] Failed to load template: {e}")
+            return {}
+        if not template or not template.get("fields"):
+            return {}
+
+        blocks = _layout(json_content)
+        found: dict[str, dict] = {}
+        for name in fields:
+            for rule in template["fields"].get(name, []):
+                match = _apply(rule, blocks)
+                if match is None:
+                    continue
+                value, block = match
+                confidence = rule["precision"]
+                shape = template.get("shapes", {}).get(name)
+                if shape and _shape(value) != shape:
+                    confidence *= SHAPE_MISMATCH_PENALTY
+                if confidence >= settings.LAYOUT_TEMPLATE_MIN_CONFIDENCE:
+                    found[name] = {
+                        "name": name,
+                        "value": value,
+                        "confidence": round(confidence, 3),
+                        "coordinate": block.bbox,
+                        "page_index": block.page,
+                        "source": "template",
+                    }
+                    break
+        return found
+
+    # Stats
+
+    def record(self, document_type_id: Optional[str], fields: int, local_fields: int, elapsed: float) -> None:
+        """One document's scalar extraction: fields asked, found by the template, seconds taken."""
+        if not document_type_id or not fields:
+            return
+        local = local_fields == fields
+        try:
+            pipe = get_redis().pipeline()
+            key = f"{STATS_KEY_PREFIX}:{document_type_id}"
+            pipe.hincrby(key, "documents", 1)
+            pipe.hincrby(key, "fields", fields)
+            pipe.hincrby(key, "template_fields", local_fields)
+            pipe.hincrby(key, "local_documents" if local else "llm_documents", 1)
+            pipe.hincrbyfloat(key, "local_ms" if local else "llm_ms", elapsed * 1000)
+            pipe.execute()
+        except Exception as e:
+            print(f"[Templates] Failed to record stats: {e}")
+
+    def collect_stats(self, document_type_id: str) -> dict:
+        raw = get_redis().hgetall(f"{STATS_KEY_PREFIX}:{document_type_id}")
+        stats = {
+            (key.decode() if isinstance(key, bytes) else key): float(value)
+            for key, value in raw.items()
+        }
+        documents = int(stats.get("documents", 0))
+        local_documents = int(stats.get("local_documents", 0))
+        llm_documents = int(stats.get("llm_documents", 0))
+        fields = int(stats.get("fields", 0))
+        return {
+            "documents": documents,
+            "fields": fields,
+            "template_fields": int(stats.get("template_fields", 0)),
+            "field_hit_rate": round(stats.get("template_fields", 0) / fields, 3) if fields else 0.0,
+            "documents_without_llm": local_documents,
+            "document_hit_rate": round(local_documents / documents, 3) if documents else 0.0,
+            "avg_ms_without_llm": round(stats.get("local_ms", 0) / local_documents, 1) if local_documents else None,
+            "avg_ms_with_llm": round(stats.get("llm_ms", 0) / llm_documents, 1) if llm_documents else None,
+        }
+
+    def describe(self, document_type_id: str) -> Optional[dict]:
+        """Stored template with its rules and extraction stats."""
+        db = SessionLocal()
+        try:
+            row = template_crud.get_template(db, UUID(document_type_id))
+        finally:
+            db.close()
+        if row is None:
+            return None
+        try:
+            stats = self.collect_stats(document_type_id)
+        except Exception as e:
+            print(f"[Templates] Failed to read stats: {e}")
+            stats = {}
+        return {
+            "document_type_id": document_type_id,
+            "documents": row.documents,
+            "updated_at": row.updated_at.isoformat() if row.updated_at else None,
+            "fields": row.template.get("fields", {}),
+            "llm_correction_rate": row.template.get("corrections", {}),
+            "stats": stats,
+        }
+
+
+layout_templates = LayoutTemplateStore()
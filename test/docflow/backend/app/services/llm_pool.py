@@ -0,0 +1,281 @@
+"""
+Shared asyncio worker for LLM HTTP calls.
+
+Every process gets one event loop thread that owns a pooled httpx client.
+Callers in any thread or event loop (Celery thread-pool tasks, FastAPI
+handlers) submit requests to it, so hundreds of requests can be in flight
+over one connection pool while the calling threads just wait.
+
+Requests pass a token bucket (LLM_RATE_LIMIT_RPS / LLM_RATE_LIMIT_BURST) and
+an adaptive concurrency limit: a 429 halves the limit and pauses the bucket
+for Retry-After, successes raise it again by one. When more than
+LLM_MAX_QUEUE requests are already waiting, new ones are rejected with
+LLMOverloadedError so the caller can retry later instead of piling up.
+Counters are published to Redis for GET /tasks/llm-metrics.
+"""
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import httpx
+
+from app.core.config import settings
+
+METRICS_KEY_PREFIX = "docflow:llm-metrics"
+METRICS_TTL = 60  # seconds a worker's metrics stay visible after it stops publishing
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class LLMOverloadedError(RuntimeError):
+    """Too many requests are waiting for the LLM; retry later."""
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Async token bucket; pause() blocks all takers until a point in time."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                await asyncio.sleep((1.0 - self._tokens) / self.rate)
+
+
+class AdaptiveLimiter:
+    """Concurrency limit with additive increase / multiplicative decrease."""
+
+    def __init__(self, initial: int, minimum: int, maximum: int):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self.in_flight = 0
+        self.waiting = 0
+        self._cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._cond:
+            self.waiting += 1
+            try:
+                await self._cond.wait_for(lambda: self.in_flight < self.limit)
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def on_success(self) -> None:
+        if self.limit < self.maximum:
+            self.limit += 1
+
+    def on_throttled(self) -> None:
+        self.limit = max(self.minimum, self.limit // 2)
+
+
+class LLMWorkerPool:
+    """Event loop thread + pooled HTTP client shared by all LLM calls of a process."""
+
+    _instance: Optional["LLMWorkerPool"] = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._loop = None
+            cls._instance._pid = None
+            cls._instance._start_lock = threading.Lock()
+        return cls._instance
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        # Forked worker processes must not reuse the parent's loop thread.
+        if self._loop is not None and self._pid == os.getpid():
+            return self._loop
+        with self._start_lock:
+            if self._loop is not None and self._pid == os.getpid():
+                return self._loop
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                self._setup()
+                ready.set()
+                loop.run_forever()
+
+            threading.Thread(target=run, name="llm-pool", daemon=True).start()
+            ready.wait()
+            self._loop = loop
+            self._pid = os.getpid()
+        return self._loop
+
+    def _setup(self) -> None:
+        """Runs inside the pool loop: objects bound to the loop are created here."""
+        max_concurrency = settings.LLM_MAX_CONCURRENCY
+        self._client = httpx.AsyncClient(
+            timeout=settings.LLM_REQUEST_TIMEOUT,
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+        )
+        self._bucket = TokenBucket(settings.LLM_RATE_LIMIT_RPS, settings.LLM_RATE_LIMIT_BURST)
+        self._limiter = AdaptiveLimiter(max_concurrency, settings.LLM_MIN_CONCURRENCY, max_concurrency)
+        self._counters = {"completed": 0, "failed": 0, "throttled": 0, "shed": 0, "retried": 0}
+        self._latency_total = 0.0
+        self._published_at = 0.0
+        self._publishing = False
+
+    async def post(self, url: str, headers: dict, payload: dict) -> httpx.Response:
+        """POST through the shared worker; awaitable from any event loop."""
+        loop = self._ensure_started()
+        future = asyncio.run_coroutine_threadsafe(self._post(url, headers, payload), loop)
+        return await asyncio.wrap_future(future)
+
+    async def _post(self, url: str, headers: dict, payload: dict) -> httpx.Response:
+        if self._limiter.waiting >= settings.LLM_MAX_QUEUE:
+            self._counters["shed"] += 1
+            self._publish_metrics()
+            raise LLMOverloadedError(f"{self._limiter.waiting} LLM requests already waiting")
+
+        attempt = 0
+        while True:
+            async with self._limiter:
+                await self._bucket.acquire()
+                started = time.monotonic()
+                try:
+                    response = await self._client.post(url, headers=headers, json=payload)
+                except httpx.TransportError:
+                    response = None
+                    if attempt >= settings.LLM_MAX_RETRIES:
+                        self._counters["failed"] += 1
+                        self._publish_metrics()
+                        raise
+                latency = time.monotonic() - started
+
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                self._limiter.on_success()
+                self._counters["completed"] += 1
+                self._latency_total += latency
+                self._publish_metrics()
+                return response
+
+            delay = min(settings.LLM_RETRY_MAX_DELAY, settings.LLM_RETRY_BASE_DELAY * 2 ** attempt)
+            if response is not None and response.status_code == 429:
+                self._counters["throttled"] += 1
+                self._limiter.on_throttled()
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                if retry_after is not None:
+                    delay = min(retry_after, settings.LLM_RETRY_MAX_DELAY)
+                self._bucket.pause(delay)
+                print(f"[LLM] Rate limited, retry in {delay:.1f}s (concurrency limit {self._limiter.limit})")
+
+            if attempt >= settings.LLM_MAX_RETRIES:
+                self._counters["failed"] += 1
+                self._publish_metrics()
+                return response
+
+            attempt += 1
+            self._counters["retried"] += 1
+            await asyncio.sleep(delay)
+
+    def metrics(self) -> dict:
+        """Current counters of this process (empty before the first request)."""
+        if self._loop is None or self._pid != os.getpid():
+            return {}
+        completed = self._counters["completed"]
+        return {
+            "in_flight": self._limiter.in_flight,
+            "waiting": self._limiter.waiting,
+            "concurrency_limit": self._limiter.limit,
+            **self._counters,
+            "avg_latency": round(self._latency_total / completed, 3) if completed else None,
+            "updated_at": time.time(),
+        }
+
+    def _publish_metrics(self) -> None:
+        """Runs on the pool loop: the snapshot is taken here, the Redis write in the default executor."""
+        now = time.monotonic()
+        if self._publishing or now - self._published_at < settings.LLM_METRICS_INTERVAL:
+            return
+        self._published_at = now
+        self._publishing = True
+        future = asyncio.get_running_loop().run_in_executor(None, self._write_metrics, json.dumps(self.metrics()))
+        future.add_done_callback(lambda _: setattr(self, "_publishing", False))
+
+    @staticmethod
+    def _write_metrics(snapshot: str) -> None:
+        try:
+            from app.core.redis_client import get_redis
+
+            key = f"{METRICS_KEY_PREFIX}:{socket.gethostname()}:{os.getpid()}"
+            get_redis().set(key, snapshot, ex=METRICS_TTL)
+        except Exception as e:
+            print(f"[LLM] Failed to publish metrics: {e}")
+
+
+def collect_metrics() -> dict:
+    """Metrics of all LLM workers plus the length of the LLM task queue."""
+    from app.core.celery_app import QUEUE_LLM
+    from app.core.redis_client import get_redis
+
+    redis_client = get_redis()
+    workers = {}
+    for key in redis_client.scan_iter(f"{METRICS_KEY_PREFIX}:*"):
+        raw = redis_client.get(key)
+        if raw:
+            name = key.decode() if isinstance(key, bytes) else key
+            workers[name[len(METRICS_KEY_PREFIX) + 1:]] = json.loads(raw)
+
+    # Redis priority queues are stored as "<queue>" and "<queue>:<priority>".
+    queued = sum(
+        redis_client.llen(QUEUE_LLM if priority == 0 else f"{QUEUE_LLM}:{priority}")
+        for priority in range(10)
+    )
+    return {
+        "queued_tasks": queued,
+        "in_flight": sum(w.get("in_flight", 0) for w in workers.values()),
+        "waiting": sum(w.get("waiting", 0) for w in workers.values()),
+        "workers": workers,
+    }
+
+
+llm_pool = LLMWorkerPool()
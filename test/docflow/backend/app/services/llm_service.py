@@ -3,14 +3,16 @@ LLM service for document reranking, type classification, field extraction,
 and document Q&A via OpenRouter API.
 """
 import ast
+import asyncio
 import json
 import re
 from typing import Optional
 
-import httpx
-
 from app.core.config import settings
-from app.core.database import SessionLocal
+from app.services.block_index import get_block_index
+from app.services.context_builder import build_context, extraction_budget, split_chunks
+from app.services.few_shot_store import few_shot_store
+from app.services.llm_pool import LLMOverloadedError, llm_pool
 
 
 class LLMService:
@@ -56,31 +58,27 @@ class LLMService:
             "temperature": 0.1,
         }
 
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
-                self.OPENROUTER_API_URL,
-                headers=self._get_headers(),
-                json=payload,
-            )
-            if response.status_code != 200:
-                print(f"[LLM] API error {response.status_code}: {response.text[:500]}")
-            response.raise_for_status()
-            data = response.json()
-
-            if "error" in data:
-                print(f"[LLM] OpenRouter error: {data['error']}")
-                return ""
-
-            choices = data.get("choices", [])
-            if choices:
-                content = choices[0].get("message", {}).get("content", "")
-                if not content:
-                    print(f"[LLM] Empty content in response. Full response: {json.dumps(data)[:500]}")
-                return content
-
-            print(f"[LLM] No choices in response: {json.dumps(data)[:500]}")
+        # Shared connection pool, rate limiting and 429 handling: see llm_pool.
+        response = await llm_pool.post(self.OPENROUTER_API_URL, self._get_headers(), payload)
+        if response.status_code != 200:
+            print(f"[LLM] API error {response.status_code}: {response.text[:500]}")
+        response.raise_for_status()
+        data = response.json()
+
+        if "error" in data:
+            print(f"[LLM] OpenRouter error: {data['error']}")
             return ""
 
+        choices = data.get("choices", [])
+        if choices:
+            content = choices[0].get("message", {}).get("content", "")
+            if not content:
+                print(f"[LLM] Empty content in response. Full response: {json.dumps(data)[:500]}")
+            return content
+
+        print(f"[LLM] No choices in response: {json.dumps(data)[:500]}")
+        return ""
+
     def _format_documents(self, docs: list[dict]) -> str:
         lines = []
         for i, doc in enumerate(docs):
@@ -196,6 +194,16 @@ Task:
             for item in document_types
         ]
 
+        context = await asyncio.to_thread(
+            build_context,
+            text,
+            [
+                " ".join([item.get("name") or "", item.get("description") or "", *(item.get("fields") or [])])
+                for item in document_types
+            ],
+            purpose="classify",
+        )
+
         prompt = f"""You are a document type classifier.
 Choose exactly one type for the document, or return null if uncertain.
 
@@ -206,7 +214,7 @@ Available document types:
 {json.dumps(types_payload, ensure_ascii=False)}
 
 Document text:
-{text[:4000]}
+{context.text}
 """
 
         try:
@@ -266,20 +274,105 @@ Document text:
         json_content: Optional[dict] = None,
         table_groups: Optional[dict[str, list[str]]] = None,
         document_type_id: Optional[str] = None,
+        semantic_context: Optional[str] = None,
     ) -> list[dict]:
-        """Extract specific fields from document text using LLM."""
+        """
+        Extract specific fields from document text using LLM.
+        semantic_context: few-shot examples loaded by the caller; looked up
+        by document type and similarity to the text when None.
+        Tables of documents longer than the prompt budget are extracted
+        chunk by chunk (see _extract_chunked).
+        """
         if not self.is_configured or (not fields_to_extract and not table_groups):
             return []
 
-        text_preview = text[:4000] if len(text) > 4000 else text
-        semantic_context = self._get_semantic_context(
-            text_preview,
-            fields_to_extract,
-            document_type_id=document_type_id,
-        )
+        table_groups = table_groups or {}
+        chunks: list[str] = []
+        if table_groups and settings.LLM_CHUNK_CONCURRENCY > 0:
+            chunks = await asyncio.to_thread(split_chunks, text, json_content, settings.LLM_CONTEXT_TOKENS)
+
+        # Prompt text of a single call; None when the document goes chunk by chunk
+        text_preview: Optional[str] = None
+        if len(chunks) <= 1:
+            # Blocks relevant to the requested fields and table columns, within a token budget
+            context = await asyncio.to_thread(
+                build_context,
+                text,
+                list(fields_to_extract) + [
+                    f"{group} {column}" for group, columns in table_groups.items() for column in columns
+                ],
+                json_content=json_content,
+                budget=settings.LLM_CONTEXT_TOKENS if table_groups else extraction_budget(len(fields_to_extract)),
+                purpose="extract",
+            )
+            text_preview = context.text
+        if semantic_context is None:
+            semantic_context = await asyncio.to_thread(self.get_few_shot_context, document_type_id, text)
+
+        try:
+            if text_preview is None:
+                extracted = await self._extract_chunked(
+                    chunks, fields_to_extract, json_content, table_groups, semantic_context
+                )
+            else:
+                extracted = await self._extract_from_text(
+                    text_preview, fields_to_extract, json_content, table_groups, semantic_context
+                )
+
+            # Deterministic fallback for missing scalar fields.
+            pattern_values = self._extract_fields_by_pattern(text, fields_to_extract)
+            if pattern_values:
+                has_value = {
+                    f.get("name"): f
+                    for f in extracted
+                    if f.get("name") in fields_to_extract and f.get("value") not in (None, "", "Не найдено")
+                }
+                for field_name in fields_to_extract:
+                    if field_name in has_value:
+                        continue
+                    if field_name not in pattern_values:
+                        continue
+                    value = pattern_values[field_name]
+                    extracted = [
+                        item
+                        for item in extracted
+                        if not (item.get("name") == field_name and item.get("value") in (None, "", "Не найдено"))
+                    ]
+                    field_data = {
+                        "name": field_name,
+                        "value": value,
+                        "confidence": 0.55,
+                        "coordinate": None,
+                    }
+                    if json_content:
+                        self._assign_location(field_data, json_content)
+                    extracted.append(field_data)
 
+            if table_groups:
+                table_fields = [f for f in extracted if f.get("group")]
+                print(f"[LLM] Extracted {len(table_fields)} table fields from {len(table_groups)} groups")
+
+            return extracted
+        except LLMOverloadedError:
+            # Let the task retry later instead of saving error values.
+            raise
+        except Exception as e:
+            print(f"LLM field extraction failed: {e}")
+            return [
+                {"name": f, "value": "Ошибка извлечения", "confidence": 0.0, "coordinate": None}
+                for f in fields_to_extract
+            ]
+
+    async def _extract_from_text(
+        self,
+        text_preview: str,
+        fields_to_extract: list[str],
+        json_content: Optional[dict],
+        table_groups: dict[str, list[str]],
+        semantic_context: Optional[str],
+    ) -> list[dict]:
+        """One extraction prompt over text_preview; raises on LLM errors."""
         fields_list = "\n".join([f"- {field}" for field in fields_to_extract])
-        table_groups = table_groups or {}
         table_groups_text = ""
         tables_json_example = '"tables": []'
 
@@ -328,123 +421,117 @@ Expected JSON format:
   {tables_json_example}
 }}"""
 
-        try:
-            max_tokens = 2000 if table_groups else 500
-            response = await self._generate(prompt, max_tokens=max_tokens)
-
-            if table_groups:
-                print(f"[LLM] Table extraction response ({len(response)} chars): {response[:500]}")
-
-            extracted = self._parse_extracted_fields(
-                response,
-                fields_to_extract,
-                json_content,
-                table_groups=table_groups,
-            )
-
-            # Deterministic fallback for missing scalar fields.
-            pattern_values = self._extract_fields_by_pattern(text, fields_to_extract)
-            if pattern_values:
-                has_value = {
-                    f.get("name"): f
-                    for f in extracted
-                    if f.get("name") in fields_to_extract and f.get("value") not in (None, "", "Не найдено")
-                }
-                for field_name in fields_to_extract:
-                    if field_name in has_value:
-                        continue
-                    if field_name not in pattern_values:
-                        continue
-                    value = pattern_values[field_name]
-                    extracted = [
-                        item
-                        for item in extracted
-                        if not (item.get("name") == field_name and item.get("value") in (None, "", "Не найдено"))
-                    ]
-                    field_data = {
-                        "name": field_name,
-                        "value": value,
-                        "confidence": 0.55,
-                        "coordinate": None,
-                    }
-                    if json_content:
-                        coord = self._find_coordinate_for_value(value, json_content)
-                        if coord:
-                            field_data["coordinate"] = coord
-                    extracted.append(field_data)
+        max_tokens = 2000 if table_groups else 500
+        response = await self._generate(prompt, max_tokens=max_tokens)
 
-            if table_groups:
-                table_fields = [f for f in extracted if f.get("group")]
-                print(f"[LLM] Extracted {len(table_fields)} table fields from {len(table_groups)} groups")
+        if table_groups:
+            print(f"[LLM] Table extraction response ({len(response)} chars): {response[:500]}")
 
-            return extracted
-        except Exception as e:
-            print(f"LLM field extraction failed: {e}")
-            return [
-                {"name": f, "value": "Ошибка извлечения", "confidence": 0.0, "coordinate": None}
-                for f in fields_to_extract
-            ]
+        return self._parse_extracted_fields(
+            response,
+            fields_to_extract,
+            json_content,
+            table_groups=table_groups,
+        )
 
-    def _get_semantic_context(
+    async def _extract_chunked(
         self,
-        text: str,
+        chunks: list[str],
         fields_to_extract: list[str],
-        max_examples: int = 5,
-        document_type_id: Optional[str] = None,
-    ) -> str:
-        """Retrieve extracted fields from same document type as few-shot examples."""
-        if not document_type_id:
-            return ""
+        json_content: Optional[dict],
+        table_groups: dict[str, list[str]],
+        semantic_context: Optional[str],
+    ) -> list[dict]:
+        """
+        Map-reduce extraction for documents longer than the prompt budget:
+        every chunk (pages / table parts, see split_chunks) is extracted on
+        its own, at most LLM_CHUNK_CONCURRENCY at a time, so no table row is
+        cut off by the context or by max_tokens of a single response.
+        Scalar fields: the most confident value wins (all distinct values of
+        fields a chunk returned several times). Table rows: concatenated in
+        chunk order and renumbered.
+        """
+        semaphore = asyncio.Semaphore(settings.LLM_CHUNK_CONCURRENCY)
 
-        try:
-            from sqlalchemy import desc
-
-            from app.models.processed_document import ProcessedDocument
-            from app.models.processing_run import ProcessingRun
-
-            db = SessionLocal()
-            try:
-                docs = (
-                    db.query(ProcessedDocument)
-                    .join(ProcessingRun, ProcessedDocument.processing_run_id == ProcessingRun.id)
-                    .filter(
-                        ProcessingRun.document_type_id == document_type_id,
-                        ProcessedDocument.extracted_fields.isnot(None),
+        async def run(chunk: str) -> Optional[list[dict]]:
+            async with semaphore:
+                try:
+                    return await self._extract_from_text(
+                        chunk, fields_to_extract, json_content, table_groups, semantic_context
                     )
-                    .order_by(desc(ProcessedDocument.created_at))
-                    .limit(max_examples)
-                    .all()
-                )
-            finally:
-                db.close()
+                except LLMOverloadedError:
+                    raise
+                except Exception as e:
+                    print(f"[LLM] Chunk extraction failed: {e}")
+                    return None
 
-            if not docs:
-                return ""
+        print(f"[LLM] Chunked extraction: {len(chunks)} chunks, concurrency {settings.LLM_CHUNK_CONCURRENCY}")
+        results = await asyncio.gather(*(run(chunk) for chunk in chunks))
+        if all(result is None for result in results):
+            raise RuntimeError(f"All {len(chunks)} chunk extractions failed")
+        return self._merge_chunk_results([result or [] for result in results], fields_to_extract)
 
-            context_parts = []
-            for doc in docs:
-                fields = doc.extracted_fields
-                if not fields or not isinstance(fields, list):
-                    continue
+    def _merge_chunk_results(self, results: list[list[dict]], fields_to_extract: list[str]) -> list[dict]:
+        merged: list[dict] = []
 
-                field_lines = []
-                for f in fields:
-                    name = f.get("name", "")
-                    value = f.get("value", "")
-                    if not name or not value or value in ("Не найдено", ""):
-                        continue
-                    field_lines.append(f"  {name}: {value}")
-
-                if field_lines:
-                    filename = doc.filename or "Документ"
-                    context_parts.append(
-                        f"Пример {len(context_parts) + 1} ({filename}):\n" + "\n".join(field_lines)
+        for field_name in fields_to_extract:
+            found: list[dict] = []
+            multi_valued = False
+            missing: Optional[dict] = None
+            for chunk_fields in results:
+                values = [
+                    f for f in chunk_fields
+                    if not f.get("group") and f.get("name") == field_name
+                    and f.get("value") not in (None, "", "Не найдено")
+                ]
+                multi_valued = multi_valued or len(values) > 1
+                found.extend(values)
+                if not values and missing is None:
+                    missing = next(
+                        (f for f in chunk_fields if not f.get("group") and f.get("name") == field_name),
+                        None,
                     )
+            if not found:
+                if missing:
+                    merged.append(missing)
+                continue
+            found.sort(key=lambda f: float(f.get("confidence") or 0.0), reverse=True)
+            if not multi_valued:
+                merged.append(found[0])
+                continue
+            seen_values: set[str] = set()
+            for f in found:
+                key = self._normalize_field_key(str(f["value"]))
+                if key not in seen_values:
+                    seen_values.add(key)
+                    merged.append(f)
+
+        # Table rows: chunk order, then row order inside the chunk
+        offsets: dict[str, int] = {}
+        for chunk_fields in results:
+            rows_in_chunk: dict[str, set[int]] = {}
+            for f in chunk_fields:
+                group = f.get("group")
+                if not group:
+                    continue
+                local_index = int(f.get("row_index") or 0)
+                rows_in_chunk.setdefault(group, set()).add(local_index)
+            renumber = {
+                group: {local: offsets.get(group, 0) + n for n, local in enumerate(sorted(indexes))}
+                for group, indexes in rows_in_chunk.items()
+            }
+            for f in chunk_fields:
+                group = f.get("group")
+                if group:
+                    merged.append({**f, "row_index": renumber[group][int(f.get("row_index") or 0)]})
+            for group, indexes in rows_in_chunk.items():
+                offsets[group] = offsets.get(group, 0) + len(indexes)
 
-            return "\n\n".join(context_parts)
-        except Exception as e:
-            print(f"Semantic context retrieval failed: {e}")
-            return ""
+        return merged
+
+    def get_few_shot_context(self, document_type_id: Optional[str], text: str = "") -> str:
+        """Few-shot examples of a document type, the most similar to `text` first (see few_shot_store)."""
+        return few_shot_store.select(document_type_id, text)
 
     def _parse_extracted_fields(
         self,
@@ -546,9 +633,7 @@ Expected JSON format:
                                 }
 
                                 if json_content and field_data["value"] != "Не найдено":
-                                    coord = self._find_coordinate_for_value(field_data["value"], json_content)
-                                    if coord:
-                                        field_data["coordinate"] = coord
+                                    self._assign_location(field_data, json_content)
 
                                 result.append(field_data)
 
@@ -591,9 +676,7 @@ Expected JSON format:
                         }
 
                         if json_content and field_data["value"] != "Не найдено":
-                            coord = self._find_coordinate_for_value(field_data["value"], json_content)
-                            if coord:
-                                field_data["coordinate"] = coord
+                            self._assign_location(field_data, json_content)
 
                         result.append(field_data)
                         seen[canonical_name] = seen.get(canonical_name, 0) + 1
@@ -683,41 +766,14 @@ Expected JSON format:
 
         return None
 
-    def _find_coordinate_for_value(self, value: str, json_content: dict) -> Optional[list[float]]:
-        """Find bounding box coordinates for value in OCR JSON."""
-        if not json_content:
-            return None
-
-        parsing_res_list = json_content.get("parsing_res_list", [])
-        if not parsing_res_list:
-            return None
-
-        value_lower = str(value).lower().strip()
-
-        for block in parsing_res_list:
-            block_content = block.get("block_content", "")
-            if not block_content:
-                continue
-
-            if value_lower in block_content.lower():
-                block_bbox = block.get("block_bbox", [])
-                if block_bbox and len(block_bbox) == 4:
-                    return block_bbox
-
-        value_words = value_lower.split()
-        if len(value_words) >= 2:
-            for block in parsing_res_list:
-                block_content = block.get("block_content", "").lower()
-                if not block_content:
-                    continue
-
-                matching_words = sum(1 for word in value_words if word in block_content)
-                if matching_words >= len(value_words) * 0.5:
-                    block_bbox = block.get("block_bbox", [])
-                    if block_bbox and len(block_bbox) == 4:
-                        return block_bbox
-
-        return None
+    def _assign_location(self, field_data: dict, json_content: dict) -> None:
+        """Set coordinate and page_index of a field from the OCR block containing its value."""
+        if not json_content or not json_content.get("parsing_res_list"):
+            return
+        block = get_block_index(json_content).find_block(field_data["value"])
+        if block:
+            field_data["coordinate"] = block.get("block_bbox")
+            field_data["page_index"] = block.get("page_index")
 
     async def query_document(
         self,
@@ -729,7 +785,8 @@ Expected JSON format:
         if not self.is_configured:
             raise RuntimeError("OpenRouter API key not configured")
 
-        text_preview = raw_text[:4000] if len(raw_text) > 4000 else raw_text
+        context = await asyncio.to_thread(build_context, raw_text, [query], purpose="query")
+        text_preview = context.text
 
         fields_section = ""
         if extracted_fields:
@@ -5,11 +5,18 @@ import tempfile
 import shutil
 import asyncio
 import html
+import io
+import sys
+import time
 from pathlib import Path
 from app.core.config import settings
 from app.services.document_converter import (
     is_pdf, is_word, convert_document_for_ocr
 )
+from app.services.grounding_parser import GroundingStreamParser, parse_grounding
+from app.services.image_rendering import draw_field_highlights
+from app.services.layout_templates import layout_templates
+from app.services.llm_pool import LLMOverloadedError
 from app.services.llm_service import llm_service
 
 # === DeepSeek OCR 2 Initialization ===
@@ -113,48 +120,62 @@ def _parse_field_specs(fields_to_extract: list[str]) -> tuple[list[str], dict[st
     return single_fields, table_groups
 
 
+_HTML_TAG_RE = re.compile(r"<[^>]+>", re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r"\s+")
+_LABEL_JUNK_RE = re.compile(r"[^0-9a-zа-яё ]+")
+_NUMBERING_CELL_RE = re.compile(r"^\s*(\d+[a-zа-я]?|[-—]+)\s*$", re.IGNORECASE)
+_TABLE_RE = re.compile(r"<table[\s\S]*?</table>", re.IGNORECASE)
+_TABLE_ROW_RE = re.compile(r"<tr[^>]*>([\s\S]*?)</tr>", re.IGNORECASE)
+_TABLE_CELL_RE = re.compile(r"<t[dh][^>]*>([\s\S]*?)</t[dh]>", re.IGNORECASE)
+
+# Minimal header score required to map a requested column to a table header.
+_MIN_HEADER_SCORE = 0.25
+
+
 def _strip_html_text(value: str) -> str:
-    cleaned = re.sub(r"<[^>]+>", "", value or "", flags=re.IGNORECASE)
+    cleaned = _HTML_TAG_RE.sub("", value or "")
     cleaned = html.unescape(cleaned).replace("\xa0", " ")
-    cleaned = re.sub(r"\s+", " ", cleaned)
+    cleaned = _WHITESPACE_RE.sub(" ", cleaned)
     return cleaned.strip()
 
 
 def _normalize_label(value: str) -> str:
     value = _strip_html_text(value).lower()
-    value = re.sub(r"[^0-9a-zа-яё ]+", " ", value)
-    value = re.sub(r"\s+", " ", value).strip()
+    value = _LABEL_JUNK_RE.sub(" ", value)
+    value = _WHITESPACE_RE.sub(" ", value).strip()
     return value
 
 
-def _split_tokens(value: str) -> set[str]:
-    return {t for t in _normalize_label(value).split(" ") if len(t) > 1}
+def _prepare_label(value: str) -> tuple[str, frozenset[str]]:
+    """Normalize a label once and return it together with its token set."""
+    normalized = _normalize_label(value)
+    tokens = frozenset(t for t in normalized.split(" ") if len(t) > 1)
+    return normalized, tokens
 
 
-def _header_match_score(requested: str, header: str) -> float:
-    req_norm = _normalize_label(requested)
-    hdr_norm = _normalize_label(header)
+def _header_match_score(
+    req_norm: str,
+    req_tokens: frozenset[str],
+    hdr_norm: str,
+    hdr_tokens: frozenset[str],
+    overlap: int,
+) -> float:
+    """Score of a header for a requested column; overlap is the number of tokens they share."""
     if not req_norm or not hdr_norm:
         return 0.0
     if req_norm == hdr_norm:
         return 1.0
     if req_norm in hdr_norm or hdr_norm in req_norm:
         return 0.9
-
-    req_tokens = _split_tokens(req_norm)
-    hdr_tokens = _split_tokens(hdr_norm)
     if not req_tokens or not hdr_tokens:
         return 0.0
-
-    overlap = len(req_tokens & hdr_tokens) / max(1, len(req_tokens))
-    return overlap
+    return overlap / len(req_tokens)
 
 
 def _looks_like_numbering_row(cells: list[str]) -> bool:
     if not cells:
         return False
-    marker_pattern = re.compile(r"^\s*(\d+[a-zа-я]?|[-—]+)\s*$", re.IGNORECASE)
-    markers = sum(1 for c in cells if marker_pattern.match(c or ""))
+    markers = sum(1 for c in cells if _NUMBERING_CELL_RE.match(c or ""))
     return markers >= max(2, int(len(cells) * 0.6))
 
 
@@ -163,13 +184,10 @@ def _parse_tables_from_html(raw_text: str) -> list[list[list[str]]]:
     if not raw_text:
         return tables
 
-    table_html_list = re.findall(r"<table[\s\S]*?</table>", raw_text, flags=re.IGNORECASE)
-    for table_html in table_html_list:
-        rows_html = re.findall(r"<tr[^>]*>([\s\S]*?)</tr>", table_html, flags=re.IGNORECASE)
+    for table_html in _TABLE_RE.findall(raw_text):
         rows: list[list[str]] = []
-        for row_html in rows_html:
-            cells_html = re.findall(r"<t[dh][^>]*>([\s\S]*?)</t[dh]>", row_html, flags=re.IGNORECASE)
-            cells = [_strip_html_text(cell) for cell in cells_html]
+        for row_html in _TABLE_ROW_RE.findall(table_html):
+            cells = [_strip_html_text(cell) for cell in _TABLE_CELL_RE.findall(row_html)]
             if cells:
                 rows.append(cells)
         if rows:
@@ -177,6 +195,49 @@ def _parse_tables_from_html(raw_text: str) -> list[list[list[str]]]:
     return tables
 
 
+class _PreparedTable:
+    """HTML table with headers normalized and tokenized once for column matching."""
+
+    __slots__ = ("rows", "data_start", "headers", "_token_to_headers")
+
+    def __init__(self, rows: list[list[str]]):
+        self.rows = rows
+        self.data_start = 2 if _looks_like_numbering_row(rows[1]) else 1
+        self.headers = [_prepare_label(header) for header in rows[0]]
+        # Inverted index token -> header positions, so the token-overlap score
+        # for a requested column is accumulated in one pass over its tokens.
+        self._token_to_headers: dict[str, list[int]] = {}
+        for idx, (_, tokens) in enumerate(self.headers):
+            for token in tokens:
+                self._token_to_headers.setdefault(token, []).append(idx)
+
+    def match_columns(
+        self,
+        requested: list[tuple[str, str, frozenset[str]]],
+    ) -> dict[str, int | None]:
+        """Map each requested column to the best matching header index (or None)."""
+        column_indexes: dict[str, int | None] = {}
+        for req_col, req_norm, req_tokens in requested:
+            overlap = [0] * len(self.headers)
+            for token in req_tokens:
+                for idx in self._token_to_headers.get(token, ()):
+                    overlap[idx] += 1
+            scores = [
+                _header_match_score(req_norm, req_tokens, hdr_norm, hdr_tokens, overlap[idx])
+                for idx, (hdr_norm, hdr_tokens) in enumerate(self.headers)
+            ]
+
+            best_idx = None
+            best_score = 0.0
+            for idx, score in enumerate(scores):
+                if score > best_score:
+                    best_score = score
+                    best_idx = idx
+            # Require at least weak overlap to avoid random mappings.
+            column_indexes[req_col] = best_idx if best_score >= _MIN_HEADER_SCORE else None
+        return column_indexes
+
+
 def _extract_table_fields_from_html(
     raw_text: str,
     table_groups: dict[str, list[str]],
@@ -184,40 +245,28 @@ def _extract_table_fields_from_html(
     """
     Deterministic fallback for table extraction.
     Parses HTML tables from OCR text and maps requested columns to headers by fuzzy match.
+    Headers and requested columns are normalized once, not per (column, header) pair.
     """
     if not raw_text or not table_groups:
         return []
 
-    parsed_tables = _parse_tables_from_html(raw_text)
-    if not parsed_tables:
+    prepared_tables = [
+        _PreparedTable(rows)
+        for rows in _parse_tables_from_html(raw_text)
+        if len(rows) >= 2
+    ]
+    if not prepared_tables:
         return []
 
     extracted: list[dict] = []
 
     for group_name, requested_columns in table_groups.items():
+        requested = [(col, *_prepare_label(col)) for col in requested_columns]
         row_index = 0
-        for table_rows in parsed_tables:
-            if len(table_rows) < 2:
-                continue
+        for table in prepared_tables:
+            column_indexes = table.match_columns(requested)
 
-            headers = table_rows[0]
-            data_start = 1
-            if len(table_rows) > 1 and _looks_like_numbering_row(table_rows[1]):
-                data_start = 2
-
-            column_indexes: dict[str, int | None] = {}
-            for req_col in requested_columns:
-                best_idx = None
-                best_score = 0.0
-                for idx, header in enumerate(headers):
-                    score = _header_match_score(req_col, header)
-                    if score > best_score:
-                        best_score = score
-                        best_idx = idx
-                # Require at least weak overlap to avoid random mappings.
-                column_indexes[req_col] = best_idx if best_score >= 0.25 else None
-
-            for row in table_rows[data_start:]:
+            for row in table.rows[table.data_start:]:
                 if not any((cell or "").strip() for cell in row):
                     continue
 
@@ -244,42 +293,72 @@ def _extract_table_fields_from_html(
     return extracted
 
 
-def extract_fields_with_llm_resilient(
+async def extract_fields_resilient_async(
     text: str,
     fields_to_extract: list[str],
     json_content: dict,
     document_type_id: str | None = None,
+    semantic_context: str | None = None,
 ) -> list[dict]:
     """
     Extract scalar and table fields in separate LLM calls so table parsing
-    failures do not wipe out scalar extraction.
+    failures do not wipe out scalar extraction. Scalar fields matched by the
+    layout template of the document type are taken without the LLM.
     """
     single_fields, table_groups = _parse_field_specs(fields_to_extract or [])
     extracted_fields: list[dict] = []
 
-    if single_fields:
+    started = time.perf_counter()
+    template_fields: dict[str, dict] = {}
+    if single_fields and document_type_id:
+        template_fields = await asyncio.to_thread(
+            layout_templates.extract, document_type_id, json_content, single_fields
+        )
+    llm_fields = [name for name in single_fields if name not in template_fields]
+
+    if semantic_context is None and llm_fields and table_groups:
+        # One lookup of similar examples for both calls
+        semantic_context = await asyncio.to_thread(llm_service.get_few_shot_context, document_type_id, text)
+
+    if llm_fields:
         try:
-            scalar_fields = extract_fields_with_llm(
+            scalar_fields = await llm_service.extract_fields(
                 text,
-                single_fields,
+                llm_fields,
                 json_content,
                 table_groups=None,
                 document_type_id=document_type_id,
+                semantic_context=semantic_context,
             )
             extracted_fields.extend(scalar_fields or [])
+        except LLMOverloadedError:
+            raise
         except Exception as e:
             print(f"Scalar field extraction failed: {e}")
+    if template_fields:
+        # Template and LLM values back in the requested field order
+        extracted_fields.extend(template_fields.values())
+        position = {name: index for index, name in enumerate(single_fields)}
+        extracted_fields.sort(key=lambda item: position.get(item.get("name"), len(position)))
+    if single_fields:
+        await asyncio.to_thread(
+            layout_templates.record,
+            document_type_id, len(single_fields), len(template_fields), time.perf_counter() - started,
+        )
 
     if table_groups:
         try:
-            table_fields = extract_fields_with_llm(
+            table_fields = await llm_service.extract_fields(
                 text,
                 [],
                 json_content,
                 table_groups=table_groups,
                 document_type_id=document_type_id,
+                semantic_context=semantic_context,
             )
             extracted_fields.extend(table_fields or [])
+        except LLMOverloadedError:
+            raise
         except Exception as e:
             print(f"Table field extraction failed: {e}")
 
@@ -293,65 +372,65 @@ def extract_fields_with_llm_resilient(
     return extracted_fields
 
 
-def _parse_deepseek_grounding(ocr_result: str, img_width: int, img_height: int) -> list[dict]:
-    """
-    Parse DeepSeek OCR 2 grounding output to structured format.
-
-    DeepSeek output format:
-    <|ref|>label<|/ref|><|det|>[[x1, y1, x2, y2]]<|/det|>
-    text content (on next lines until next <|ref|> or end)
-    """
-    blocks = []
-
-    if not ocr_result:
-        return []
-
-    # Split by <|ref|> tags to get each block
-    # Pattern: capture label, coords, and content until next <|ref|> or end
-    pattern = r'<\|ref\|>([^<]*)<\|/ref\|><\|det\|>\[\[(\d+),\s*(\d+),\s*(\d+),\s*(\d+)\]\]<\|/det\|>\s*\n?([\s\S]*?)(?=<\|ref\|>|$)'
-
-    matches = re.findall(pattern, ocr_result)
-
-    for i, match in enumerate(matches):
-        label, x1, y1, x2, y2, text = match
-
-        # Clean text content
-        text = text.strip()
-        # Remove trailing empty lines
-        text = re.sub(r'\n\s*$', '', text)
-
-        # DeepSeek coords are normalized to 1000, convert to pixels
-        x1_px = int(int(x1) * img_width / 1000)
-        y1_px = int(int(y1) * img_height / 1000)
-        x2_px = int(int(x2) * img_width / 1000)
-        y2_px = int(int(y2) * img_height / 1000)
-
-        blocks.append({
-            "block_id": i,
-            "block_label": label.strip(),
-            "block_content": text,
-            "block_bbox": [x1_px, y1_px, x2_px, y2_px]
-        })
+def extract_fields_with_llm_resilient(
+    text: str,
+    fields_to_extract: list[str],
+    json_content: dict,
+    document_type_id: str | None = None,
+) -> list[dict]:
+    """Sync wrapper of extract_fields_resilient_async."""
+    return _run_async(
+        extract_fields_resilient_async(
+            text,
+            fields_to_extract,
+            json_content,
+            document_type_id=document_type_id,
+        )
+    )
 
-    return blocks
 
+class _GroundingStdoutTap(io.TextIOBase):
+    """
+    stdout replacement used while DeepSeek infer() streams tokens.
 
-def _normalize_deepseek_markdown(text: str) -> str:
-    """Extract clean markdown text from DeepSeek grounding output."""
-    if not text:
-        return ""
+    Complete lines that are not model progress/log noise are fed to the
+    grounding parser as they arrive, so parsing overlaps decoding.
+    """
 
-    # Remove all grounding tags but keep the content after them
-    # Pattern: remove <|ref|>...<|/ref|><|det|>...<|/det|> but keep what follows
-    cleaned = re.sub(r'<\|ref\|>[^<]*<\|/ref\|><\|det\|>\[\[[^\]]+\]\]<\|/det\|>\s*', '', text)
+    _NOISE_MARKERS = ("it/s", "%|", "BASE:", "PATCHES:")
 
-    # Remove any remaining tags
-    cleaned = re.sub(r'<\|/?[^|]+\|>', '', cleaned)
+    def __init__(self, parser: GroundingStreamParser):
+        self.parser = parser
+        self.lines: list[str] = []
+        self._partial = ""
 
-    # Clean up multiple newlines
-    cleaned = re.sub(r'\n{3,}', '\n\n', cleaned)
+    def writable(self) -> bool:
+        return True
 
-    return cleaned.strip()
+    def write(self, text: str) -> int:
+        self._partial += text
+        if "\n" in self._partial:
+            *complete, self._partial = self._partial.split("\n")
+            for line in complete:
+                self._accept(line)
+        return len(text)
+
+    def finish(self) -> str:
+        if self._partial:
+            self._accept(self._partial)
+            self._partial = ""
+        return "\n".join(self.lines)
+
+    def _accept(self, line: str) -> None:
+        if "<|ref|>" not in line and "<|det|>" not in line:
+            if not line.strip() or line.startswith("="):
+                return
+            if any(marker in line for marker in self._NOISE_MARKERS):
+                return
+        if self.lines:
+            self.parser.feed("\n")
+        self.parser.feed(line)
+        self.lines.append(line)
 
 
 def _coerce_deepseek_result(result: object) -> str:
@@ -423,12 +502,12 @@ def _process_image(image_path: str, output_dir: str) -> tuple[str, dict, str]:
         abs_image_path = os.path.abspath(image_path).replace('\\', '/')
         abs_output_dir = os.path.abspath(output_dir).replace('\\', '/')
 
-        # Capture stdout in case model prints result instead of returning it
-        import io
-        import sys
+        # infer() streams generated tokens to stdout; parse them as they arrive
+        parser = GroundingStreamParser(img_w, img_h)
+        tap = _GroundingStdoutTap(parser)
 
         old_stdout = sys.stdout
-        sys.stdout = captured_output = io.StringIO()
+        sys.stdout = tap
 
         try:
             result = ocr_model.infer(
@@ -439,29 +518,27 @@ def _process_image(image_path: str, output_dir: str) -> tuple[str, dict, str]:
                 base_size=settings.DEEPSEEK_BASE_SIZE,
                 image_size=settings.DEEPSEEK_IMAGE_SIZE,
                 crop_mode=True,
-                save_results=True
+                save_results=settings.DEEPSEEK_SAVE_RESULTS
             )
         finally:
             sys.stdout = old_stdout
 
-        captured_text = captured_output.getvalue()
+        captured_text = tap.finish()
         # Only log in debug mode, suppress noisy model output
         if settings.DEBUG:
             print(f"[DeepSeek OCR] infer() returned: {type(result)}")
 
-        # If result is None but we captured output, try to extract OCR result
+        # If result is None but we captured output, use the streamed parse
         if result is None and captured_text:
-            lines = captured_text.split('\n')
-            ocr_lines = [l for l in lines if '<|ref|>' in l or '<|det|>' in l or
-                        (l.strip() and not l.startswith('=') and 'it/s' not in l and
-                         '%|' not in l and 'BASE:' not in l and 'PATCHES:' not in l)]
-            if ocr_lines:
-                result = '\n'.join(ocr_lines)
+            result = captured_text
+        else:
+            parser = None
     except Exception as e:
         print(f"[DeepSeek OCR] infer() exception: {e}")
         import traceback
         traceback.print_exc()
         result = None
+        parser = None
 
     raw_result = _coerce_deepseek_result(result)
 
@@ -470,8 +547,12 @@ def _process_image(image_path: str, output_dir: str) -> tuple[str, dict, str]:
         if settings.DEBUG:
             print(f"[DeepSeek OCR] Loaded from files, length: {len(raw_result) if raw_result else 0}")
 
-    # Parse grounding blocks
-    blocks = _parse_deepseek_grounding(raw_result, img_w, img_h)
+    # Parse grounding blocks and markdown in a single pass
+    if parser is not None:
+        parsed = parser.close()
+    else:
+        parsed = parse_grounding(raw_result, img_w, img_h)
+    blocks = parsed["blocks"]
 
     if settings.DEBUG:
         print(f"[DeepSeek OCR] Parsed {len(blocks)} blocks, text length: {len(raw_result)}")
@@ -485,7 +566,7 @@ def _process_image(image_path: str, output_dir: str) -> tuple[str, dict, str]:
 
     # Extract markdown (clean text without grounding tags)
     if settings.DEEPSEEK_CLEAN_MARKDOWN:
-        markdown = _normalize_deepseek_markdown(raw_result)
+        markdown = parsed["markdown"]
     else:
         markdown = raw_result or ""
 
@@ -500,6 +581,68 @@ def _process_image(image_path: str, output_dir: str) -> tuple[str, dict, str]:
     return markdown, json_content, raw_result or ""
 
 
+def ocr_page(image_path: str, page_index: int = 0) -> dict:
+    """
+    OCR a single page image. Blocks carry page_index so coordinates stay
+    page-aware when pages are merged (possibly after being OCR'd by different workers).
+    """
+    if not OCR_INITIALIZED or ocr_model is None:
+        raise Exception("DeepSeek OCR не инициализирован")
+
+    output_dir = tempfile.mkdtemp()
+    try:
+        markdown, json_content, raw_result = _process_image(image_path, output_dir)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    blocks = json_content.get("parsing_res_list", [])
+    for block in blocks:
+        block["page_index"] = page_index
+
+    return {
+        "page_index": page_index,
+        "markdown": markdown or "",
+        "raw": raw_result or "",
+        "blocks": blocks,
+        "width": json_content.get("width"),
+        "height": json_content.get("height"),
+    }
+
+
+def merge_pages(pages: list[dict], extracted_text_fallback: str | None = None) -> dict:
+    """Merge per-page OCR results in page order into document text and json_content."""
+    all_markdown_content = []
+    all_raw_content = []
+    all_json_content = {"parsing_res_list": [], "pages": []}
+
+    for page in sorted(pages, key=lambda p: p["page_index"]):
+        all_markdown_content.append(page.get("markdown") or "")
+        if page.get("raw"):
+            all_raw_content.append(page["raw"])
+        all_json_content["parsing_res_list"].extend(page.get("blocks", []))
+        all_json_content["pages"].append({
+            "page_index": page["page_index"],
+            "width": page.get("width"),
+            "height": page.get("height"),
+        })
+
+    markdown_content = "\n\n---\n\n".join(all_markdown_content)
+    raw_text_raw = "\n\n---\n\n".join(all_raw_content)
+
+    # If OCR didn't extract text but we have fallback text from PDF/Word
+    if not markdown_content.strip() and extracted_text_fallback:
+        markdown_content = extracted_text_fallback
+    if settings.OCR_LOG_PREVIEW_CHARS > 0:
+        preview = markdown_content[: settings.OCR_LOG_PREVIEW_CHARS].replace("\n", "\\n")
+        print(f"OCR preview ({len(markdown_content)} chars): {preview}")
+
+    return {
+        "rawText": markdown_content,
+        "rawTextRaw": raw_text_raw,
+        "jsonContent": all_json_content,
+    }
+
+
 def extract_document(file_path: str, fields_to_extract: list[str] = None, document_type_id: str | None = None) -> dict:
     """
     Extract content from a document using DeepSeek OCR 2.
@@ -515,9 +658,6 @@ def extract_document(file_path: str, fields_to_extract: list[str] = None, docume
 
     filename = os.path.basename(file_path)
     temp_dir = None
-    all_markdown_content = []
-    all_raw_content = []
-    all_json_content = {"parsing_res_list": []}
     extracted_text_fallback = None
 
     try:
@@ -530,68 +670,28 @@ def extract_document(file_path: str, fields_to_extract: list[str] = None, docume
         else:
             images_to_process = [file_path]
 
-        # Create output directory for results
-        output_dir = tempfile.mkdtemp()
-
         # Process each image/page
-        for i, image_path in enumerate(images_to_process):
+        pages = [
+            ocr_page(image_path, i)
+            for i, image_path in enumerate(images_to_process)
             # Skip non-image files
-            if image_path.endswith('.txt'):
-                continue
-
-            markdown, json_content, raw_result = _process_image(image_path, output_dir)
-            if markdown is None:
-                markdown = ""
-
-            all_markdown_content.append(markdown)
-            if raw_result:
-                all_raw_content.append(raw_result)
-            all_json_content["parsing_res_list"].extend(json_content.get("parsing_res_list", []))
-
-        markdown_content = "\n\n---\n\n".join(all_markdown_content)
-        raw_text_raw = "\n\n---\n\n".join(all_raw_content)
-
-        # If OCR didn't extract text but we have fallback text from PDF/Word
-        if not markdown_content.strip() and extracted_text_fallback:
-            markdown_content = extracted_text_fallback
-        if settings.OCR_LOG_PREVIEW_CHARS > 0:
-            preview = markdown_content[: settings.OCR_LOG_PREVIEW_CHARS].replace("\n", "\\n")
-            print(f"OCR preview ({len(markdown_content)} chars): {preview}")
+            if not image_path.endswith('.txt')
+        ]
+        merged = merge_pages(pages, extracted_text_fallback)
 
         # Extract fields using LLM
         extracted_fields = []
         if fields_to_extract:
             extracted_fields = extract_fields_with_llm_resilient(
-                markdown_content,
+                merged["rawText"],
                 fields_to_extract,
-                all_json_content,
+                merged["jsonContent"],
                 document_type_id=document_type_id,
             )
 
-        # Cleanup output directory
-        shutil.rmtree(output_dir, ignore_errors=True)
-
-        # Create highlighted image if fields were extracted
-        highlighted_image_path = None
-        if extracted_fields and images_to_process:
-            try:
-                # Use first image for highlighting
-                original_image = images_to_process[0]
-                if not original_image.endswith('.txt'):
-                    highlighted_image_path = create_highlighted_image(
-                        original_image,
-                        extracted_fields,
-                        all_json_content
-                    )
-            except Exception as e:
-                print(f"Failed to create highlighted image: {e}")
-
         return {
             "fields": extracted_fields,
-            "rawText": markdown_content,
-            "rawTextRaw": raw_text_raw,
-            "jsonContent": all_json_content,
-            "highlightedImage": highlighted_image_path,
+            **merged,
             "pageImages": images_to_process if (is_pdf(filename) or is_word(filename)) else [],
             "_temp_dir": temp_dir,
         }
@@ -607,7 +707,8 @@ def create_highlighted_image(
     image_path: str,
     extracted_fields: list[dict],
     json_content: dict,
-    output_path: str = None
+    output_path: str = None,
+    page_index: int | None = None,
 ) -> str:
     """
     Create an image with highlighted extracted fields.
@@ -617,95 +718,17 @@ def create_highlighted_image(
         extracted_fields: List of extracted fields with 'coordinate' (bbox) from LLM
         json_content: OCR result with parsing_res_list (for fallback lookup)
         output_path: Optional output path, if None - creates next to original
+        page_index: If set, only fields and blocks of this page are drawn
+            (fields/blocks without a page index belong to the first page)
 
     Returns:
         Path to the highlighted image
     """
-    from PIL import Image, ImageDraw, ImageFont
+    from PIL import Image
 
     # Load original image
     img = Image.open(image_path).convert('RGB')
-    draw = ImageDraw.Draw(img, 'RGBA')
-
-    # Build value -> bbox mapping from json_content for fallback
-    value_to_bbox = {}
-    for block in json_content.get("parsing_res_list", []):
-        content = block.get("block_content", "")
-        bbox = block.get("block_bbox")
-        if content and bbox and len(bbox) == 4:
-            value_to_bbox[content.lower().strip()] = bbox
-
-    # Color palette for different fields
-    colors = [
-        ((231, 76, 60), (231, 76, 60, 80)),      # Red
-        ((52, 152, 219), (52, 152, 219, 80)),    # Blue
-        ((155, 89, 182), (155, 89, 182, 80)),    # Purple
-        ((46, 204, 113), (46, 204, 113, 80)),    # Green
-        ((243, 156, 18), (243, 156, 18, 80)),    # Orange
-        ((26, 188, 156), (26, 188, 156, 80)),    # Teal
-        ((230, 126, 34), (230, 126, 34, 80)),    # Dark Orange
-        ((22, 160, 133), (22, 160, 133, 80)),    # Dark Teal
-    ]
-
-    # Try to load a font for labels
-    try:
-        font = ImageFont.truetype("arial.ttf", 14)
-    except:
-        font = ImageFont.load_default()
-
-    # Draw each field
-    field_colors = {}
-    color_idx = 0
-    highlighted_count = 0
-
-    for field in extracted_fields:
-        field_name = field.get("name", "")
-        field_value = field.get("value", "")
-
-        # Skip "Не найдено" fields
-        if field_value == "Не найдено":
-            continue
-
-        # Get bbox from field's coordinate or try to find by value
-        bbox = field.get("coordinate")
-
-        if not bbox:
-            # Try to find bbox by matching value in json_content
-            value_lower = str(field_value).lower().strip()
-            for content, content_bbox in value_to_bbox.items():
-                if value_lower in content or content in value_lower:
-                    bbox = content_bbox
-                    break
-
-        if not bbox or len(bbox) != 4:
-            continue
-
-        # Assign color to field
-        if field_name not in field_colors:
-            field_colors[field_name] = colors[color_idx % len(colors)]
-            color_idx += 1
-
-        line_color, fill_color = field_colors[field_name]
-
-        x1, y1, x2, y2 = bbox
-
-        # Ensure coordinates are integers
-        x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
-
-        # Draw semi-transparent fill
-        draw.rectangle([x1, y1, x2, y2], fill=fill_color, outline=line_color, width=2)
-
-        # Draw label above the box
-        label = f"{field_name}: {field_value[:30]}..." if len(str(field_value)) > 30 else f"{field_name}: {field_value}"
-        text_bbox = draw.textbbox((x1, y1 - 18), label, font=font)
-
-        # Background for label
-        draw.rectangle(
-            [text_bbox[0] - 2, text_bbox[1] - 2, text_bbox[2] + 2, text_bbox[3] + 2],
-            fill=line_color
-        )
-        draw.text((x1, y1 - 18), label, fill=(255, 255, 255), font=font)
-        highlighted_count += 1
+    highlighted_count = draw_field_highlights(img, extracted_fields, json_content, page_index=page_index)
 
     # Only save if we highlighted something
     if highlighted_count == 0:
@@ -783,6 +806,21 @@ def create_highlighted_image_from_blocks(
     return output_path
 
 
+def _run_async(coro):
+    """Run a coroutine from sync code, also when called inside a running loop."""
+    try:
+        loop = asyncio.get_event_loop()
+    except RuntimeError:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+    if loop.is_running():
+        import concurrent.futures
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            return executor.submit(asyncio.run, coro).result()
+    return loop.run_until_complete(coro)
+
+
 def extract_fields_with_llm(
     text: str,
     fields_to_extract: list[str],
@@ -795,36 +833,15 @@ def extract_fields_with_llm(
     Runs async code in sync context.
     """
     try:
-        loop = asyncio.get_event_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-
-    try:
-        if loop.is_running():
-            import concurrent.futures
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                future = executor.submit(
-                    asyncio.run,
-                    llm_service.extract_fields(
-                        text,
-                        fields_to_extract,
-                        json_content,
-                        table_groups=table_groups,
-                        document_type_id=document_type_id
-                    )
-                )
-                return future.result()
-        else:
-            return loop.run_until_complete(
-                llm_service.extract_fields(
-                    text,
-                    fields_to_extract,
-                    json_content,
-                    table_groups=table_groups,
-                    document_type_id=document_type_id
-                )
+        return _run_async(
+            llm_service.extract_fields(
+                text,
+                fields_to_extract,
+                json_content,
+                table_groups=table_groups,
+                document_type_id=document_type_id
             )
+        )
     except Exception as e:
         print(f"LLM extraction failed: {e}")
         raise
@@ -0,0 +1,101 @@
+"""
+Progress events of processing runs over Redis pub/sub.
+
+Workers publish small JSON events (stage, page n/m, fields extracted, errors)
+to one channel per run; GET /processing-runs/{id}/events streams them to the
+browser as Server-Sent Events. The last event of every document is also kept
+in a hash, so a client that connects mid-run starts from the current state.
+Publishing never raises: progress is informational, processing must go on.
+"""
+import json
+import time
+from typing import AsyncIterator, Optional
+
+from app.core.config import settings
+from app.core.redis_client import get_redis
+
+KEY_PREFIX = "docflow:run"
+STATE_TTL = 24 * 3600
+
+
+def channel_name(run_id: str) -> str:
+    return f"{KEY_PREFIX}:{run_id}:events"
+
+
+def _state_key(run_id: str) -> str:
+    return f"{KEY_PREFIX}:{run_id}:state"
+
+
+def _counter_key(run_id: str, name: str) -> str:
+    return f"{KEY_PREFIX}:{run_id}:count:{name}"
+
+
+def publish(run_id: str, stage: str, document_id: Optional[str] = None, **data) -> None:
+    """Publish a progress event of a run (and remember it as the document's last state)."""
+    event = {"run_id": str(run_id), "stage": stage, "document_id": document_id, "ts": time.time(), **data}
+    try:
+        redis_client = get_redis()
+        payload = json.dumps(event, ensure_ascii=False, default=str)
+        pipe = redis_client.pipeline()
+        if document_id:
+            pipe.hset(_state_key(run_id), document_id, payload)
+            pipe.expire(_state_key(run_id), STATE_TTL)
+        pipe.publish(channel_name(run_id), payload)
+        pipe.execute()
+    except Exception as e:
+        print(f"[Progress] Failed to publish {stage} event for run {run_id}: {e}")
+
+
+def increment(run_id: str, name: str) -> int:
+    """Run-wide counter (e.g. OCR'd pages of a document); 0 if Redis is unavailable."""
+    try:
+        pipe = get_redis().pipeline()
+        pipe.incr(_counter_key(run_id, name))
+        pipe.expire(_counter_key(run_id, name), STATE_TTL)
+        return pipe.execute()[0]
+    except Exception:
+        return 0
+
+
+def snapshot(run_id: str) -> list[dict]:
+    """Last known event of every document of a run."""
+    try:
+        raw = get_redis().hgetall(_state_key(run_id))
+    except Exception:
+        return []
+    return sorted((json.loads(value) for value in raw.values()), key=lambda e: e.get("ts", 0))
+
+
+def format_sse(event: dict, event_type: str = "progress") -> str:
+    return f"event: {event_type}\ndata: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
+
+
+async def stream(run_id: str, initial: list[dict], is_disconnected) -> AsyncIterator[str]:
+    """
+    SSE stream of a run: the initial snapshot, then live events. A comment
+    line is sent every SSE_HEARTBEAT_SECONDS to keep proxies from closing
+    the connection.
+    """
+    import redis.asyncio as aioredis
+
+    client = aioredis.Redis.from_url(settings.REDIS_URL)
+    pubsub = client.pubsub()
+    await pubsub.subscribe(channel_name(run_id))
+    try:
+        yield f"retry: {settings.SSE_RETRY_MS}\n\n"
+        for event in initial:
+            yield format_sse(event, event.pop("event", "progress"))
+
+        last_heartbeat = time.monotonic()
+        while not await is_disconnected():
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            if message and message.get("type") == "message":
+                data = message["data"]
+                yield f"event: progress\ndata: {data.decode() if isinstance(data, bytes) else data}\n\n"
+            elif time.monotonic() - last_heartbeat >= settings.SSE_HEARTBEAT_SECONDS:
+                last_heartbeat = time.monotonic()
+                yield ": keep-alive\n\n"
+    finally:
+        await pubsub.unsubscribe(channel_name(run_id))
+        await pubsub.aclose()
+        await client.aclose()
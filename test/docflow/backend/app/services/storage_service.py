@@ -1,6 +1,6 @@
 import posixpath
 from pathlib import Path
-from typing import Iterable, Optional
+from typing import Iterable, Iterator, Optional
 
 import boto3
 from botocore.config import Config
@@ -76,6 +76,12 @@ class S3StorageService:
         response = self.client.get_object(Bucket=self.bucket, Key=key)
         return response["Body"].read()
 
+    def iter_bytes(self, key: str, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        """Open an object and stream its body in chunks instead of buffering it."""
+        self._ensure_bucket()
+        response = self.client.get_object(Bucket=self.bucket, Key=key)
+        return response["Body"].iter_chunks(chunk_size)
+
     def delete(self, key: str) -> None:
         self._ensure_bucket()
         self.client.delete_object(Bucket=self.bucket, Key=key)
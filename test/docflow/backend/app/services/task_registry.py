@@ -0,0 +1,84 @@
+"""
+Redis registry of queued and running Celery tasks.
+
+Replaces control.inspect() broadcasts for GET /tasks/pending: tasks are
+registered when published, marked active when a worker starts them and
+removed when they finish. Entries of tasks lost with a crashed worker expire
+after REGISTRY_STALE_AFTER. Handlers are connected to Celery signals on
+import (see app/core/celery_app.py).
+"""
+import json
+import time
+
+from celery.signals import before_task_publish, task_postrun, task_prerun
+
+from app.core.redis_client import get_redis
+
+REGISTRY_KEY = "docflow:tasks:registry"
+REGISTRY_STALE_AFTER = 6 * 3600
+
+
+def _store(task_id: str, entry: dict) -> None:
+    try:
+        get_redis().hset(REGISTRY_KEY, task_id, json.dumps(entry, default=str))
+    except Exception as e:
+        print(f"[TaskRegistry] Failed to update task {task_id}: {e}")
+
+
+@before_task_publish.connect
+def _on_publish(sender=None, headers=None, routing_key=None, **kwargs):
+    headers = headers or {}
+    task_id = headers.get("id")
+    if not task_id:
+        return
+    _store(task_id, {
+        "task_id": task_id,
+        "name": sender,
+        "status": "queued",
+        "queue": routing_key,
+        "worker": None,
+        "updated_at": time.time(),
+    })
+
+
+@task_prerun.connect
+def _on_start(task_id=None, task=None, **kwargs):
+    if not task_id:
+        return
+    _store(task_id, {
+        "task_id": task_id,
+        "name": task.name if task else None,
+        "status": "active",
+        "queue": (task.request.delivery_info or {}).get("routing_key") if task else None,
+        "worker": task.request.hostname if task else None,
+        "updated_at": time.time(),
+    })
+
+
+@task_postrun.connect
+def _on_finish(task_id=None, state=None, **kwargs):
+    if not task_id or state == "RETRY":
+        # A retry publishes the task again, which re-registers it as queued.
+        return
+    try:
+        get_redis().hdel(REGISTRY_KEY, task_id)
+    except Exception as e:
+        print(f"[TaskRegistry] Failed to remove task {task_id}: {e}")
+
+
+def list_tasks(limit: int) -> tuple[list[dict], int]:
+    """Registered tasks, active first then oldest queued; prunes stale entries."""
+    redis_client = get_redis()
+    now = time.time()
+    tasks, stale = [], []
+    for task_id, raw in redis_client.hgetall(REGISTRY_KEY).items():
+        entry = json.loads(raw)
+        if now - entry.get("updated_at", 0) > REGISTRY_STALE_AFTER:
+            stale.append(task_id)
+            continue
+        tasks.append(entry)
+    if stale:
+        redis_client.hdel(REGISTRY_KEY, *stale)
+
+    tasks.sort(key=lambda t: (t["status"] != "active", t.get("updated_at", 0)))
+    return tasks[:limit], len(tasks)
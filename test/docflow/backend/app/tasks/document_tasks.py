@@ -2,23 +2,79 @@
 Celery tasks for document processing
 """
 import os
-import shutil
-from pathlib import Path
+import time
 from uuid import UUID
 from typing import Optional
 
-from app.core.celery_app import celery_app
+from celery import chord
+from celery.exceptions import SoftTimeLimitExceeded
+
+from app.core.celery_app import celery_app, PRIORITY_BULK
+from app.core.config import settings
 from app.core.database import SessionLocal
-from app.services import ocr_service
-from app.services.semantic_index_service import semantic_index_service
+from app.services import document_pipeline, progress
+from app.services.checkpoints import DocumentCheckpoints, file_sha256
 from app.services.storage_service import storage_service
 from app.crud import processing_run as run_crud
 from app.crud import document_type as document_type_crud
-from app.models.processed_document import DocumentStatus
-from app.models.processing_run import ProcessingStatus
 
 
-@celery_app.task(bind=True, max_retries=3)
+def _ensure_local_file(file_path: Optional[str], temp_filepath: str) -> None:
+    """Restore the upload from storage when a retry runs after the temp file was removed."""
+    if os.path.exists(temp_filepath):
+        return
+    if not file_path:
+        raise FileNotFoundError(temp_filepath)
+    os.makedirs(os.path.dirname(temp_filepath) or ".", exist_ok=True)
+    with open(temp_filepath, "wb") as f:
+        f.write(storage_service.read_bytes(file_path))
+
+
+def _retry_or_fail(task, db, job: dict, stage: str, exc: Exception, countdown: int):
+    """Retry the stage task; mark the document as failed only once retries are exhausted."""
+    if task.request.retries < task.max_retries:
+        raise task.retry(exc=exc, countdown=countdown * (task.request.retries + 1))
+    document_pipeline.mark_failed(db, job, stage, str(exc))
+    raise exc
+
+
+def _dispatch_ocr(job: dict, ocr_sources: list[list]) -> dict:
+    """Run the OCR stage for pages without a checkpoint, then continue with extraction."""
+    checkpoints = DocumentCheckpoints(job["content_hash"])
+    missing = [[i, key] for i, key in ocr_sources if not checkpoints.has_page(i)]
+    if not missing:
+        extract_document_task.delay([], job)
+        return {"success": True, "document_id": job["document_id"], "pages_queued": 0}
+
+    # Large documents: one task per page on any free worker; otherwise one task for all.
+    if len(missing) >= settings.OCR_PAGE_FANOUT_MIN_PAGES:
+        chunks = [[page] for page in missing]
+    else:
+        chunks = [missing]
+
+    target = {
+        "processing_run_id": job["processing_run_id"],
+        "document_id": job["document_id"],
+        "pages_total": len(ocr_sources),
+    }
+    header = [
+        ocr_pages_task.s(job["content_hash"], chunk, target).set(
+            soft_time_limit=settings.OCR_PAGE_TIME_LIMIT * len(chunk),
+            time_limit=settings.OCR_PAGE_TIME_LIMIT * len(chunk) + 60,
+        )
+        for chunk in chunks
+    ]
+    callback = extract_document_task.s(job).on_error(document_failed_task.s(job=job))
+    chord(header)(callback)
+    return {"success": True, "document_id": job["document_id"], "pages_queued": len(missing)}
+
+
+@celery_app.task(
+    bind=True,
+    max_retries=3,
+    soft_time_limit=settings.PIPELINE_CONVERT_TIME_LIMIT,
+    time_limit=settings.PIPELINE_CONVERT_TIME_LIMIT + 60,
+)
 def process_document_task(
     self,
     document_id: str,
@@ -31,124 +87,181 @@ def process_document_task(
     fields_to_extract: list[str],
     user_id: str,
 ):
+    """
+    Entry point of the document pipeline (convert stage).
+
+    Stages: convert → OCR (ocr_pages_task, fanned out per page for large
+    documents) → extract → persist → index. Every stage checkpoints its output
+    under the file's content hash, so retries resume where they stopped.
+    """
     db = SessionLocal()
+    doc_uuid = UUID(document_id)
+    job = {
+        "document_id": document_id,
+        "processing_run_id": processing_run_id,
+        "document_type_id": document_type_id,
+        "original_filename": original_filename,
+        "fields_to_extract": fields_to_extract,
+        "user_id": user_id,
+    }
 
     try:
-        doc_uuid = UUID(document_id)
-        run_uuid = UUID(processing_run_id)
-        doc_type_uuid = UUID(document_type_id)
-
-        document_type = document_type_crud.get_document_type(db, doc_type_uuid)
+        document_type = document_type_crud.get_document_type(db, UUID(document_type_id))
         if not document_type:
             raise ValueError(f"Document type {document_type_id} not found")
 
-        run_crud.update_document_status(db, doc_uuid, DocumentStatus.PROCESSING)
-
-        if not ocr_service.is_paddle_initialized():
-            run_crud.update_document_status(db, doc_uuid, DocumentStatus.ERROR)
-            run_crud.update_processing_run_status(db, run_uuid, ProcessingStatus.ERROR)
-            raise RuntimeError("PaddleOCR not initialized")
-
-        result = ocr_service.extract_document(temp_filepath, fields_to_extract, document_type_id=document_type_id)
-
-        try:
-            # Save preview image for PDF/Word documents
-            preview_path = None
-            page_images = result.get("pageImages", [])
-            if page_images:
-                document = run_crud.get_processed_document(db, doc_uuid)
-                if document and document.file_path:
-                    first_page = page_images[0]
-                    if os.path.exists(first_page) and not first_page.endswith('.txt'):
-                        original_stem = Path(original_filename).stem
-                        storage_prefix = document.file_path.rsplit("/", 1)[0] if "/" in document.file_path else ""
-                        preview_key = storage_service.build_key(storage_prefix, f"{original_stem}_preview.png")
-                        storage_service.save_file(first_page, preview_key, content_type="image/png")
-                        preview_path = preview_key
-        finally:
-            # Cleanup temp dir from OCR
-            temp_dir = result.get("_temp_dir")
-            if temp_dir:
-                shutil.rmtree(temp_dir, ignore_errors=True)
-
-        extracted_fields = [
-            {
-                "name": f["name"],
-                "value": f["value"],
-                "confidence": f.get("confidence", 0.0),
-                "coordinate": f.get("coordinate"),
-                "group": f.get("group"),
-                "row_index": f.get("row_index"),
-                "original_value": f["value"],
-                "is_corrected": False,
-            }
-            for f in result.get("fields", [])
-        ]
-
-        ocr_result = {
-            "raw_text": result.get("rawText", ""),
-            "raw_text_raw": result.get("rawTextRaw", ""),
-            "json_content": result.get("jsonContent", {}),
-            "preview_image": preview_path,
-        }
+        file_path = run_crud.start_document_processing(db, doc_uuid)
 
-        run_crud.update_document_extraction_results(
-            db,
-            doc_uuid,
-            ocr_result=ocr_result,
-            extracted_fields=extracted_fields,
-            status=DocumentStatus.NEEDS_REVIEW,
-        )
+        _ensure_local_file(file_path, temp_filepath)
+        job["content_hash"] = file_sha256(temp_filepath)
+        job["file_path"] = file_path
+
+        converted = document_pipeline.run_convert(job, temp_filepath)
+        job["page_indices"] = [i for i, _ in converted["ocr_sources"]]
+        job["page_image_keys"] = converted["page_images"]
+        job["extracted_text"] = converted["extracted_text"]
+
+        return _dispatch_ocr(job, converted["ocr_sources"])
 
-        raw_text = result.get("rawText", "")
-        if raw_text:
+    except Exception as exc:
+        _retry_or_fail(self, db, job, "convert", exc, countdown=60)
+
+    finally:
+        db.close()
+        if os.path.exists(temp_filepath):
             try:
-                document = run_crud.get_processed_document(db, doc_uuid)
-                semantic_index_service.add_document(
-                    document_id=doc_uuid,
-                    text=raw_text,
-                    metadata={
-                        "filename": original_filename,
-                        "document_type_id": document_type_id,
-                        "document_type_name": document_type.name,
-                        "run_id": processing_run_id,
-                        "user_id": user_id,
-                        "status": DocumentStatus.NEEDS_REVIEW.value,
-                        "created_at": document.created_at.isoformat() if document and document.created_at else "",
-                    },
-                )
-            except Exception as e:
-                print(f"Failed to index document {document_id} in semantic index: {e}")
+                os.remove(temp_filepath)
+            except Exception:
+                pass
+
+
+@celery_app.task(bind=True, max_retries=3)
+def ocr_pages_task(self, content_hash: str, pages: list[list], target: Optional[dict] = None):
+    """OCR stage: OCR [page_index, image key] pairs and checkpoint each page."""
+    try:
+        return document_pipeline.ocr_pages(content_hash, pages, target)
+    except Exception as exc:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=exc, countdown=30 * (self.request.retries + 1))
+        raise
 
-        run_crud.update_processing_run_status(db, run_uuid, ProcessingStatus.NEEDS_REVIEW)
 
+@celery_app.task(
+    bind=True,
+    max_retries=3,
+    soft_time_limit=settings.PIPELINE_EXTRACT_TIME_LIMIT,
+    time_limit=settings.PIPELINE_EXTRACT_TIME_LIMIT + 60,
+)
+def extract_document_task(self, page_results: list, job: dict):
+    """Extract stage (chord callback): merge page checkpoints and run LLM extraction."""
+    db = SessionLocal()
+    try:
+        result = document_pipeline.run_extract(job)
+        persist_document_task.delay(job)
         return {
             "success": True,
-            "document_id": document_id,
-            "fields_extracted": len(result.get("fields", [])),
+            "document_id": job["document_id"],
+            "fields_extracted": len(result["fields"]),
+            "pages": len(job["page_indices"]),
         }
+    except Exception as exc:
+        _retry_or_fail(self, db, job, "extract", exc, countdown=60)
+    finally:
+        db.close()
 
+
+@celery_app.task(bind=True, max_retries=5)
+def persist_document_task(self, job: dict):
+    """Persist stage: write results to the database, then schedule indexing."""
+    db = SessionLocal()
+    try:
+        if document_pipeline.run_persist(db, job):
+            index_document_task.delay(job)
+        return {"success": True, "document_id": job["document_id"]}
     except Exception as exc:
-        try:
-            run_crud.update_document_status(db, UUID(document_id), DocumentStatus.ERROR)
-            run_crud.update_processing_run_status(db, UUID(processing_run_id), ProcessingStatus.ERROR)
-        except Exception:
-            pass
+        _retry_or_fail(self, db, job, "persist", exc, countdown=10)
+    finally:
+        db.close()
 
+
+@celery_app.task(
+    bind=True,
+    max_retries=5,
+    soft_time_limit=settings.PIPELINE_INDEX_TIME_LIMIT,
+    time_limit=settings.PIPELINE_INDEX_TIME_LIMIT + 60,
+)
+def index_document_task(self, job: dict):
+    """Index stage: failures are recorded on the document, the run stays in review."""
+    db = SessionLocal()
+    try:
+        document_pipeline.run_index(db, job)
+        return {"success": True, "document_id": job["document_id"]}
+    except Exception as exc:
         if self.request.retries < self.max_retries:
             raise self.retry(exc=exc, countdown=60 * (self.request.retries + 1))
-        raise
+        print(f"Failed to index document {job['document_id']} in semantic index: {exc}")
+        document_pipeline.mark_index_failed(db, job, str(exc))
+        return {"success": False, "document_id": job["document_id"]}
+    finally:
+        db.close()
 
+
+@celery_app.task
+def document_failed_task(request, exc, traceback, job: dict):
+    """Chord error callback: a page failed after all of its retries."""
+    print(f"Page OCR failed for document {job['document_id']}: {exc}")
+    db = SessionLocal()
+    try:
+        document_pipeline.mark_failed(db, job, "ocr", str(exc))
     finally:
         db.close()
-        if os.path.exists(temp_filepath):
-            try:
-                os.remove(temp_filepath)
-            except Exception:
-                pass
 
 
-@celery_app.task(bind=True, max_retries=3)
+def _dispatch_batch_ocr(batch: dict) -> int:
+    """
+    OCR stage of a batch run: pages of all documents without a checkpoint are
+    packed into tasks of BATCH_OCR_PAGES_PER_TASK pages, then extraction runs
+    once for the whole batch. Identical files in the batch are OCR'd once.
+    """
+    missing: list[list] = []
+    seen: set[tuple[str, int]] = set()
+    for job in batch["jobs"]:
+        checkpoints = DocumentCheckpoints(job["content_hash"])
+        for page_index, image_key in job["ocr_sources"]:
+            page_id = (job["content_hash"], page_index)
+            if page_id in seen or checkpoints.has_page(page_index):
+                continue
+            seen.add(page_id)
+            missing.append([job["content_hash"], page_index, image_key])
+
+    extract_sig = batch_extract_task.s(batch).set(
+        soft_time_limit=settings.PIPELINE_EXTRACT_TIME_LIMIT * max(1, len(batch["jobs"])),
+        time_limit=settings.PIPELINE_EXTRACT_TIME_LIMIT * max(1, len(batch["jobs"])) + 60,
+    )
+    if not missing:
+        extract_sig.delay([])
+        return 0
+
+    size = max(1, settings.BATCH_OCR_PAGES_PER_TASK)
+    target = {"processing_run_id": batch["processing_run_id"], "pages_total": len(missing)}
+    header = [
+        ocr_page_batch_task.s(chunk, target).set(
+            soft_time_limit=settings.OCR_PAGE_TIME_LIMIT * len(chunk),
+            time_limit=settings.OCR_PAGE_TIME_LIMIT * len(chunk) + 60,
+        )
+        for chunk in (missing[i:i + size] for i in range(0, len(missing), size))
+    ]
+    chord(header)(extract_sig.on_error(batch_failed_task.s(batch=batch)))
+    return len(missing)
+
+
+def batch_time_limits(documents_count: int) -> dict:
+    """apply_async options of batch_process_documents_task: the convert limit per document."""
+    soft = settings.PIPELINE_CONVERT_TIME_LIMIT * max(1, documents_count)
+    return {"soft_time_limit": soft, "time_limit": soft + 60}
+
+
+@celery_app.task(bind=True, max_retries=3, priority=PRIORITY_BULK)
 def batch_process_documents_task(
     self,
     document_type_id: str,
@@ -156,39 +269,80 @@ def batch_process_documents_task(
     documents: list[dict],
     user_id: str,
 ):
+    """
+    Process all documents of a run as one batch (convert stage).
+
+    The document type is loaded once, pages of all documents are OCR'd in
+    shared tasks, LLM extraction runs concurrently with the few-shot context
+    loaded once, and results are written with a single bulk UPDATE
+    (batch_extract_task). Throughput of the run is returned by the last stage.
+    Documents that fail are marked ERROR without stopping the rest.
+    Conversion is serial, so the caller sets the time limits per batch size
+    (batch_time_limits).
+    """
     db = SessionLocal()
+    started_at = time.time()
 
     try:
-        doc_type_uuid = UUID(document_type_id)
-        document_type = document_type_crud.get_document_type(db, doc_type_uuid)
+        document_type = document_type_crud.get_document_type(db, UUID(document_type_id))
         if not document_type:
             raise ValueError(f"Document type {document_type_id} not found")
-
         fields_to_extract = document_type.fields or []
 
-        results = []
+        jobs = []
         for doc_info in documents:
-            task = process_document_task.delay(
-                document_id=doc_info["document_id"],
-                processing_run_id=processing_run_id,
-                document_type_id=document_type_id,
-                temp_filepath=doc_info["temp_filepath"],
-                original_filename=doc_info["original_filename"],
-                file_size=doc_info["file_size"],
-                mime_type=doc_info.get("mime_type"),
-                fields_to_extract=fields_to_extract,
-                user_id=user_id,
-            )
-            results.append({
+            job = {
                 "document_id": doc_info["document_id"],
-                "task_id": task.id,
-            })
+                "processing_run_id": processing_run_id,
+                "document_type_id": document_type_id,
+                "original_filename": doc_info["original_filename"],
+                "fields_to_extract": fields_to_extract,
+                "user_id": user_id,
+            }
+            temp_filepath = doc_info["temp_filepath"]
+            try:
+                doc_uuid = UUID(job["document_id"])
+                file_path = run_crud.start_document_processing(db, doc_uuid)
+
+                _ensure_local_file(file_path, temp_filepath)
+                job["content_hash"] = file_sha256(temp_filepath)
+                job["file_path"] = file_path
+
+                converted = document_pipeline.run_convert(job, temp_filepath)
+                job["ocr_sources"] = converted["ocr_sources"]
+                job["page_indices"] = [i for i, _ in converted["ocr_sources"]]
+                job["page_image_keys"] = converted["page_images"]
+                job["extracted_text"] = converted["extracted_text"]
+                jobs.append(job)
+            except SoftTimeLimitExceeded:
+                # Out of time for the whole batch: retried below, converted files resume from checkpoints
+                raise
+            except Exception as e:
+                print(f"Batch convert failed for {job['original_filename']}: {e}")
+                document_pipeline.mark_failed(db, job, "convert", str(e))
+            finally:
+                if os.path.exists(temp_filepath):
+                    try:
+                        os.remove(temp_filepath)
+                    except Exception:
+                        pass
+
+        batch = {
+            "processing_run_id": processing_run_id,
+            "document_type_id": document_type_id,
+            "jobs": jobs,
+            "documents_total": len(documents),
+            "started_at": started_at,
+            "convert_seconds": round(time.time() - started_at, 3),
+        }
+        pages_queued = _dispatch_batch_ocr(batch) if jobs else 0
 
         return {
             "success": True,
             "processing_run_id": processing_run_id,
-            "documents_queued": len(results),
-            "tasks": results,
+            "documents_queued": len(jobs),
+            "documents_failed": len(documents) - len(jobs),
+            "pages_queued": pages_queued,
         }
 
     except Exception as exc:
@@ -200,6 +354,100 @@ def batch_process_documents_task(
         db.close()
 
 
+@celery_app.task(bind=True, max_retries=3)
+def ocr_page_batch_task(self, items: list[list], target: Optional[dict] = None):
+    """OCR stage of a batch run: [content_hash, page_index, image key] of several documents."""
+    try:
+        return document_pipeline.ocr_page_batch(items, target)
+    except Exception as exc:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=exc, countdown=30 * (self.request.retries + 1))
+        raise
+
+
+@celery_app.task(bind=True, max_retries=3)
+def batch_extract_task(self, page_results: list, batch: dict):
+    """
+    Extract and persist stages of a batch run (chord callback): concurrent LLM
+    extraction, one bulk UPDATE, then indexing. Returns the run's throughput.
+    """
+    db = SessionLocal()
+    try:
+        extract_started = time.time()
+        errors = document_pipeline.run_batch_extract(batch["jobs"], batch["document_type_id"])
+        extract_seconds = time.time() - extract_started
+
+        for job in batch["jobs"]:
+            if job["document_id"] in errors:
+                document_pipeline.mark_failed(db, job, "extract", errors[job["document_id"]])
+        done = [job for job in batch["jobs"] if job["document_id"] not in errors]
+
+        for job in document_pipeline.run_batch_persist(db, done):
+            index_document_task.delay(job)
+
+        elapsed = max(time.time() - batch["started_at"], 1e-6)
+        pages = sum(len(job["page_indices"]) for job in done)
+        stats = {
+            "success": True,
+            "processing_run_id": batch["processing_run_id"],
+            "documents": len(done),
+            "documents_failed": batch["documents_total"] - len(done),
+            "pages": pages,
+            "pages_ocr": sum(page_results or []),
+            "convert_seconds": batch["convert_seconds"],
+            "extract_seconds": round(extract_seconds, 3),
+            "total_seconds": round(elapsed, 3),
+            "documents_per_minute": round(len(done) * 60 / elapsed, 2),
+            "pages_per_second": round(pages / elapsed, 3),
+        }
+        print(
+            f"[Batch {batch['processing_run_id']}] {stats['documents']} documents, {pages} pages "
+            f"in {stats['total_seconds']}s ({stats['documents_per_minute']} docs/min, "
+            f"{stats['pages_per_second']} pages/s), {stats['documents_failed']} failed"
+        )
+        progress.publish(batch["processing_run_id"], "run", status="done", **stats)
+        return stats
+    except Exception as exc:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=exc, countdown=60 * (self.request.retries + 1))
+        for job in batch["jobs"]:
+            document_pipeline.mark_failed(db, job, "extract", str(exc))
+        raise
+    finally:
+        db.close()
+
+
+@celery_app.task
+def batch_failed_task(request, exc, traceback, batch: dict):
+    """
+    Chord error callback of a batch run: OCR of some page failed after all
+    retries. Only documents with pages missing a checkpoint are marked failed;
+    the rest of the batch goes on to extraction.
+    """
+    print(f"Batch OCR failed for run {batch['processing_run_id']}: {exc}")
+    done, failed = [], []
+    for job in batch["jobs"]:
+        checkpoints = DocumentCheckpoints(job["content_hash"])
+        if all(checkpoints.has_page(page_index) for page_index, _ in job["ocr_sources"]):
+            done.append(job)
+        else:
+            failed.append(job)
+
+    db = SessionLocal()
+    try:
+        for job in failed:
+            document_pipeline.mark_failed(db, job, "ocr", str(exc))
+    finally:
+        db.close()
+
+    if done:
+        # documents_total is kept: OCR failures count in the run's documents_failed
+        batch_extract_task.s([], {**batch, "jobs": done}).set(
+            soft_time_limit=settings.PIPELINE_EXTRACT_TIME_LIMIT * len(done),
+            time_limit=settings.PIPELINE_EXTRACT_TIME_LIMIT * len(done) + 60,
+        ).delay()
+
+
 @celery_app.task
 def cleanup_temp_files_task(file_paths: list[str]):
     for path in file_paths:
@@ -0,0 +1,57 @@
+"""
+Celery tasks keeping the few-shot example store up to date, off the request path.
+A refresh also schedules retraining of the layout templates of the changed types.
+"""
+from typing import Optional
+from uuid import UUID
+
+from app.core.celery_app import celery_app
+from app.core.database import SessionLocal
+from app.crud import few_shot_example as example_crud
+from app.services.few_shot_store import few_shot_store
+from app.services.layout_templates import layout_templates
+
+_REFRESH_BATCH = 200
+
+
+@celery_app.task(bind=True, max_retries=3)
+def refresh_few_shot_examples_task(self, document_ids: Optional[list[str]] = None, run_id: Optional[str] = None):
+    try:
+        ids = [UUID(document_id) for document_id in document_ids or []]
+        if run_id:
+            db = SessionLocal()
+            try:
+                ids += example_crud.get_run_document_ids(db, UUID(run_id))
+            finally:
+                db.close()
+        changed_types: set[str] = set()
+        for start in range(0, len(ids), _REFRESH_BATCH):
+            changed_types.update(few_shot_store.refresh_documents(ids[start:start + _REFRESH_BATCH]))
+        # Layout templates learn from the same reviewed documents
+        layout_templates.request_training(changed_types)
+        return {"success": True, "documents": len(ids), "document_types": sorted(changed_types)}
+    except Exception as exc:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=exc, countdown=30 * (self.request.retries + 1))
+        raise
+
+
+@celery_app.task(bind=True, max_retries=3)
+def rebuild_few_shot_examples_task(self, document_type_id: str):
+    try:
+        return {"success": True, "document_types": few_shot_store.rebuild_type(document_type_id)}
+    except Exception as exc:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=exc, countdown=30 * (self.request.retries + 1))
+        raise
+
+
+def enqueue_few_shot_refresh(document_ids=None, run_id=None) -> None:
+    """Schedule a refresh of the examples; failures never affect the caller."""
+    try:
+        refresh_few_shot_examples_task.delay(
+            document_ids=[str(document_id) for document_id in document_ids or []],
+            run_id=str(run_id) if run_id else None,
+        )
+    except Exception as e:
+        print(f"Failed to enqueue few-shot refresh (documents {document_ids}, run {run_id}): {e}")
@@ -0,0 +1,15 @@
+"""
+Celery task training the layout templates of document types.
+"""
+from app.core.celery_app import celery_app
+from app.services.layout_templates import layout_templates
+
+
+@celery_app.task(bind=True, max_retries=3)
+def train_layout_template_task(self, document_type_id: str):
+    try:
+        return {"success": True, "document_type_id": document_type_id, **layout_templates.train_type(document_type_id)}
+    except Exception as exc:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=exc, countdown=60 * (self.request.retries + 1))
+        raise
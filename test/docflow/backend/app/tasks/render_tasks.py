@@ -0,0 +1,40 @@
+"""
+Celery tasks for preview rendering, kept off the extraction path.
+"""
+from uuid import UUID
+
+from app.core.celery_app import celery_app
+from app.core.database import SessionLocal
+from app.crud import processing_run as run_crud
+from app.services.highlight_service import render_preview_variants
+
+
+@celery_app.task(bind=True, max_retries=3)
+def render_document_previews_task(self, document_id: str):
+    db = SessionLocal()
+    try:
+        document = run_crud.get_processed_document(db, UUID(document_id))
+        if not document:
+            return {"success": False, "document_id": document_id}
+
+        variants = render_preview_variants(document)
+        if variants:
+            run_crud.update_document_ocr_result(db, document.id, {"preview_variants": variants})
+
+        return {"success": True, "document_id": document_id, "variants": len(variants)}
+
+    except Exception as exc:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=exc, countdown=30 * (self.request.retries + 1))
+        raise
+
+    finally:
+        db.close()
+
+
+def enqueue_preview_rendering(document_id) -> None:
+    """Schedule preview rendering; failures never affect the caller."""
+    try:
+        render_document_previews_task.delay(str(document_id))
+    except Exception as e:
+        print(f"Failed to enqueue preview rendering for document {document_id}: {e}")
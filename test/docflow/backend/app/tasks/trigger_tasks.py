@@ -6,6 +6,27 @@ from app.core.celery_app import celery_app
 
 @celery_app.task(name="scan_folder_triggers")
 def scan_folder_triggers_task():
-    """Periodic task: scan all enabled folder triggers for new files."""
+    """Periodic task: enqueue a scan for every enabled folder trigger."""
     from app.services.folder_trigger_service import scan_folder_triggers
     scan_folder_triggers()
+
+
+@celery_app.task(name="scan_folder_trigger")
+def scan_folder_trigger_task(trigger_id: str):
+    """Scan one trigger folder and dispatch processing of new files."""
+    from app.services.folder_trigger_service import scan_folder_trigger
+    scan_folder_trigger(trigger_id)
+
+
+@celery_app.task(bind=True, name="process_trigger_file")
+def process_trigger_file_task(self, trigger_file_id: str):
+    """Process a single file recorded by the folder scanner."""
+    from app.services.folder_trigger_service import process_trigger_file
+    process_trigger_file(trigger_file_id, task_id=self.request.id)
+
+
+@celery_app.task(name="trigger_file_ready")
+def trigger_file_ready_task(trigger_id: str, filename: str, size: int, mtime: float):
+    """File reported as fully written by the folder watcher."""
+    from app.services.folder_trigger_service import register_ready_file
+    register_ready_file(trigger_id, filename, size, mtime)
@@ -1,29 +1,86 @@
 #!/usr/bin/env python3
-import sys
+import argparse
 import platform
-from app.core.celery_app import celery_app
+from app.core.celery_app import (
+    celery_app,
+    QUEUE_OCR,
+    QUEUE_LLM,
+    QUEUE_INDEXING,
+    QUEUE_MAINTENANCE,
+)
 from app.core.config import settings
 
+# Worker profiles: which queues a pool consumes, with which pool type and concurrency.
+#   ocr         one process per GPU model copy
+#   llm         threads (or gevent if installed) — tasks mostly wait on HTTP
+#   indexing    embeddings and preview rendering, CPU-bound
+#   maintenance folder scans and dispatchers; can also run beat
+#   all         every queue in a single worker (development)
+PROFILES = {
+    "ocr": {
+        "queues": [QUEUE_OCR],
+        "pool": "prefork",
+        "concurrency": settings.CELERY_OCR_CONCURRENCY,
+    },
+    "llm": {
+        "queues": [QUEUE_LLM],
+        "pool": settings.CELERY_LLM_POOL,
+        "concurrency": settings.CELERY_LLM_CONCURRENCY,
+    },
+    "indexing": {
+        "queues": [QUEUE_INDEXING],
+        "pool": "prefork",
+        "concurrency": settings.CELERY_INDEXING_CONCURRENCY,
+    },
+    "maintenance": {
+        "queues": [QUEUE_MAINTENANCE],
+        "pool": "threads",
+        "concurrency": settings.CELERY_MAINTENANCE_CONCURRENCY,
+    },
+    "all": {
+        "queues": [QUEUE_OCR, QUEUE_LLM, QUEUE_INDEXING, QUEUE_MAINTENANCE],
+        "pool": "prefork",
+        "concurrency": 2,  # Run up to two tasks concurrently
+    },
+}
+
 
 def main():
+    parser = argparse.ArgumentParser(description="DocFlow Celery worker")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="all")
+    parser.add_argument("--concurrency", type=int, default=None, help="override the profile's concurrency")
+    parser.add_argument("--beat", action="store_true", help="also run the beat scheduler in this worker")
+    args = parser.parse_args()
+
+    profile = PROFILES[args.profile]
+    pool = profile["pool"]
+    concurrency = args.concurrency or profile["concurrency"]
+
+    # On Windows, use threads to allow true concurrent task execution.
+    # 'solo' always runs one task at a time regardless of concurrency.
+    if platform.system() == "Windows" and pool == "prefork":
+        pool = "threads"
+
     print("=" * 50)
     print("  DocFlow Celery Worker")
     print("=" * 50)
     print(f"  Broker: {settings.CELERY_BROKER_URL}")
     print(f"  Backend: {settings.CELERY_RESULT_BACKEND}")
+    print(f"  Profile: {args.profile} ({', '.join(profile['queues'])})")
+    print(f"  Pool: {pool} x {concurrency}")
     print("=" * 50)
     print()
 
-    # On Windows, use threads to allow true concurrent task execution.
-    # 'solo' always runs one task at a time regardless of concurrency.
-    pool = "threads" if platform.system() == "Windows" else "prefork"
-
     argv = [
         "worker",
         "--loglevel=info",
         f"--pool={pool}",
-        "--concurrency=2",  # Run up to two tasks concurrently
+        f"--concurrency={concurrency}",
+        f"--queues={','.join(profile['queues'])}",
+        f"--hostname={args.profile}@%h",
     ]
+    if args.beat:
+        argv.append("--beat")
 
     celery_app.worker_main(argv)
 
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Benchmark of map-reduce table extraction (llm_service.extract_fields on a
+document longer than the prompt budget) with a stub LLM of fixed latency.
+
+Builds a synthetic invoice of --pages pages with a --rows-row table each,
+extracts it at every --concurrency value (LLM_CHUNK_CONCURRENCY) and
+reports chunks, wall time and whether all rows came back in order:
+
+    python run_chunk_benchmark.py
+    python run_chunk_benchmark.py --latency 2 --concurrency 1 2 4 8
+"""
+import argparse
+import asyncio
+import json
+import re
+import sys
+import time
+
+from app.core.config import settings
+from app.services import context_builder
+from app.services.llm_service import llm_service
+
+TABLE_GROUPS = {"Товары": ["Наименование", "Сумма"]}
+
+
+def build_document(pages: int, rows: int) -> tuple[str, dict]:
+    blocks = [{"block_label": "text", "block_content": "Счёт-фактура № 4711 от 01.02.2026", "page_index": 0}]
+    for page in range(pages):
+        body = "".join(
+            f"<tr><td>{page * rows + r + 1}</td><td>Товар {page}-{r}</td><td>{(page * rows + r) * 10}.00</td></tr>"
+            for r in range(rows)
+        )
+        blocks.append({
+            "block_label": "table",
+            "page_index": page,
+            "block_content": f"<table><tr><td>№</td><td>Наименование</td><td>Сумма</td></tr>{body}</table>",
+        })
+    text = context_builder.PAGE_SEPARATOR.join(
+        "\n\n".join(b["block_content"] for b in blocks if b["page_index"] == page) for page in range(pages)
+    )
+    return text, {"parsing_res_list": blocks}
+
+
+def stub_llm(latency: float, calls: list):
+    async def generate(prompt: str, max_tokens: int = 500) -> str:
+        calls.append(1)
+        await asyncio.sleep(latency)
+        document = prompt.split("Document text:", 1)[1].split("Fields to extract:", 1)[0]
+        rows = []
+        for row in re.findall(r"<tr>(.*?)</tr>", document):
+            cells = re.findall(r"<td>(.*?)</td>", row)
+            if len(cells) == 3 and cells[1] != "Наименование":
+                rows.append({"Наименование": cells[1], "Сумма": cells[2]})
+        number = re.search(r"№ (\d+)", document)
+        reply = json.dumps({
+            "fields": [{"name": "Номер", "value": number.group(1) if number else "Не найдено"}],
+            "tables": [{"group": "Товары", "rows": rows}],
+        }, ensure_ascii=False)
+        # A real model stops at max_tokens
+        return reply[:max_tokens * 3]
+
+    return generate
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--rows", type=int, default=30)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds per stub LLM call")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4])
+    args = parser.parse_args()
+
+    settings.OPENROUTER_API_KEY = settings.OPENROUTER_API_KEY or "stub"
+    settings.LLM_CONTEXT_EMBEDDINGS = False
+    context_builder._record = lambda *a: None
+    text, json_content = build_document(args.pages, args.rows)
+    expected = [f"Товар {p}-{r}" for p in range(args.pages) for r in range(args.rows)]
+
+    failures = 0
+    for concurrency in args.concurrency:
+        settings.LLM_CHUNK_CONCURRENCY = concurrency
+        calls: list = []
+        llm_service._generate = stub_llm(args.latency, calls)
+        started = time.perf_counter()
+        fields = asyncio.run(llm_service.extract_fields(text, ["Номер"], json_content, TABLE_GROUPS, semantic_context=""))
+        elapsed = time.perf_counter() - started
+        names = [f for f in fields if f.get("group") == "Товары" and f["name"] == "Наименование"]
+        ok = [f["value"] for f in names] == expected and [f["row_index"] for f in names] == list(range(len(expected)))
+        failures += not ok
+        print(
+            f"concurrency {concurrency}: {len(calls)} LLM calls, {len(names)}/{len(expected)} rows, "
+            f"{'in order' if ok else 'MISMATCH'}, {elapsed:.2f}s"
+        )
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Extraction accuracy and prompt tokens of the document context, with a stub LLM.
+
+Builds synthetic Russian contracts of 1-12 pages (OCR blocks of boilerplate
+with five requisites placed at random, as "label value" or as a label block
+followed by a value block) and extracts the requisites with
+llm_service.extract_fields. The stub LLM can only read a value that is in the
+prompt, so accuracy measures whether the context kept the right blocks.
+Compared: the first 4000 characters (the old prompt), the context builder
+with the per-field budget, and the context builder with the flat budget:
+
+    python run_context_benchmark.py
+    python run_context_benchmark.py --repeat 10 --embeddings
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import sys
+
+from app.core.config import settings
+from app.services import context_builder
+from app.services import llm_service as llm_module
+from app.services.llm_service import llm_service
+
+FILLER = [
+    "Настоящий договор заключён между сторонами в соответствии с действующим законодательством Российской Федерации.",
+    "Поставщик обязуется передать товар покупателю в сроки, установленные спецификацией к договору.",
+    "Оплата производится путём перечисления денежных средств на расчётный счёт поставщика.",
+    "Стороны освобождаются от ответственности за неисполнение обязательств при форс-мажоре.",
+    "Все споры разрешаются путём переговоров, а при недостижении согласия — в арбитражном суде.",
+    "Приёмка товара по количеству и качеству осуществляется в порядке, установленном инструкциями.",
+    "Покупатель вправе отказаться от товара ненадлежащего качества с уведомлением поставщика.",
+    "Гарантийный срок на товар составляет двенадцать месяцев с даты подписания акта приёма-передачи.",
+]
+FIELDS = {
+    "ИНН поставщика": lambda rnd: str(rnd.randint(10**9, 10**10 - 1)),
+    "КПП": lambda rnd: str(rnd.randint(10**8, 10**9 - 1)),
+    "БИК банка": lambda rnd: "04" + str(rnd.randint(10**6, 10**7 - 1)),
+    "Номер договора": lambda rnd: f"Д-{rnd.randint(100, 999)}/{rnd.randint(20, 26)}",
+    "Дата договора": lambda rnd: f"{rnd.randint(1, 28):02d}.{rnd.randint(1, 12):02d}.2025",
+    "Сумма итого": lambda rnd: f"{rnd.randint(1000, 999999)},00",
+    "Расчётный счёт": lambda rnd: "40702" + str(rnd.randint(10**14, 10**15 - 1)),
+}
+PAGE_SIZES = [1, 1, 2, 2, 3, 3, 4, 5, 6, 8, 10, 12]
+BLOCKS_PER_PAGE = 14
+
+
+def make_document(rnd: random.Random, pages: int):
+    """(text, json_content, requested field names, true values) of one contract."""
+    blocks, truth = [], {}
+    names = rnd.sample(list(FIELDS), 5)
+    slots = {name: (rnd.randrange(pages), rnd.randrange(12)) for name in names}
+    for page in range(pages):
+        for i in range(BLOCKS_PER_PAGE):
+            for name, slot in slots.items():
+                if slot != (page, i):
+                    continue
+                value = FIELDS[name](rnd)
+                truth[name] = value
+                if rnd.random() < 0.5:
+                    blocks.append({"block_content": f"{name} {value}", "page_index": page})
+                else:
+                    blocks.append({"block_content": name, "page_index": page})
+                    blocks.append({"block_content": value, "page_index": page})
+            blocks.append({"block_content": " ".join(rnd.sample(FILLER, 2)), "page_index": page})
+    text = "\n\n".join(block["block_content"] for block in blocks)
+    return text, {"parsing_res_list": blocks}, names, truth
+
+
+class StubLLM:
+    """Reads "<field> <value>" from the document part of the prompt only."""
+
+    def __init__(self):
+        self.tokens = 0
+        self.values: dict[str, str] = {}
+
+    async def __call__(self, prompt: str, max_tokens: int = 500) -> str:
+        document = prompt.split("Document text:\n", 1)[1].split("\n\nFields to extract:", 1)[0]
+        fields = re.findall(r"^- (.+)$", prompt.split("Fields to extract:", 1)[1].split("Rules:", 1)[0], re.M)
+        self.tokens += context_builder.count_tokens(document)
+        out = []
+        for field in fields:
+            match = re.search(re.escape(field) + r"\s+(\S+)", document)
+            out.append({"name": field, "value": match.group(1) if match else "Не найдено", "confidence": 0.9})
+        self.values = {f["name"]: f["value"] for f in out}
+        return json.dumps({"fields": out, "tables": []}, ensure_ascii=False)
+
+
+def first_characters(text, queries, json_content=None, budget=None, purpose="extract"):
+    """The prompt text before the context builder: text[:4000]."""
+    head = text[:4000]
+    return context_builder.LLMContext(head, context_builder.count_tokens(head), context_builder.count_tokens(text), 1, 1)
+
+
+def evaluate(documents, stub: StubLLM) -> tuple[float, float]:
+    correct = total = 0
+    stub.tokens = 0
+    for text, json_content, names, truth in documents:
+        asyncio.run(llm_service.extract_fields(text, names, json_content, semantic_context=""))
+        for name in names:
+            total += 1
+            correct += stub.values.get(name) == truth[name]
+    return correct / total, stub.tokens / len(documents)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=3, help="times the 12 page sizes are generated")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--embeddings", action="store_true", help="rank with EMBEDDING_MODEL too")
+    args = parser.parse_args()
+
+    settings.OPENROUTER_API_KEY = settings.OPENROUTER_API_KEY or "stub"
+    settings.LLM_CONTEXT_EMBEDDINGS = args.embeddings
+    context_builder._record = lambda purpose, context: None
+    stub = StubLLM()
+    llm_service._generate = stub
+
+    rnd = random.Random(args.seed)
+    documents = [make_document(rnd, pages) for pages in PAGE_SIZES * args.repeat]
+    full = sum(context_builder.count_tokens(document[0]) for document in documents)
+    print(f"{len(documents)} documents, 5 fields each, {full / len(documents):.0f} document tokens/doc")
+
+    build_context = llm_module.build_context
+    results = []
+    llm_module.build_context = first_characters
+    results.append(("text[:4000]", *evaluate(documents, stub)))
+    llm_module.build_context = build_context
+    results.append(("context builder", *evaluate(documents, stub)))
+    per_field = settings.LLM_CONTEXT_TOKENS_PER_FIELD
+    settings.LLM_CONTEXT_TOKENS_PER_FIELD = 0
+    results.append((f"flat {settings.LLM_CONTEXT_TOKENS} budget", *evaluate(documents, stub)))
+    settings.LLM_CONTEXT_TOKENS_PER_FIELD = per_field
+
+    for label, accuracy, tokens in results:
+        print(f"{label:20s} accuracy {accuracy:6.1%}, {tokens:5.0f} tokens/doc sent")
+    # The builder must not be less accurate than the first characters
+    return 0 if results[1][1] >= results[0][1] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Query plan check for the hot access paths.
+
+Seeds a large synthetic data set into the configured database inside one
+transaction, runs the CRUD queries of the API hot paths, EXPLAINs every SQL
+statement they issue and fails when a plan sequentially scans one of the
+seeded tables. Everything is rolled back at the end, so it can be pointed at
+a development database:
+
+    python run_explain.py
+    python run_explain.py --runs 50000 --docs-per-run 20
+"""
+import argparse
+import json
+import sys
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.crud import few_shot_example as example_crud
+from app.crud import processing_run as run_crud
+from app.crud.pagination import next_cursor
+from app.models.processed_document import DocumentStatus
+from app.models.trigger import Trigger
+from app.models.user import User
+
+LARGE_TABLES = {"users", "processing_runs", "processed_documents", "processed_document_texts", "triggers"}
+
+
+def seed(conn, users: int, runs: int, docs_per_run: int) -> None:
+    params = {"users": users, "runs": runs, "docs": docs_per_run}
+    conn.execute(text(
+        """
+        INSERT INTO users (id, username, password_hash, password_salt, api_token, role, created_at, updated_at)
+        SELECT gen_random_uuid(), 'explain-' || g, 'x', 'x', 'explain-token-' || g, 'user', now(), now()
+        FROM generate_series(1, :users) g
+        """
+    ), params)
+    conn.execute(text(
+        """
+        INSERT INTO type_of_documents (id, user_id, name, description, fields, export_keys, created_at, updated_at)
+        SELECT gen_random_uuid(), id, 'explain-seed', '', '{}', '{}', now(), now()
+        FROM users WHERE username LIKE 'explain-%'
+        """
+    ))
+    conn.execute(text(
+        """
+        WITH t AS (
+            SELECT id, user_id, row_number() OVER () - 1 AS n
+            FROM type_of_documents WHERE name = 'explain-seed'
+        )
+        INSERT INTO processing_runs (id, document_type_id, user_id, source, status, created_at, updated_at)
+        SELECT gen_random_uuid(), t.id, t.user_id, 'manual', 'needs_review',
+               now() - make_interval(secs => g), now()
+        FROM generate_series(1, :runs) g
+        JOIN t ON t.n = g % :users
+        """
+    ), params)
+    conn.execute(text(
+        """
+        INSERT INTO processed_documents (id, processing_run_id, filename, status, ocr_result, extracted_fields,
+                                         created_at, updated_at)
+        SELECT gen_random_uuid(), r.id, 'doc-' || g || '.pdf', 'needs_review', '{}', '[]', now(), now()
+        FROM processing_runs r
+        CROSS JOIN generate_series(1, :docs) g
+        JOIN type_of_documents t ON t.id = r.document_type_id AND t.name = 'explain-seed'
+        """
+    ), params)
+    conn.execute(text(
+        """
+        INSERT INTO triggers (id, user_id, enabled, folder, created_at, updated_at)
+        SELECT gen_random_uuid(), id, random() < 0.01, '/data/in', now(), now()
+        FROM users WHERE username LIKE 'explain-%'
+        """
+    ))
+    for table in LARGE_TABLES:
+        conn.execute(text(f"ANALYZE {table}"))
+
+
+def _plan_nodes(node: dict):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _plan_nodes(child)
+
+
+def explain(conn, statement: str, parameters) -> tuple[dict, list[str]]:
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute("EXPLAIN (FORMAT JSON) " + statement, parameters)
+        plan = cursor.fetchone()[0][0]["Plan"]
+    finally:
+        cursor.close()
+    seq_scans = [
+        node["Relation Name"]
+        for node in _plan_nodes(plan)
+        if node["Node Type"] == "Seq Scan" and node.get("Relation Name") in LARGE_TABLES
+    ]
+    return plan, seq_scans
+
+
+def hot_paths(db: Session) -> list[tuple[str, callable]]:
+    user = db.query(User).filter(User.username.like("explain-%")).first()
+    run = db.execute(text(
+        "SELECT id, document_type_id FROM processing_runs WHERE user_id = :u LIMIT 1"
+    ), {"u": user.id}).first()
+    document_id = db.execute(text(
+        "SELECT id FROM processed_documents WHERE processing_run_id = :r LIMIT 1"
+    ), {"r": run.id}).scalar()
+
+    def second_page():
+        runs, _ = run_crud.get_processing_runs(db, 0, 50, user.id)
+        run_crud.get_processing_runs(db, 0, 50, user.id, cursor=next_cursor(runs, 50))
+
+    return [
+        ("auth token lookup", lambda: db.query(User).filter(User.api_token == user.api_token).first()),
+        ("runs of a user", lambda: run_crud.get_processing_runs(db, 0, 50, user.id)),
+        ("runs of a user, next page", second_page),
+        ("all runs (admin)", lambda: run_crud.get_processing_runs(db, 0, 50)),
+        ("runs by document type", lambda: run_crud.get_processing_runs_by_document_type(db, run.document_type_id, 0, 50, user.id)),
+        ("run detail", lambda: run_crud.get_processing_run_detail(db, run.id)),
+        ("document", lambda: run_crud.get_processed_document(db, document_id)),
+        ("export columns", lambda: run_crud.get_export_columns(db, [run.id])),
+        ("export chunks", lambda: list(run_crud.iter_export_documents(db, [run.id], chunk_size=3))),
+        ("few-shot examples", lambda: example_crud.get_examples(db, run.document_type_id, settings.FEW_SHOT_STORE_SIZE)),
+        ("document raw text", lambda: run_crud.get_document_raw_text(db, document_id)),
+        ("document status", lambda: run_crud.update_document_status(db, document_id, DocumentStatus.REVIEWED, commit=False)),
+        ("run status refresh", lambda: run_crud.refresh_processing_run_status(db, run.id, commit=False)),
+        ("enabled triggers", lambda: db.query(Trigger.id).filter(Trigger.enabled == True, Trigger.folder.isnot(None)).all()),
+    ]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="EXPLAIN the hot CRUD queries on a seeded database")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--runs", type=int, default=20000)
+    parser.add_argument("--docs-per-run", type=int, default=10)
+    args = parser.parse_args()
+
+    engine = create_engine(settings.DATABASE_URL)
+    failures = 0
+    with engine.connect() as conn:
+        transaction = conn.begin()
+        try:
+            print(f"Seeding {args.users} users, {args.runs} runs, {args.runs * args.docs_per_run} documents...")
+            seed(conn, args.users, args.runs, args.docs_per_run)
+
+            captured = []
+
+            @event.listens_for(conn, "before_cursor_execute")
+            def capture(conn_, cursor, statement, parameters, context, executemany):
+                if not executemany and not statement.lstrip().upper().startswith("EXPLAIN"):
+                    captured.append((statement, parameters))
+
+            # CRUD commits only release a savepoint; the seed stays invisible to others.
+            db = Session(bind=conn, join_transaction_mode="create_savepoint")
+            for name, run_query in hot_paths(db):
+                captured.clear()
+                run_query()
+                for statement, parameters in list(captured):
+                    plan, seq_scans = explain(conn, statement, parameters)
+                    status = "FAIL" if seq_scans else "ok"
+                    failures += bool(seq_scans)
+                    first_line = " ".join(statement.split())[:90]
+                    print(f"[{status}] {name}: {plan['Node Type']} cost={plan['Total Cost']:.0f}  {first_line}")
+                    if seq_scans:
+                        print(f"       Seq Scan on {', '.join(seq_scans)}")
+                        print(json.dumps(plan, indent=2)[:2000])
+            db.close()
+        finally:
+            transaction.rollback()
+
+    print()
+    print(f"{failures} statement(s) with sequential scans on large tables" if failures else "All plans use indexes")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the deterministic table fallback (ocr_service._extract_table_fields_from_html).
+
+Builds synthetic OCR text of HTML tables (header row, numbering row, data
+rows), times the extraction and checks its column mapping against a plain
+pairwise matcher that normalizes every (column, header) pair on the spot:
+
+    python run_table_benchmark.py
+    python run_table_benchmark.py --tables 200 --rows 80 --repeat 5
+"""
+import argparse
+import sys
+import time
+
+from app.services import ocr_service
+
+HEADERS = [
+    "№ п/п", "Наименование товара", "Единица измерения", "Количество", "Цена за единицу, руб.",
+    "Сумма без НДС", "Ставка НДС", "Сумма НДС", "Всего с НДС", "Страна происхождения",
+    "Код товара", "Примечание",
+]
+TABLE_GROUPS = {
+    "Товары": ["Наименование", "Количество", "Цена", "Сумма НДС", "Всего", "Код", "Страна"],
+    "НДС": ["Ставка НДС", "Сумма НДС", "Сумма без НДС"],
+}
+
+
+def build_text(tables: int, rows: int) -> str:
+    parts = []
+    for t in range(tables):
+        html = ["<tr>" + "".join(f"<th>{h}</th>" for h in HEADERS) + "</tr>"]
+        html.append("<tr>" + "".join(f"<td>{i + 1}</td>" for i in range(len(HEADERS))) + "</tr>")
+        for r in range(rows):
+            html.append("<tr>" + "".join(f"<td>v{t}_{r}_{c} &amp; x</td>" for c in range(len(HEADERS))) + "</tr>")
+        parts.append("<table>" + "".join(html) + "</table>")
+    return "\n".join(parts)
+
+
+def reference_columns(requested_columns: list[str], headers: list[str]) -> dict:
+    """Column mapping without prepared headers: every pair normalized separately."""
+    mapping = {}
+    for column in requested_columns:
+        req_norm, req_tokens = ocr_service._prepare_label(column)
+        best_idx, best_score = None, 0.0
+        for idx, header in enumerate(headers):
+            hdr_norm, hdr_tokens = ocr_service._prepare_label(header)
+            score = ocr_service._header_match_score(
+                req_norm, req_tokens, hdr_norm, hdr_tokens, len(req_tokens & hdr_tokens)
+            )
+            if score > best_score:
+                best_idx, best_score = idx, score
+        mapping[column] = best_idx if best_score >= ocr_service._MIN_HEADER_SCORE else None
+    return mapping
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--tables", type=int, default=60)
+    parser.add_argument("--rows", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    text = build_text(args.tables, args.rows)
+    timings = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        fields = ocr_service._extract_table_fields_from_html(text, TABLE_GROUPS)
+        timings.append(time.perf_counter() - started)
+
+    failures = 0
+    table = ocr_service._PreparedTable(ocr_service._parse_tables_from_html(text)[0])
+    for group, columns in TABLE_GROUPS.items():
+        requested = [(column, *ocr_service._prepare_label(column)) for column in columns]
+        expected = reference_columns(columns, table.rows[0])
+        actual = table.match_columns(requested)
+        if actual != expected:
+            failures += 1
+            print(f"[FAIL] {group}: {actual} != {expected}")
+
+    print(
+        f"{args.tables} tables x {args.rows} rows x {len(HEADERS)} columns, {len(TABLE_GROUPS)} groups: "
+        f"{len(fields)} fields, best {min(timings):.3f}s of {args.repeat}"
+    )
+    print("Column mapping matches the pairwise matcher" if not failures else f"{failures} group(s) mapped differently")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
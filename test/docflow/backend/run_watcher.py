@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+import signal
+import threading
+
+from app.core.config import settings
+from app.services.folder_watcher import FolderWatcher, enqueue_ready_file, load_trigger_folders
+from app.tasks.trigger_tasks import scan_folder_triggers_task
+
+
+def main():
+    print("=" * 50)
+    print("  DocFlow Folder Watcher")
+    print("=" * 50)
+    print(f"  Backend: {settings.TRIGGER_WATCH_BACKEND}")
+    print(f"  Broker: {settings.CELERY_BROKER_URL}")
+    print("=" * 50)
+    print()
+
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+    # Catch up on files that arrived while the watcher was down.
+    scan_folder_triggers_task.delay()
+
+    watcher = FolderWatcher(on_ready=enqueue_ready_file)
+    watcher.run(load_trigger_folders, stop)
+
+
+if __name__ == "__main__":
+    main()
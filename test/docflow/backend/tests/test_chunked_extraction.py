@@ -0,0 +1,106 @@
+"""
+Map-reduce extraction of a table longer than the prompt budget
+(split_chunks → _extract_chunked → _merge_chunk_results), with a stub LLM.
+"""
+import asyncio
+import json
+import re
+
+import pytest
+
+from app.core.config import settings
+from app.services import context_builder
+from app.services.llm_service import llm_service
+
+PAGES, ROWS = 20, 30
+TABLE_GROUPS = {"Товары": ["Наименование", "Сумма"]}
+
+
+def synthetic_document() -> tuple[str, dict]:
+    """Invoice number on the first page, a 30-row table on each of 20 pages (<td> header, as OCR emits)."""
+    blocks = [{"block_label": "text", "block_content": "Счёт-фактура № 4711 от 01.02.2026", "page_index": 0}]
+    for page in range(PAGES):
+        rows = "".join(
+            f"<tr><td>{page * ROWS + r + 1}</td><td>Товар {page}-{r}</td><td>{(page * ROWS + r) * 10}.00</td></tr>"
+            for r in range(ROWS)
+        )
+        blocks.append({
+            "block_label": "table",
+            "page_index": page,
+            "block_content": f"<table><tr><td>№</td><td>Наименование</td><td>Сумма</td></tr>{rows}</table>",
+        })
+    text = context_builder.PAGE_SEPARATOR.join(
+        "\n\n".join(b["block_content"] for b in blocks if b["page_index"] == page) for page in range(PAGES)
+    )
+    return text, {"parsing_res_list": blocks}
+
+
+class StubLLM:
+    """Answers with the table rows present in the prompt; the reply is cut at max_tokens like a real model."""
+
+    def __init__(self):
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, prompt: str, max_tokens: int = 500) -> str:
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            document = prompt.split("Document text:", 1)[1].split("Fields to extract:", 1)[0]
+            rows = []
+            for row in re.findall(r"<tr>(.*?)</tr>", document):
+                cells = re.findall(r"<td>(.*?)</td>", row)
+                if len(cells) == 3 and cells[1] != "Наименование":
+                    rows.append({"Наименование": cells[1], "Сумма": cells[2]})
+            number = re.search(r"№ (\d+)", document)
+            reply = json.dumps({
+                "fields": [{
+                    "name": "Номер",
+                    "value": number.group(1) if number else "Не найдено",
+                    "confidence": 0.9 if number else 0.0,
+                }],
+                "tables": [{"group": "Товары", "rows": rows}],
+            }, ensure_ascii=False)
+            return reply[:max_tokens * 3]
+        finally:
+            self.in_flight -= 1
+
+
+@pytest.fixture
+def stub_llm(monkeypatch):
+    monkeypatch.setattr(settings, "OPENROUTER_API_KEY", "stub")
+    monkeypatch.setattr(settings, "LLM_CONTEXT_EMBEDDINGS", False)
+    monkeypatch.setattr(settings, "LLM_CHUNK_CONCURRENCY", 4)
+    monkeypatch.setattr(context_builder, "_record", lambda *args: None)
+    stub = StubLLM()
+    monkeypatch.setattr(llm_service, "_generate", stub)
+    return stub
+
+
+def test_long_table_is_extracted_chunk_by_chunk(stub_llm):
+    text, json_content = synthetic_document()
+    fields = asyncio.run(llm_service.extract_fields(
+        text, ["Номер"], json_content, TABLE_GROUPS, semantic_context=""
+    ))
+
+    names = [f for f in fields if f.get("group") == "Товары" and f["name"] == "Наименование"]
+    sums = [f for f in fields if f.get("group") == "Товары" and f["name"] == "Сумма"]
+    assert [f["row_index"] for f in names] == list(range(PAGES * ROWS))
+    assert [f["value"] for f in names] == [f"Товар {p}-{r}" for p in range(PAGES) for r in range(ROWS)]
+    assert [f["value"] for f in sums] == [f"{i * 10}.00" for i in range(PAGES * ROWS)]
+
+    scalars = [(f["name"], f["value"]) for f in fields if not f.get("group")]
+    assert scalars == [("Номер", "4711")]
+
+    assert stub_llm.calls > 1
+    assert stub_llm.max_in_flight <= settings.LLM_CHUNK_CONCURRENCY
+
+
+def test_every_chunk_keeps_the_table_header():
+    text, json_content = synthetic_document()
+    chunks = context_builder.split_chunks(text, json_content, 800)
+    assert len(chunks) > 1
+    assert all("<td>Наименование</td>" in chunk for chunk in chunks)
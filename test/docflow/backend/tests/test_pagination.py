@@ -0,0 +1,70 @@
+"""
+Paging of the processing run lists (app/crud/pagination.py), on SQLite in memory.
+"""
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import noload, sessionmaker
+
+from app.crud.pagination import next_cursor
+from app.crud.processing_run import _page_runs
+from app.models.processing_run import ProcessingRun
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    ProcessingRun.__table__.create(engine)
+    session = sessionmaker(bind=engine)()
+    started = datetime(2024, 1, 1)
+    session.add_all(
+        ProcessingRun(
+            document_type_id=uuid.uuid4(),
+            user_id=uuid.uuid4(),
+            created_at=started + timedelta(minutes=i),
+            updated_at=started + timedelta(minutes=i),
+        )
+        for i in range(7)
+    )
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def _runs(db):
+    return db.query(ProcessingRun).options(noload("*"))
+
+
+def _newest_first(db):
+    return [run.id for run in _runs(db).order_by(ProcessingRun.created_at.desc()).all()]
+
+
+def test_skip_pages(db):
+    expected = _newest_first(db)
+    first, total = _page_runs(_runs(db), 0, 3, None)
+    second, _ = _page_runs(_runs(db), 3, 3, None)
+    last, _ = _page_runs(_runs(db), 6, 3, None)
+    assert total == 7
+    assert [run.id for run in first + second + last] == expected
+
+
+def test_cursor_pages(db):
+    expected = _newest_first(db)
+    seen, cursor = [], None
+    while True:
+        runs, total = _page_runs(_runs(db), 0, 3, cursor)
+        assert total == (None if cursor else 7)
+        seen += [run.id for run in runs]
+        cursor = next_cursor(runs, 3)
+        if not cursor:
+            break
+    assert seen == expected
+
+
+def test_cursor_ignores_skip(db):
+    first, _ = _page_runs(_runs(db), 0, 3, None)
+    runs, _ = _page_runs(_runs(db), 5, 3, next_cursor(first, 3))
+    assert [run.id for run in runs] == _newest_first(db)[3:6]
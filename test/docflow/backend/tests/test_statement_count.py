@@ -0,0 +1,129 @@
+"""
+SQL statements per processed document (convert prologue, persist and index
+stages), counted with a before_cursor_execute listener on SQLite.
+
+SQLite only executes the PostgreSQL-flavoured statements (jsonb ||, run
+counters kept by triggers); the test guards the number of round trips, not
+their results.
+"""
+import json
+import uuid
+from collections import Counter
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import app.models  # noqa: F401
+from app.core.database import Base
+from app.crud import document_type as document_type_crud
+from app.crud import processing_run as run_crud
+from app.models.document_type import DocumentType
+from app.models.processed_document import DocumentStatus
+from app.models.processing_run import ProcessingRun
+from app.services import document_pipeline
+
+DOCUMENTS = 20
+TABLES = ("users", "type_of_documents", "processing_runs", "processed_documents", "processed_document_texts")
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def _functions(dbapi_connection, record):
+        dbapi_connection.create_function("jsonb_build_object", 2, lambda key, value: json.dumps({key: value}))
+
+    Base.metadata.create_all(engine, tables=[Base.metadata.tables[name] for name in TABLES])
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def indexed(monkeypatch):
+    """
+    Stages without Redis, storage and Celery; checkpoints replaced by fixed
+    values. Returns the calls of the semantic index.
+    """
+    monkeypatch.setattr(document_pipeline, "_progress", lambda *args, **kwargs: None)
+    monkeypatch.setattr(document_pipeline, "enqueue_preview_rendering", lambda *args, **kwargs: None)
+    indexed = []
+    monkeypatch.setattr(document_pipeline.semantic_index_service, "update_document", lambda **kwargs: indexed.append(kwargs))
+    monkeypatch.setattr(document_pipeline, "_persist_values", lambda job: {
+        "id": uuid.UUID(job["document_id"]),
+        "ocr_result": {"raw_text": "Счёт № 1", "stages": {}},
+        "extracted_fields": [{"name": "Номер", "value": "1"}],
+        "status": DocumentStatus.NEEDS_REVIEW,
+    })
+    return indexed
+
+
+def test_statements_per_document(engine, indexed):
+    Session = sessionmaker(bind=engine)
+    db = Session()
+    document_type = DocumentType(name="Счёт", fields=["Номер"], user_id=uuid.uuid4())
+    db.add(document_type)
+    db.commit()
+    run = ProcessingRun(document_type_id=document_type.id, user_id=uuid.uuid4())
+    db.add(run)
+    db.commit()
+    run_id, document_type_id = run.id, document_type.id
+    document_ids = [
+        run_crud.create_processed_document(
+            db, run_id, filename=f"{i}.pdf", file_path=f"key-{i}", file_size=1, mime_type="application/pdf"
+        ).id
+        for i in range(DOCUMENTS)
+    ]
+    db.close()
+
+    statements: dict[str, Counter] = {}
+    stage = None
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        verb = statement.split()[0].upper()
+        if verb not in ("BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE"):
+            statements.setdefault(stage, Counter())[verb] += 1
+
+    for document_id in document_ids:
+        job = {
+            "document_id": str(document_id),
+            "processing_run_id": str(run_id),
+            "document_type_id": str(document_type_id),
+            "original_filename": "invoice.pdf",
+            "user_id": str(uuid.uuid4()),
+        }
+        stage = "convert"
+        db = Session()
+        document_type_crud.get_document_type(db, document_type_id)
+        run_crud.start_document_processing(db, document_id)
+        db.close()
+
+        stage = "persist"
+        db = Session()
+        document_pipeline.run_persist(db, job)
+        db.close()
+
+        stage = "index"
+        db = Session()
+        document_pipeline.run_index(db, job)
+        db.close()
+
+    per_document = {
+        name: {verb: count / DOCUMENTS for verb, count in counter.items()}
+        for name, counter in statements.items()
+    }
+    # convert: document type, status UPDATE ... RETURNING file_path
+    assert per_document["convert"] == {"SELECT": 1, "UPDATE": 1}
+    # persist: document UPDATE, OCR text upsert, run status UPDATE
+    assert per_document["persist"] == {"UPDATE": 2, "INSERT": 1}
+    # index: document with its text and type name, stage state UPDATE
+    assert per_document["index"] == {"SELECT": 1, "UPDATE": 1}
+    assert sum(sum(stage_counts.values()) for stage_counts in per_document.values()) == 7
+
+    assert len(indexed) == DOCUMENTS
+    assert indexed[0]["text"] == "Счёт № 1"
+    assert indexed[0]["metadata"]["document_type_name"] == "Счёт"
+    assert indexed[0]["metadata"]["status"] == DocumentStatus.NEEDS_REVIEW.value
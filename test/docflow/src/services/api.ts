@@ -193,6 +193,12 @@ export interface ProcessingRunResponse {
   source: 'manual' | 'trigger';
   trigger_name: string | null;
   status: 'processing' | 'needs_review' | 'reviewed' | 'error';
+  documents_total: number;
+  documents_processing: number;
+  documents_needs_review: number;
+  documents_reviewed: number;
+  documents_error: number;
+  fields_extracted: number;
   created_at: string;
   updated_at: string;
   documents: ProcessedDocumentBrief[];
@@ -205,6 +211,7 @@ export interface ExtractedField {
   coordinate: [number, number, number, number] | null;
   group?: string | null;
   row_index?: number | null;
+  page_index?: number | null;
   original_value: string | null;
   is_corrected: boolean;
 }
@@ -220,6 +227,7 @@ export interface ProcessedDocumentResponse {
   raw_text_raw: string | null;
   highlighted_image: string | null;
   preview_image: string | null;
+  page_count: number;
   fields_count: number;
   extracted_fields: ExtractedField[];
   created_at: string;
@@ -233,6 +241,12 @@ export interface ProcessingRunDetailResponse {
   source: 'manual' | 'trigger';
   trigger_name: string | null;
   status: 'processing' | 'needs_review' | 'reviewed' | 'error';
+  documents_total: number;
+  documents_processing: number;
+  documents_needs_review: number;
+  documents_reviewed: number;
+  documents_error: number;
+  fields_extracted: number;
   created_at: string;
   updated_at: string;
   documents: ProcessedDocumentResponse[];
@@ -430,8 +444,12 @@ export const processingRunApi = {
     }
     const blob = await response.blob();
     const disposition = response.headers.get('Content-Disposition') || '';
-    const filenameMatch = disposition.match(/filename="?(.+?)"?$/);
-    const filename = filenameMatch ? filenameMatch[1] : `export.${format}`;
+    // Non-ASCII names come as filename*=UTF-8''...
+    const encodedMatch = disposition.match(/filename\*=UTF-8''([^;]+)/i);
+    const filenameMatch = disposition.match(/filename="?([^";]+)"?/);
+    const filename = encodedMatch
+      ? decodeURIComponent(encodedMatch[1])
+      : filenameMatch ? filenameMatch[1] : `export.${format}`;
     const url = URL.createObjectURL(blob);
     const a = document.createElement('a');
     a.href = url;